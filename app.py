@@ -0,0 +1,141 @@
+import os
+from flask import Flask, Response, jsonify, request
+from mylib import instrumentation
+from mylib.recommender_model import RecommenderModel, default_shards
+
+
+def create_app(model=None, background=False):
+    """
+    Creates the Flask app serving title search and recommendations.
+
+    Args:
+        model (RecommenderModel, optional): The model to serve. A default model is
+            created and loaded when omitted.
+        background (bool): Load the default model in a background thread instead of
+            blocking; search is served once the movies are loaded and /ready
+            reports 503 until the ratings are too.
+
+    Setting RECOMMENDER_INSTRUMENTATION=1 (or =memory to also trace allocations)
+    records per-stage histograms, served at /metrics. Setting RECOMMENDER_SHARDS=N
+    counts uncached recommendations across N processes, see ShardedRatingsIndex.
+
+    Returns:
+        Flask: The configured app.
+    """
+    if os.environ.get("RECOMMENDER_INSTRUMENTATION"):
+        instrumentation.enable(
+            trace_memory=os.environ["RECOMMENDER_INSTRUMENTATION"] == "memory"
+        )
+    if model is None:
+        model = RecommenderModel(shards=default_shards())
+        if background:
+            model.load_async()
+        else:
+            model.load()
+
+    app = Flask(__name__)
+    app.config["MODEL"] = model
+
+    @app.get("/health")
+    def health():
+        """Liveness check, answers as soon as the process is up."""
+        return jsonify(status="ok")
+
+    @app.get("/ready")
+    def ready():
+        """Readiness check, only succeeds once the model is warm."""
+        if model.ready:
+            return jsonify(status="ready")
+        if model.error is not None:
+            return jsonify(status="failed", error=str(model.error)), 503
+        return jsonify(status="loading"), 503
+
+    @app.get("/stats")
+    def stats():
+        """Result cache hit/miss/eviction counters."""
+        return jsonify(caches=model.cache_stats())
+
+    @app.get("/metrics")
+    def metrics():
+        """Per-stage histograms and cache counters in the Prometheus text format."""
+        lines = [instrumentation.render_prometheus()]
+        for cache, counters in model.cache_stats().items():
+            for counter in ("hits", "misses", "evictions", "expirations"):
+                lines.append(
+                    f'recommender_cache_{counter}_total{{cache="{cache}"}} '
+                    f"{counters[counter]}\n"
+                )
+        return Response("".join(lines), mimetype="text/plain; version=0.0.4")
+
+    @app.get("/search")
+    def search():
+        title = request.args.get("q", "").strip()
+        if not title:
+            return jsonify(error="missing query parameter 'q'"), 400
+        if not model.search_ready:
+            return jsonify(error="model is loading"), 503
+        results = model.search(title, fuzzy=request.args.get("fuzzy") == "1")
+        return jsonify(
+            results=results[["movieId", "title", "genres", "score"]].to_dict("records")
+        )
+
+    @app.get("/autocomplete")
+    def autocomplete():
+        """As-you-type title completions, one request per keystroke."""
+        prefix = request.args.get("q", "")
+        if not prefix.strip():
+            return jsonify(error="missing query parameter 'q'"), 400
+        if not model.search_ready:
+            return jsonify(error="model is loading"), 503
+        k = request.args.get("k", "10")
+        if not k.isdigit() or int(k) < 1:
+            return jsonify(error="query parameter 'k' must be a positive integer"), 400
+        results = model.autocomplete(prefix, int(k))
+        return jsonify(
+            results=results[["movieId", "title", "score"]].to_dict("records")
+        )
+
+    def recommendation_options():
+        """Parses the k and filter query parameters, raising ValueError if invalid."""
+        options = {
+            name: request.args[name]
+            for name in ("k", "min_year", "max_year")
+            if name in request.args
+        }
+        if not all(value.isdigit() for value in options.values()):
+            raise ValueError("k, min_year and max_year must be integers")
+        options = {name: int(value) for name, value in options.items()}
+        if request.args.get("genres"):
+            options["genres"] = request.args["genres"].split(",")
+        return options
+
+    @app.get("/recommend/<int:movie_id>")
+    def recommend(movie_id):
+        if not model.ready:
+            return jsonify(error="model is loading"), 503
+        if movie_id not in model.catalog:
+            return jsonify(error=f"unknown movieId {movie_id}"), 404
+        try:
+            results = model.recommend(
+                movie_id, request.args.get("mode", "exact"), **recommendation_options()
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify(movieId=movie_id, results=results.to_dict("records"))
+
+    @app.get("/recommend/user/<int:user_id>")
+    def recommend_for_user(user_id):
+        """Recommendations from everything the user liked, excluding seen movies."""
+        if not model.ready:
+            return jsonify(error="model is loading"), 503
+        try:
+            results = model.recommend_for_user(user_id, **recommendation_options())
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify(userId=user_id, results=results.to_dict("records"))
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=8000)
@@ -0,0 +1,139 @@
+import json
+from urllib.parse import parse_qs
+from mylib.async_service import AsyncRecommender, Overloaded
+from mylib.recommender_model import RecommenderModel, default_shards
+
+
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": payload})
+
+
+def create_asgi_app(model=None, background=False, **options):
+    """
+    Creates an ASGI app serving /search, /autocomplete and /recommend through an
+    AsyncRecommender.
+
+    Concurrent identical requests share one computation, requests past their
+    deadline get a 504 and requests shed under load get a 503 with Retry-After.
+    Run it with any ASGI server, e.g. ``uvicorn --factory asgi:create_asgi_app``.
+    Setting RECOMMENDER_SHARDS=N counts uncached recommendations across N
+    processes, see ShardedRatingsIndex.
+
+    Args:
+        model (RecommenderModel, optional): The model to serve. A default model is
+            created and loaded when omitted.
+        background (bool): Load the default model in a background thread instead of
+            blocking.
+        **options: workers, max_pending and timeout of the AsyncRecommender.
+
+    Returns:
+        callable: The ASGI application.
+    """
+    if model is None:
+        model = RecommenderModel(shards=default_shards())
+        if background:
+            model.load_async()
+        else:
+            model.load()
+    service = AsyncRecommender(model, **options)
+
+    async def serve(path, query):
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/ready":
+            if model.ready:
+                return 200, {"status": "ready"}
+            if model.error is not None:
+                return 503, {"status": "failed", "error": str(model.error)}
+            return 503, {"status": "loading"}
+        if path == "/stats":
+            return 200, {"caches": model.cache_stats(), "requests": service.stats()}
+        if path == "/search":
+            title = query.get("q", [""])[0].strip()
+            if not title:
+                return 400, {"error": "missing query parameter 'q'"}
+            if not model.search_ready:
+                return 503, {"error": "model is loading"}
+            results = await service.search(
+                title, fuzzy=query.get("fuzzy", ["0"])[0] == "1"
+            )
+            return 200, {
+                "results": results[["movieId", "title", "genres", "score"]].to_dict(
+                    "records"
+                )
+            }
+        if path == "/autocomplete":
+            prefix = query.get("q", [""])[0]
+            if not prefix.strip():
+                return 400, {"error": "missing query parameter 'q'"}
+            if not model.search_ready:
+                return 503, {"error": "model is loading"}
+            k = query.get("k", ["10"])[0]
+            if not k.isdigit() or int(k) < 1:
+                return 400, {"error": "query parameter 'k' must be a positive integer"}
+            results = await service.autocomplete(prefix, int(k))
+            return 200, {
+                "results": results[["movieId", "title", "score"]].to_dict("records")
+            }
+        if path.startswith("/recommend/") and path[len("/recommend/") :].isdigit():
+            movie_id = int(path[len("/recommend/") :])
+            if not model.ready:
+                return 503, {"error": "model is loading"}
+            if movie_id not in model.catalog:
+                return 404, {"error": f"unknown movieId {movie_id}"}
+            options = {}
+            for name in ("k", "min_year", "max_year"):
+                if name in query:
+                    if not query[name][0].isdigit():
+                        return 400, {
+                            "error": f"query parameter {name!r} must be an integer"
+                        }
+                    options[name] = int(query[name][0])
+            if query.get("genres", [""])[0]:
+                options["genres"] = query["genres"][0].split(",")
+            try:
+                results = await service.recommend(
+                    movie_id, mode=query.get("mode", ["exact"])[0], **options
+                )
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            return 200, {"movieId": movie_id, "results": results.to_dict("records")}
+        return 404, {"error": "not found"}
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            service.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        if scope["method"] != "GET":
+            await _send_json(send, 405, {"error": "method not allowed"})
+            return
+        query = parse_qs(scope.get("query_string", b"").decode())
+        try:
+            status, body = await serve(scope["path"], query)
+        except Overloaded:
+            await _send_json(
+                send, 503, {"error": "overloaded"}, [(b"retry-after", b"1")]
+            )
+            return
+        except TimeoutError:
+            await _send_json(send, 504, {"error": "deadline exceeded"})
+            return
+        await _send_json(send, status, body)
+
+    app.service = service
+    return app
@@ -0,0 +1,297 @@
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_dataset  # noqa: E402
+from mylib.data_cache import (  # noqa: E402
+    load_movies,
+    load_ratings_index,
+    load_vectorizer,
+)
+from mylib.movie_utils import (  # noqa: E402
+    initialize_vectorizer,
+    load_and_clean_data,
+    search_movies,
+)
+from mylib.recommender_model import RecommenderModel  # noqa: E402
+from mylib.recommender_utils import add_popularity, find_similar_movies  # noqa: E402
+from mylib.title_index import TitleIndex  # noqa: E402
+
+# Bump when metrics are added, renamed or measured differently
+SCHEMA_VERSION = 3
+# Similar users sampled by the bounded-cost recommendation benchmark
+SAMPLED_USERS = 500
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+def _time_calls(function, arguments):
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return _percentiles(samples)
+
+
+def _start_model(movies_path, ratings_path):
+    """Loads everything the service needs, the way RecommenderModel.load does."""
+    movies = load_movies(movies_path)
+    ratings = load_ratings_index(ratings_path)
+    movies = add_popularity(movies, ratings)
+    vectorizer, tfidf = load_vectorizer(movies_path, movies)
+    return movies, ratings, vectorizer, TitleIndex(tfidf)
+
+
+def _measure_start(movies_path, ratings_path, command="start"):
+    """Measures start-up in a fresh interpreter so time and peak RSS are isolated."""
+    begin = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), command, movies_path, ratings_path],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    measured = json.loads(output.strip().splitlines()[-1])
+    measured["process_seconds"] = time.perf_counter() - begin
+    return measured
+
+
+def _top10_miss_rate(ratings, seeds, max_similar_users):
+    """Mean share of the exact top 10 missing from the sampled top 10."""
+    misses = []
+    for movie_id in seeds:
+        exact = ratings.score_movie(movie_id)[0][:10]
+        if len(exact):
+            sampled = ratings.score_movie(
+                movie_id, max_similar_users=max_similar_users
+            )[0][:10]
+            misses.append(1 - len(np.intersect1d(exact, sampled)) / len(exact))
+    return float(np.mean(misses)) if misses else 0.0
+
+
+def run_suite(movies_path, ratings_path, queries=500, seed=0):
+    """
+    Runs every benchmark against a dataset.
+
+    Args:
+        movies_path (str): Path to movies.csv.
+        ratings_path (str): Path to ratings.csv.
+        queries (int): Number of timed calls per hot-path function.
+        seed (int): Seed for choosing queries.
+
+    Returns:
+        dict: The measured metrics.
+    """
+    shutil.rmtree(
+        os.path.join(os.path.dirname(ratings_path), ".cache"), ignore_errors=True
+    )
+    cold = _measure_start(movies_path, ratings_path)
+    warm = _measure_start(movies_path, ratings_path)
+    first_search = _measure_start(movies_path, ratings_path, "first-search")
+
+    start = time.perf_counter()
+    raw_movies = load_and_clean_data(movies_path)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    initialize_vectorizer(raw_movies)
+    fit_seconds = time.perf_counter() - start
+
+    movies, ratings, vectorizer, tfidf = _start_model(movies_path, ratings_path)
+    rng = np.random.default_rng(seed)
+    # Queries are title prefixes, seeds are drawn in proportion to popularity
+    titles = movies["title"].to_numpy()[rng.integers(0, len(movies), queries)]
+    title_queries = [title[: max(3, len(title) // 2)] for title in titles]
+    popularity = ratings.movie_counts / ratings.movie_counts.sum()
+    seeds = rng.choice(ratings.movie_ids, queries, p=popularity)
+
+    return {
+        "cold_start_s": cold["seconds"],
+        "cold_start_process_s": cold["process_seconds"],
+        "cold_start_peak_rss_mb": cold["peak_rss_mb"],
+        "warm_start_s": warm["seconds"],
+        "warm_start_process_s": warm["process_seconds"],
+        "warm_start_peak_rss_mb": warm["peak_rss_mb"],
+        "first_search_s": first_search["seconds"],
+        "first_search_process_s": first_search["process_seconds"],
+        "first_search_ready_s": first_search["ready_seconds"],
+        "load_and_clean_data_s": load_seconds,
+        "initialize_vectorizer_s": fit_seconds,
+        "search_movies": _time_calls(
+            lambda title: search_movies(title, movies, vectorizer, tfidf),
+            title_queries,
+        ),
+        "find_similar_movies": _time_calls(
+            lambda movie_id: find_similar_movies(movie_id, ratings, movies), seeds
+        ),
+        "find_similar_movies_sampled": _time_calls(
+            lambda movie_id: find_similar_movies(
+                movie_id, ratings, movies, max_similar_users=SAMPLED_USERS
+            ),
+            seeds,
+        ),
+        "sampled_top10_miss_rate": _top10_miss_rate(
+            ratings, seeds[:100], SAMPLED_USERS
+        ),
+    }
+
+
+def _flatten(metrics, prefix=""):
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results against a baseline, lower values being better for every metric.
+
+    Args:
+        results (dict): Output of the current run.
+        baseline (dict): Output of a previous run.
+        threshold (float): Allowed relative slowdown, e.g. 0.25 for 25%.
+
+    Returns:
+        list: (metric, baseline value, current value) for every regression.
+
+    Raises:
+        ValueError: If the runs differ in schema or config, e.g. the dataset size,
+            seed or number of queries, so their metrics are not comparable.
+    """
+    for field in ("schema", "config"):
+        if results.get(field) != baseline.get(field):
+            raise ValueError(
+                f"The baseline was recorded with {field} {baseline.get(field)!r}, "
+                f"this run with {results.get(field)!r}"
+            )
+    current = _flatten(results["metrics"])
+    previous = _flatten(baseline["metrics"])
+    return [
+        (name, previous[name], value)
+        for name, value in sorted(current.items())
+        if name in previous and value > previous[name] * (1 + threshold)
+    ]
+
+
+@click.group()
+def cli():
+    """Benchmarks for loading, search and recommendation hot paths."""
+
+
+@cli.command()
+@click.argument("movies_path")
+@click.argument("ratings_path")
+def start(movies_path, ratings_path):
+    """Time a full model start (run in a fresh process by the suite)."""
+    begin = time.perf_counter()
+    _start_model(movies_path, ratings_path)
+    seconds = time.perf_counter() - begin
+    click.echo(json.dumps({"seconds": seconds, "peak_rss_mb": _peak_rss_mb()}))
+
+
+@cli.command("first-search")
+@click.argument("movies_path")
+@click.argument("ratings_path")
+def first_search(movies_path, ratings_path):
+    """Time the first search of a staged model start, which loads the ratings last."""
+    begin = time.perf_counter()
+    model = RecommenderModel(movies_path, ratings_path, None, None)
+    model.load_async()
+    model.search("the")
+    seconds = time.perf_counter() - begin
+    model.wait()
+    click.echo(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "ready_seconds": time.perf_counter() - begin,
+                "peak_rss_mb": _peak_rss_mb(),
+            }
+        )
+    )
+
+
+@cli.command()
+@click.option("--ratings", "n_ratings", default=100_000, show_default=True)
+@click.option("--movies", "n_movies", type=int, default=None)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--data-dir", default="./benchmarks/data", show_default=True)
+@click.option("--queries", default=500, show_default=True)
+@click.option("--output", default=None, help="Write the JSON results to this file.")
+@click.option("--baseline", default=None, help="JSON results to compare against.")
+@click.option("--threshold", default=0.25, show_default=True)
+def run(n_ratings, n_movies, seed, data_dir, queries, output, baseline, threshold):
+    """Generate a synthetic dataset (reused if present) and run the suite."""
+    data_dir = os.path.join(data_dir, f"{n_ratings}-{n_movies or 'auto'}-{seed}")
+    movies_path = os.path.join(data_dir, "movies.csv")
+    ratings_path = os.path.join(data_dir, "ratings.csv")
+    if not os.path.exists(ratings_path):
+        write_dataset(data_dir, n_ratings, n_movies, seed)
+
+    results = {
+        "schema": SCHEMA_VERSION,
+        "config": {
+            "ratings": n_ratings,
+            "movies": n_movies,
+            "seed": seed,
+            "queries": queries,
+        },
+        "machine": {"python": platform.python_version(), "cpus": os.cpu_count()},
+        "metrics": run_suite(movies_path, ratings_path, queries, seed),
+    }
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    click.echo(report)
+
+    if baseline and not os.path.exists(baseline):
+        # Baselines are machine specific and not committed
+        click.echo(
+            f"No baseline at {baseline}, skipping the comparison; "
+            "record one with `make bench-baseline`",
+            err=True,
+        )
+    elif baseline:
+        with open(baseline, encoding="utf-8") as f:
+            previous = json.load(f)
+        try:
+            regressions = compare(results, previous, threshold)
+        except ValueError as e:
+            raise click.ClickException(
+                f"Cannot compare with {baseline}: {e}. Record a matching baseline "
+                "with `make bench-baseline`"
+            ) from e
+        for name, previous, value in regressions:
+            click.echo(f"REGRESSION {name}: {previous:.4g} -> {value:.4g}", err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
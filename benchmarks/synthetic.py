@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Genres used by MovieLens, combined pipe-separated in the genres column
+GENRES = [
+    "Action",
+    "Adventure",
+    "Animation",
+    "Children",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Fantasy",
+    "Film-Noir",
+    "Horror",
+    "Musical",
+    "Mystery",
+    "Romance",
+    "Sci-Fi",
+    "Thriller",
+    "War",
+    "Western",
+]
+
+# Rating values and their approximate frequencies in MovieLens
+RATING_VALUES = np.array([0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0])
+RATING_WEIGHTS = np.array([1.5, 3.0, 1.5, 6.5, 5.0, 19.5, 13.0, 26.5, 9.0, 14.5])
+
+
+def _make_words(rng, n_words):
+    """Generates deterministic pseudo-words for titles."""
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    lengths = rng.integers(2, 9, n_words)
+    return np.array(["".join(rng.choice(letters, length)) for length in lengths])
+
+
+def generate_movies(n_movies, seed=0):
+    """
+    Generates a MovieLens-like movies table.
+
+    Movie IDs are sparse like the real ones, titles are 1-5 pseudo-words followed
+    by a release year, and every movie has 1-3 genres.
+
+    Args:
+        n_movies (int): Number of movies.
+        seed (int): Random seed, the same seed always gives the same table.
+
+    Returns:
+        DataFrame: Movies with 'movieId', 'title' and 'genres' columns.
+    """
+    rng = np.random.default_rng(seed)
+    words = _make_words(rng, max(100, n_movies // 4))
+    movie_ids = np.sort(rng.choice(n_movies * 4, n_movies, replace=False)) + 1
+    years = rng.integers(1920, 2024, n_movies)
+    n_words = rng.integers(1, 6, n_movies)
+    titles = [
+        " ".join(rng.choice(words, count)).title() + f" ({year})"
+        for count, year in zip(n_words, years)
+    ]
+    genres = [
+        "|".join(rng.choice(GENRES, count, replace=False))
+        for count in rng.integers(1, 4, n_movies)
+    ]
+    return pd.DataFrame({"movieId": movie_ids, "title": titles, "genres": genres})
+
+
+def generate_ratings(
+    movie_ids, n_ratings, n_users=None, zipf_exponent=1.0, seed=0, chunk_size=1_000_000
+):
+    """
+    Generates MovieLens-like ratings in chunks.
+
+    Movie popularity follows a Zipf distribution over a random ranking of the movies,
+    and user activity follows a milder one, so a few titles and users dominate.
+
+    Args:
+        movie_ids (array-like): Movie IDs to rate.
+        n_ratings (int): Total number of ratings.
+        n_users (int, optional): Number of users, defaults to one per 150 ratings.
+        zipf_exponent (float): Exponent of the movie popularity distribution.
+        seed (int): Random seed, the same arguments always give the same ratings.
+        chunk_size (int): Number of ratings per yielded chunk.
+
+    Yields:
+        DataFrame: Chunks with 'userId', 'movieId', 'rating' and 'timestamp' columns.
+    """
+    rng = np.random.default_rng(seed)
+    movie_ids = rng.permutation(np.asarray(movie_ids))
+    n_users = n_users or max(1, n_ratings // 150)
+    movie_p = 1.0 / np.arange(1, len(movie_ids) + 1) ** zipf_exponent
+    user_p = 1.0 / np.arange(1, n_users + 1) ** 0.5
+    movie_p, user_p = movie_p / movie_p.sum(), user_p / user_p.sum()
+    rating_p = RATING_WEIGHTS / RATING_WEIGHTS.sum()
+    for start in range(0, n_ratings, chunk_size):
+        size = min(chunk_size, n_ratings - start)
+        yield pd.DataFrame(
+            {
+                "userId": rng.choice(n_users, size, p=user_p).astype(np.int32) + 1,
+                "movieId": rng.choice(movie_ids, size, p=movie_p).astype(np.int32),
+                "rating": rng.choice(RATING_VALUES, size, p=rating_p),
+                "timestamp": rng.integers(789652009, 1700000000, size),
+            }
+        )
+
+
+def write_dataset(directory, n_ratings, n_movies=None, seed=0):
+    """
+    Writes a synthetic movies.csv and ratings.csv pair.
+
+    Args:
+        directory (str): Output directory.
+        n_ratings (int): Number of ratings.
+        n_movies (int, optional): Number of movies, defaults to one per 400 ratings
+            (bounded to 1,000-62,000 like the MovieLens releases).
+        seed (int): Random seed.
+
+    Returns:
+        str, str: Paths of the movies and ratings files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    n_movies = n_movies or int(np.clip(n_ratings // 400, 1000, 62000))
+    movies = generate_movies(n_movies, seed)
+    movies_path = os.path.join(directory, "movies.csv")
+    ratings_path = os.path.join(directory, "ratings.csv")
+    movies.to_csv(movies_path, index=False)
+    for i, chunk in enumerate(
+        generate_ratings(movies["movieId"], n_ratings, seed=seed)
+    ):
+        chunk.to_csv(
+            ratings_path, mode="w" if i == 0 else "a", header=i == 0, index=False
+        )
+    return movies_path, ratings_path
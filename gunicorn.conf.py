@@ -0,0 +1,10 @@
+# Gunicorn settings for serving app:create_app()
+import multiprocessing
+
+bind = "0.0.0.0:8000"
+
+# Load the model once in the master so the forked workers share it copy-on-write
+preload_app = True
+
+workers = multiprocessing.cpu_count()
+threads = 4
@@ -1,5 +1,4 @@
-from mylib.movie_utils import load_and_clean_data, initialize_vectorizer, search_movies
-from mylib.recommender_utils import find_similar_movies
+from mylib.recommender_model import RecommenderModel
 import pandas as pd
 
 
@@ -8,26 +7,10 @@ def main():
     MOVIES_FILEPATH = "./data/movies.csv"
     RATINGS_FILEPATH = "./data/ratings.csv"
 
-    try:
-        # Load and clean the movie and ratings data
-        movies = load_and_clean_data(MOVIES_FILEPATH)
-        ratings = pd.read_csv(RATINGS_FILEPATH)
-    except FileNotFoundError as e:
-        print(f"File not found: {e}")
-        return
-    except pd.errors.ParserError as e:
-        print(f"Error parsing CSV file: {e}")
-        return
-
-    # Initialize vectorizer and TF-IDF matrix
-    try:
-        vectorizer, tfidf = initialize_vectorizer(movies)
-    except ValueError as e:
-        print(f"Value error initializing vectorizer: {e}")
-        return
-    except TypeError as e:
-        print(f"Type error initializing vectorizer: {e}")
-        return
+    # Load the data in the background: search is usable once the movies are
+    # loaded, while the ratings keep loading until the first recommendation
+    model = RecommenderModel(MOVIES_FILEPATH, RATINGS_FILEPATH)
+    model.load_async()
 
     print("Welcome to the Movie Recommendation System!")
     print("Type a movie title to search for recommendations or 'exit' to quit.")
@@ -43,9 +26,16 @@ def main():
 
         # Ensure input is long enough for meaningful search
         if len(title) > 2:
-            # Perform content-based search
+            # Perform content-based search, with trigrams so misspelled titles
+            # still seed the right movie
             try:
-                search_results = search_movies(title, movies, vectorizer, tfidf)
+                search_results = model.search(title, fuzzy=True)
+            except FileNotFoundError as e:
+                print(f"File not found: {e}")
+                return
+            except pd.errors.ParserError as e:
+                print(f"Error parsing CSV file: {e}")
+                return
             except ValueError as e:
                 print(f"Value error during content-based search: {e}")
                 continue
@@ -58,7 +48,7 @@ def main():
                 continue
 
             print("\nContent-Based Search Results:")
-            print(search_results[["title"]].to_string(index=False))
+            print(search_results[["title", "score"]].to_string(index=False))
 
             # Get the first search result's movie ID for collaborative filtering
             movie_id = search_results.iloc[0]["movieId"]
@@ -66,14 +56,20 @@ def main():
                 f"\nFinding collaborative recommendations based on '{search_results.iloc[0]['title']}'...\n"
             )
 
-            # Perform collaborative filtering
+            # Perform collaborative filtering, waiting for the ratings if needed
             try:
-                recommendations = find_similar_movies(movie_id, ratings, movies)
+                recommendations = model.recommend(movie_id)
                 if not recommendations.empty:
                     print("Collaborative Filtering Recommendations:")
                     print(recommendations.to_string(index=False))
                 else:
                     print("No collaborative recommendations found.")
+            except FileNotFoundError as e:
+                print(f"File not found: {e}")
+                return
+            except pd.errors.ParserError as e:
+                print(f"Error parsing CSV file: {e}")
+                return
             except KeyError as e:
                 print(f"Key error during collaborative filtering: {e}")
             except ValueError as e:
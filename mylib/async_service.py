@@ -0,0 +1,165 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from mylib.movie_utils import clean_title
+
+
+class Overloaded(Exception):
+    """Raised when too many distinct computations are already in flight."""
+
+
+class AsyncRecommender:
+    """
+    Asyncio front end that runs a RecommenderModel's CPU work in a thread pool.
+
+    Identical concurrent requests are coalesced: callers asking for the same movie
+    ID, or for titles that clean to the same query, await one shared computation
+    (single-flight). Each caller waits at most its own deadline; a caller timing
+    out does not cancel the computation, whose result still lands in the model's
+    caches for later requests. New computations are refused with Overloaded once
+    max_pending of them are running or queued, so bursts are shed instead of
+    piling up behind the executor.
+    """
+
+    def __init__(self, model, workers=None, max_pending=64, timeout=5.0):
+        """
+        Args:
+            model (RecommenderModel): The loaded model to serve.
+            workers (int, optional): Number of executor threads, defaults to all cores.
+            max_pending (int): Maximum number of distinct computations in flight.
+            timeout (float, optional): Default per-request deadline in seconds.
+        """
+        self.model = model
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self._inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    @property
+    def pending(self):
+        """Number of distinct computations running or queued."""
+        return len(self._inflight)
+
+    async def _single_flight(self, key, function, argument, timeout):
+        self.requests += 1
+        future = self._inflight.get(key)
+        if future is None:
+            if len(self._inflight) >= self.max_pending:
+                self.shed += 1
+                raise Overloaded(f"{len(self._inflight)} computations in flight")
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, function, argument
+            )
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        try:
+            # Shielded, so a caller's deadline never cancels the shared computation
+            return await asyncio.wait_for(
+                asyncio.shield(future), self.timeout if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def _finish(self, key, future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # Marks errors of abandoned computations as retrieved
+
+    async def recommend(self, movie_id, timeout=None, mode="exact", **options):
+        """
+        Recommends movies for a movie ID, see RecommenderModel.recommend.
+
+        Args:
+            movie_id (int): The movie ID.
+            timeout (float, optional): Deadline in seconds, defaults to self.timeout.
+            mode (str): Recommendation mode, see find_similar_movies.
+            **options: Scoring knobs, k and filters of find_similar_movies.
+
+        Returns:
+            DataFrame: The top recommended movies.
+
+        Raises:
+            Overloaded: If the request would start a computation beyond max_pending.
+            TimeoutError: If the result is not ready within the deadline.
+        """
+        movie_id = int(movie_id)
+        if "genres" in options:
+            options["genres"] = tuple(sorted(options["genres"]))
+        return await self._single_flight(
+            ("recommend", mode, movie_id, *sorted(options.items())),
+            lambda movie_id: self.model.recommend(movie_id, mode, **options),
+            movie_id,
+            timeout,
+        )
+
+    async def search(self, title, timeout=None, fuzzy=False):
+        """
+        Searches movie titles, see RecommenderModel.search.
+
+        Args:
+            title (str): The title to search for.
+            timeout (float, optional): Deadline in seconds, defaults to self.timeout.
+            fuzzy (bool): Also match misspelled and truncated words.
+
+        Returns:
+            DataFrame: The most similar movies.
+
+        Raises:
+            Overloaded: If the request would start a computation beyond max_pending.
+            TimeoutError: If the result is not ready within the deadline.
+        """
+        return await self._single_flight(
+            ("search", clean_title(title), fuzzy),
+            lambda title: self.model.search(title, fuzzy),
+            title,
+            timeout,
+        )
+
+    async def autocomplete(self, prefix, k=10, timeout=None):
+        """
+        Completes a partially typed title, see RecommenderModel.autocomplete.
+
+        Args:
+            prefix (str): The typed text.
+            k (int): Maximum number of completions.
+            timeout (float, optional): Deadline in seconds, defaults to self.timeout.
+
+        Returns:
+            DataFrame: The completed movies.
+
+        Raises:
+            Overloaded: If the request would start a computation beyond max_pending.
+            TimeoutError: If the result is not ready within the deadline.
+        """
+        return await self._single_flight(
+            ("autocomplete", clean_title(prefix), k),
+            lambda prefix: self.model.autocomplete(prefix, k),
+            prefix,
+            timeout,
+        )
+
+    def stats(self):
+        """
+        Returns the request counters.
+
+        Returns:
+            dict: Requests, coalesced requests, shed requests, timeouts and pending.
+        """
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "pending": self.pending,
+        }
+
+    def close(self):
+        """Shuts the executor down without waiting for running computations."""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,329 @@
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import time
+import click
+from mylib.recommender_model import (
+    MOVIES_FILEPATH,
+    RATINGS_FILEPATH,
+    TABLE_FILEPATH,
+    EMBEDDINGS_FILEPATH,
+    RecommenderModel,
+    default_shards,
+)
+from mylib.parallel_index import ShardedRatingsIndex
+
+# Model used by the pool workers, inherited from the parent when it forks
+_MODEL = None
+
+# What each kind of batch job reads from its input lines, and the record key
+KINDS = {"recommend": "movieId", "users": "userId", "search": "query"}
+
+# Names of the files written by the Parquet writer, with the batch number
+PART_PATTERN = re.compile(r"part-(\d{5})\.parquet")
+
+
+def _process_item(kind, item, options):
+    """Answers one input line as a JSON-serializable record."""
+    key = KINDS[kind]
+    if kind == "search":
+        try:
+            results = _MODEL.search(item, fuzzy=options.get("fuzzy", False))
+        except ValueError as e:
+            return {key: item, "error": str(e)}
+        results = results[["movieId", "title", "genres", "score"]]
+        return {key: item, "results": results.to_dict("records")}
+    try:
+        item = int(item)
+    except ValueError:
+        return {key: item, "error": f"invalid {key} {item!r}"}
+    knobs = {name: value for name, value in options.items() if name != "fuzzy"}
+    try:
+        if kind == "users":
+            results = _MODEL.recommend_for_user(item, **knobs)
+        elif item not in _MODEL.catalog:
+            return {key: item, "error": f"unknown movieId {item}"}
+        else:
+            results = _MODEL.recommend(item, **knobs)
+    except ValueError as e:
+        return {key: item, "error": str(e)}
+    return {key: item, "results": results.to_dict("records")}
+
+
+def _process_batch(args):
+    """Answers a batch of input lines, in order."""
+    kind, items, options = args
+    return [_process_item(kind, item, options) for item in items]
+
+
+def read_items(lines, skip=0):
+    """
+    Reads the non-blank input lines, stripped.
+
+    Args:
+        lines (iterable of str): The input file or stdin.
+        skip (int): Number of items already processed, which are not returned.
+
+    Returns:
+        iterator of str: The remaining items.
+    """
+    items = (line.strip() for line in lines)
+    return itertools.islice((item for item in items if item), skip, None)
+
+
+class _JsonlWriter:
+    """Appends one JSON record per line to a single file."""
+
+    def __init__(self, path, position):
+        self.file = open(path, "a+b")
+        # Drops whatever a killed run wrote after its last checkpoint
+        self.file.truncate(position)
+        self.file.seek(position)
+
+    def write(self, records):
+        self.file.write(
+            b"".join(json.dumps(record).encode() + b"\n" for record in records)
+        )
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def _parquet_rows(records):
+    """
+    Flattens records into one row per result with its rank, and one row with the
+    error and a null rank per error record, so both formats report every item.
+    """
+    rows = []
+    for record in records:
+        key, item = next(iter(record.items()))
+        if key != KINDS["search"] and not isinstance(item, int):
+            # An unparsable ID, named by the error, would mix strings into the IDs
+            item = None
+        row = {key: item, "error": record.get("error")}
+        if "error" in record:
+            rows.append(row | {"rank": None})
+        rows.extend(
+            row | {"rank": rank, **result}
+            for rank, result in enumerate(record.get("results", []), 1)
+        )
+    return rows
+
+
+class _ParquetWriter:
+    """Writes every batch as one Parquet file of a directory, see _parquet_rows."""
+
+    def __init__(self, path, position):
+        try:
+            import pyarrow  # noqa: F401, pandas writes Parquet through pyarrow
+        except ImportError as exc:
+            raise click.UsageError("Parquet output requires pyarrow") from exc
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Drops the parts a killed run wrote after its last checkpoint
+        for name in os.listdir(path):
+            match = PART_PATTERN.fullmatch(name)
+            if match and int(match.group(1)) >= position:
+                os.remove(os.path.join(path, name))
+        self.position = position
+
+    def write(self, records):
+        import pandas as pd
+
+        pd.DataFrame(_parquet_rows(records)).to_parquet(
+            os.path.join(self.path, f"part-{self.position:05d}.parquet"), index=False
+        )
+        self.position += 1
+        return self.position
+
+    def close(self):
+        pass
+
+
+def _save_checkpoint(path, items, position):
+    """Atomically records the number of processed items and the output position."""
+    with open(path + ".tmp", "w") as f:
+        json.dump({"items": items, "position": position}, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_batch(
+    kind,
+    lines,
+    output,
+    model,
+    output_format="jsonl",
+    batch_size=1000,
+    workers=None,
+    **options,
+):
+    """
+    Answers many requests offline, streaming the results to a file.
+
+    The model is loaded once by the caller and shared with the workers through
+    fork. Batches are written in input order, and after each one the number of
+    processed items is saved to ``<output>.checkpoint``: a run killed midway and
+    started again with the same input resumes after the last written batch. The
+    checkpoint is removed once the input is exhausted.
+
+    Args:
+        kind (str): "recommend" for movie IDs, "users" for user IDs or "search"
+            for title queries, one per input line.
+        lines (iterable of str): The input lines.
+        output (str): The JSONL file, or the directory of Parquet files.
+        model (RecommenderModel): The loaded model.
+        output_format (str): "jsonl", one record per input line, or "parquet",
+            one row per result with its rank and one row per error with a null
+            rank; items with an empty result list get no rows.
+        batch_size (int): Number of items answered per task.
+        workers (int, optional): Number of worker processes, defaults to all cores.
+            Batches are answered in this process when the ratings index is a
+            ShardedRatingsIndex.
+        **options: Options of the model calls, e.g. k, genres or fuzzy.
+
+    Returns:
+        int: Number of items processed by this run.
+    """
+    global _MODEL
+    checkpoint = os.fspath(output) + ".checkpoint"
+    done, position = 0, 0
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+        done, position = state["items"], state["position"]
+    writer = (_ParquetWriter if output_format == "parquet" else _JsonlWriter)(
+        output, position
+    )
+    items = read_items(lines, done)
+    batches = iter(lambda: list(itertools.islice(items, batch_size)), [])
+    tasks = ((kind, batch, options) for batch in batches)
+    processed = 0
+    _MODEL = model
+    pool = None
+    try:
+        # Pool workers cannot start the shard processes of a sharded index, whose
+        # counting passes already use several cores
+        if workers == 1 or isinstance(model.ratings, ShardedRatingsIndex):
+            results = map(_process_batch, tasks)
+        else:
+            # fork shares the model with the workers without pickling it
+            workers = workers or os.cpu_count()
+            pool = multiprocessing.get_context("fork").Pool(workers)
+            # Only a few batches per worker are in flight, whatever the input size
+            windows = iter(lambda: list(itertools.islice(tasks, 4 * workers)), [])
+            results = (
+                records
+                for window in windows
+                for records in pool.imap(_process_batch, window)
+            )
+        for records in results:
+            position = writer.write(records)
+            processed += len(records)
+            _save_checkpoint(checkpoint, done + processed, position)
+    finally:
+        _MODEL = None
+        writer.close()
+        if pool is not None:
+            pool.terminate()
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return processed
+
+
+@click.command()
+@click.argument("kind", type=click.Choice(list(KINDS)))
+@click.argument("input_file", type=click.File("r"))
+@click.argument("output")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["jsonl", "parquet"]),
+    default="jsonl",
+    show_default=True,
+)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--workers", type=int, default=None, help="Defaults to all cores.")
+@click.option("--k", type=int, default=None, help="Recommendations per item.")
+@click.option("--genres", default=None, help="Comma-separated genres to keep.")
+@click.option("--min-year", type=int, default=None)
+@click.option("--max-year", type=int, default=None)
+@click.option("--fuzzy", is_flag=True, help="Typo-tolerant search.")
+@click.option(
+    "--shards",
+    type=int,
+    default=None,
+    help="Count every recommendation across this many processes instead of "
+    "answering batches in --workers processes. Defaults to RECOMMENDER_SHARDS.",
+)
+@click.option("--movies", "movies_filepath", default=MOVIES_FILEPATH)
+@click.option("--ratings", "ratings_filepath", default=RATINGS_FILEPATH)
+def main(
+    kind,
+    input_file,
+    output,
+    output_format,
+    batch_size,
+    workers,
+    k,
+    genres,
+    min_year,
+    max_year,
+    fuzzy,
+    shards,
+    movies_filepath,
+    ratings_filepath,
+):
+    """
+    Answer one request per line of INPUT_FILE ('-' for stdin) into OUTPUT.
+
+    KIND is "recommend" for movie IDs, "users" for user IDs and "search" for
+    title queries. A killed run resumes where it stopped when started again.
+    """
+    options = {
+        "k": k,
+        "genres": genres.split(",") if genres else None,
+        "min_year": min_year,
+        "max_year": max_year,
+    }
+    options = {name: value for name, value in options.items() if value is not None}
+    if kind == "search":
+        options = {"fuzzy": fuzzy}
+    start = time.perf_counter()
+    model = RecommenderModel(
+        movies_filepath,
+        ratings_filepath,
+        TABLE_FILEPATH,
+        EMBEDDINGS_FILEPATH,
+        shards=shards or default_shards(),
+    )
+    model.load()
+    loaded = time.perf_counter()
+    try:
+        processed = run_batch(
+            kind,
+            input_file,
+            output,
+            model,
+            output_format,
+            batch_size,
+            workers,
+            **options,
+        )
+    finally:
+        if isinstance(model.ratings, ShardedRatingsIndex):
+            model.ratings.close()
+    seconds = time.perf_counter() - loaded
+    click.echo(
+        f"Wrote {processed} items to {output} in {seconds:.1f}s "
+        f"({processed / max(seconds, 1e-9):.0f} items/s, "
+        f"data loaded in {loaded - start:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
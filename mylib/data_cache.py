@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from mylib.movie_utils import (
+    VECTORIZER_PARAMS,
+    initialize_vectorizer,
+    load_and_clean_data,
+    restore_vectorizer,
+)
+from mylib.ratings_index import RatingsIndex
+
+# Bump whenever the on-disk layout of a cache entry changes
+CACHE_VERSION = 4
+
+# Narrow dtypes kept for the ratings columns; the timestamp column is never used
+RATINGS_DTYPES = {"userId": np.int32, "movieId": np.int32, "rating": np.float32}
+
+# Bump whenever the vectorizer or its artifact layout changes
+VECTORIZER_VERSION = 2
+
+# Memory budget for one parsed CSV chunk, and the parser's approximate cost per row
+DEFAULT_CHUNK_MEMORY = 64 * 2**20
+CHUNK_BYTES_PER_ROW = 64
+
+
+def default_cache_dir(filepath):
+    """
+    Returns the cache directory used for a source file when none is given.
+
+    Args:
+        filepath (str): Path to the source CSV file.
+
+    Returns:
+        str: A '.cache' directory next to the source file.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(filepath)), ".cache")
+
+
+def file_hash(filepath, chunk_size=1 << 23):
+    """
+    Computes the SHA-256 hex digest of a file, reading it in chunks.
+
+    Args:
+        filepath (str): Path to the file.
+        chunk_size (int): Number of bytes read per chunk.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_signature(filepath):
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _entry_dir(filepath, cache_dir, kind):
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(cache_dir or default_cache_dir(filepath), f"{name}.{kind}")
+
+
+def _is_valid(entry, filepath, params):
+    """
+    Checks a cache entry against its source file.
+
+    Size and mtime are compared first. When only the mtime differs (e.g. after a
+    fresh checkout) the content hash decides, and the manifest is refreshed.
+    """
+    manifest_path = os.path.join(entry, "manifest.json")
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get("version") != CACHE_VERSION or manifest.get("params") != params:
+        return False
+    signature = _source_signature(filepath)
+    if signature["size"] != manifest["size"]:
+        return False
+    if signature["mtime_ns"] == manifest["mtime_ns"]:
+        return True
+    if file_hash(filepath) != manifest["sha256"]:
+        return False
+    manifest.update(signature)
+    try:
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+    except OSError:
+        pass  # a read-only cache is still valid, it is just re-hashed next time
+    return True
+
+
+def _write_entry(entry, filepath, params, write):
+    """
+    Writes a cache entry into a temporary directory and moves it into place, so
+    concurrent readers never see a partially written entry.
+    """
+    parent = os.path.dirname(entry)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    try:
+        write(tmp)
+        manifest = {
+            "version": CACHE_VERSION,
+            "params": params,
+            "sha256": file_hash(filepath),
+            **_source_signature(filepath),
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            pass  # another process published the same entry first
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def iter_ratings_chunks(filepath, max_memory=DEFAULT_CHUNK_MEMORY):
+    """
+    Streams the ratings CSV in chunks, keeping only the needed columns in narrow dtypes.
+
+    Args:
+        filepath (str): Path to the ratings CSV file.
+        max_memory (int): Memory ceiling in bytes for a single parsed chunk.
+
+    Yields:
+        DataFrame: Chunks with int32 'userId'/'movieId' and float32 'rating'.
+    """
+    chunksize = max(1, max_memory // CHUNK_BYTES_PER_ROW)
+    with pd.read_csv(
+        filepath,
+        usecols=list(RATINGS_DTYPES),
+        dtype=RATINGS_DTYPES,
+        chunksize=chunksize,
+    ) as reader:
+        yield from reader
+
+
+def build_ratings_index(
+    filepath, rating_threshold=4.0, max_memory=DEFAULT_CHUNK_MEMORY
+):
+    """
+    Builds a RatingsIndex straight from the ratings CSV without materializing it.
+
+    Each chunk is reduced to its (userId, movieId) pairs and a mask of the high ratings
+    before the next one is read, so peak memory is one chunk plus the compact pairs
+    and index.
+
+    Args:
+        filepath (str): Path to the ratings CSV file.
+        rating_threshold (float): Ratings strictly above this value count as high.
+        max_memory (int): Memory ceiling in bytes for a single parsed chunk.
+
+    Returns:
+        RatingsIndex: The built index.
+    """
+    user_ids, movie_ids, high = [], [], []
+    for chunk in iter_ratings_chunks(filepath, max_memory):
+        high.append(chunk["rating"].to_numpy() > rating_threshold)
+        user_ids.append(chunk["userId"].to_numpy())
+        movie_ids.append(chunk["movieId"].to_numpy())
+    if not user_ids:
+        user_ids = movie_ids = [np.empty(0, dtype=np.int32)]
+        high = [np.empty(0, dtype=bool)]
+    user_ids, movie_ids = np.concatenate(user_ids), np.concatenate(movie_ids)
+    high = np.concatenate(high)
+    return RatingsIndex.from_pairs(
+        user_ids[high], movie_ids[high], rating_threshold, user_ids, movie_ids
+    )
+
+
+def _open_column(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def load_ratings(filepath, cache_dir=None, max_memory=DEFAULT_CHUNK_MEMORY):
+    """
+    Loads the ratings, converting them once into memory-mappable binary columns.
+
+    The CSV is streamed chunk by chunk into one raw file per column. Later calls
+    memory-map the cached columns read-only, so start-up is nearly instant and
+    processes loading the same cache share its pages.
+
+    Args:
+        filepath (str): Path to the ratings CSV file.
+        cache_dir (str, optional): Cache directory, defaults to default_cache_dir.
+        max_memory (int): Memory ceiling in bytes for a single parsed chunk.
+
+    Returns:
+        DataFrame: Ratings with 'userId', 'movieId' and 'rating' columns.
+    """
+    entry = _entry_dir(filepath, cache_dir, "columns")
+    if not _is_valid(entry, filepath, {}):
+
+        def write(directory):
+            files = {
+                column: open(os.path.join(directory, f"{column}.bin"), "wb")
+                for column in RATINGS_DTYPES
+            }
+            try:
+                for chunk in iter_ratings_chunks(filepath, max_memory):
+                    for column, f in files.items():
+                        f.write(chunk[column].to_numpy().tobytes())
+            finally:
+                for f in files.values():
+                    f.close()
+
+        _write_entry(entry, filepath, {}, write)
+    columns = {
+        column: _open_column(os.path.join(entry, f"{column}.bin"), dtype)
+        for column, dtype in RATINGS_DTYPES.items()
+    }
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_ratings_index(
+    filepath, cache_dir=None, rating_threshold=4.0, max_memory=DEFAULT_CHUNK_MEMORY
+):
+    """
+    Loads the RatingsIndex for a ratings file, building and caching it on first use.
+
+    Args:
+        filepath (str): Path to the ratings CSV file.
+        cache_dir (str, optional): Cache directory, defaults to default_cache_dir.
+        rating_threshold (float): Ratings strictly above this value count as high.
+        max_memory (int): Memory ceiling in bytes for a single parsed chunk.
+
+    Returns:
+        RatingsIndex: The index, memory-mapped from the cache.
+    """
+    entry = _entry_dir(filepath, cache_dir, "index")
+    params = {"rating_threshold": rating_threshold}
+    if not _is_valid(entry, filepath, params):
+
+        def write(directory):
+            build_ratings_index(filepath, rating_threshold, max_memory).save(directory)
+
+        _write_entry(entry, filepath, params, write)
+    return RatingsIndex.load(entry, rating_threshold)
+
+
+def load_movies(filepath, cache_dir=None):
+    """
+    Loads the cleaned movies via load_and_clean_data, with the release year in a
+    'year' column, caching the result as a pickle.
+
+    Args:
+        filepath (str): Path to the movies CSV file.
+        cache_dir (str, optional): Cache directory, defaults to default_cache_dir.
+
+    Returns:
+        DataFrame: The movies DataFrame with cleaned titles and years.
+    """
+    entry = _entry_dir(filepath, cache_dir, "movies")
+    if not _is_valid(entry, filepath, {}):
+
+        def write(directory):
+            load_and_clean_data(filepath, extract_year=True).to_pickle(
+                os.path.join(directory, "movies.pkl")
+            )
+
+        _write_entry(entry, filepath, {}, write)
+    return pd.read_pickle(os.path.join(entry, "movies.pkl"))
+
+
+def load_vectorizer(filepath, movies=None, cache_dir=None):
+    """
+    Loads the fitted TF-IDF vectorizer and matrix for a movies file, fitting and
+    persisting them on first use.
+
+    The artifact holds the vocabulary, the idf weights and the raw CSR buffers of
+    the TF-IDF matrix. It is keyed to the movies file like every cache entry, and
+    the matrix buffers are memory-mapped so worker processes share their pages.
+
+    Args:
+        filepath (str): Path to the movies CSV file.
+        movies (DataFrame, optional): The movies loaded by load_movies, loaded when
+            omitted and the artifact has to be built.
+        cache_dir (str, optional): Cache directory, defaults to default_cache_dir.
+
+    Returns:
+        TfidfVectorizer, sparse matrix: The vectorizer and the TF-IDF matrix.
+    """
+    entry = _entry_dir(filepath, cache_dir, "tfidf")
+    params = {
+        "vectorizer_version": VECTORIZER_VERSION,
+        "vectorizer": {key: list(value) for key, value in VECTORIZER_PARAMS.items()},
+    }
+    if not _is_valid(entry, filepath, params):
+
+        def write(directory):
+            source = movies if movies is not None else load_movies(filepath, cache_dir)
+            vectorizer, tfidf = initialize_vectorizer(source)
+            tfidf = sparse.csr_matrix(tfidf)
+            arrays = {
+                "terms": vectorizer.get_feature_names_out().astype(str),
+                "idf": vectorizer.idf_,
+                "data": tfidf.data,
+                "indices": tfidf.indices,
+                "indptr": tfidf.indptr,
+                "shape": np.array(tfidf.shape),
+            }
+            for name, array in arrays.items():
+                np.save(os.path.join(directory, f"{name}.npy"), array)
+
+        _write_entry(entry, filepath, params, write)
+
+    def array(name, mmap_mode="r"):
+        return np.load(os.path.join(entry, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    vectorizer = restore_vectorizer(array("terms", None), array("idf", None))
+    tfidf = sparse.csr_matrix(
+        (array("data"), array("indices"), array("indptr")),
+        shape=tuple(array("shape", None)),
+        copy=False,
+    )
+    return vectorizer, tfidf
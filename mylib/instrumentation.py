@@ -0,0 +1,203 @@
+import bisect
+import logging
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, +Inf is implied
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+ROWS_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTES_BUCKETS = (1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26, 1 << 30)
+
+_enabled = False
+_lock = threading.Lock()
+_histograms = {}
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NoopStage:
+    """Returned by stage when instrumentation is disabled, records nothing."""
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+class Stage:
+    """Times one stage of a function and records its rows and allocation delta."""
+
+    def __init__(self, function, name):
+        self.function = function
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        self._memory = (
+            tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        )
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        alloc = None
+        if self._memory is not None and tracemalloc.is_tracing():
+            alloc = tracemalloc.get_traced_memory()[0] - self._memory
+        _record(self.function, self.name, seconds, self.rows, alloc)
+        return False
+
+
+def enable(trace_memory=False):
+    """
+    Turns instrumentation on.
+
+    Args:
+        trace_memory (bool): Also start tracemalloc to record allocation deltas,
+            which slows allocations down noticeably.
+    """
+    global _enabled
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """Turns instrumentation off, stopping tracemalloc if it was running."""
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Drops every recorded observation."""
+    with _lock:
+        _histograms.clear()
+
+
+def stage(function, name):
+    """
+    Instruments one stage of a function.
+
+    Usage::
+
+        with stage("find_similar_movies", "similar_users") as s:
+            users = get_similar_users(movie_id, ratings)
+            s.rows = len(users)
+
+    When instrumentation is disabled a shared no-op context is returned, so the
+    cost is a single flag check.
+
+    Args:
+        function (str): Name of the instrumented function.
+        name (str): Name of the stage.
+
+    Returns:
+        Stage: Context manager whose 'rows' attribute can be set inside the block.
+    """
+    if not _enabled:
+        return _NOOP
+    return Stage(function, name)
+
+
+def _record(function, name, seconds, rows, alloc):
+    labels = (function, name)
+    with _lock:
+        for metric, value, buckets in (
+            ("seconds", seconds, SECONDS_BUCKETS),
+            ("rows", rows, ROWS_BUCKETS),
+            ("alloc_bytes", alloc, BYTES_BUCKETS),
+        ):
+            if value is not None:
+                key = (metric,) + labels
+                if key not in _histograms:
+                    _histograms[key] = Histogram(buckets)
+                _histograms[key].observe(value)
+    logger.debug(
+        "%s.%s took %.3f ms",
+        function,
+        name,
+        seconds * 1000,
+        extra={
+            "function": function,
+            "stage": name,
+            "seconds": seconds,
+            "rows": rows,
+            "alloc_bytes": alloc,
+        },
+    )
+
+
+def dump():
+    """
+    Returns a snapshot of every histogram.
+
+    Returns:
+        dict: {metric: {"function.stage": {"count", "sum", "buckets"}}}.
+    """
+    snapshot = {}
+    with _lock:
+        for (metric, function, name), histogram in sorted(_histograms.items()):
+            snapshot.setdefault(metric, {})[f"{function}.{name}"] = {
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "buckets": dict(zip(histogram.buckets + ("+Inf",), histogram.counts)),
+            }
+    return snapshot
+
+
+def render_prometheus(prefix="recommender_stage"):
+    """
+    Renders every histogram in the Prometheus text exposition format.
+
+    Args:
+        prefix (str): Prefix of the metric names.
+
+    Returns:
+        str: The metrics text.
+    """
+    lines = []
+    with _lock:
+        items = sorted(_histograms.items())
+    for metric in ("seconds", "rows", "alloc_bytes"):
+        series = [(key[1:], h) for key, h in items if key[0] == metric]
+        if not series:
+            continue
+        name = f"{prefix}_{metric}"
+        lines.append(f"# TYPE {name} histogram")
+        for (function, stage_name), histogram in series:
+            labels = f'function="{function}",stage="{stage_name}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
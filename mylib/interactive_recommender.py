@@ -1,6 +1,8 @@
-from mylib.movie_utils import load_and_clean_data, initialize_vectorizer, search_movies
-from mylib.recommender_utils import find_similar_movies
-import pandas as pd
+from mylib.movie_utils import search_movies
+from mylib.recommender_utils import add_popularity, find_similar_movies
+from mylib.recommender_model import MIN_SIMILARITY
+from mylib.data_cache import load_movies, load_ratings_index, load_vectorizer
+from mylib.title_index import TitleIndex
 
 
 def interactive_search(movies, ratings, vectorizer, tfidf):
@@ -9,9 +11,9 @@ def interactive_search(movies, ratings, vectorizer, tfidf):
 
     Args:
         movies (DataFrame): DataFrame of movies.
-        ratings (DataFrame): DataFrame of user ratings.
+        ratings (DataFrame or RatingsIndex): User ratings or their prebuilt index.
         vectorizer (TfidfVectorizer): TF-IDF vectorizer trained on movie titles.
-        tfidf (sparse matrix): TF-IDF matrix of movie titles.
+        tfidf (sparse matrix or TitleIndex): TF-IDF matrix of movie titles.
     """
     print("Interactive Movie Recommendation Tool")
     print("Type a movie title to search for similar movies. Type 'exit' to quit.")
@@ -26,14 +28,16 @@ def interactive_search(movies, ratings, vectorizer, tfidf):
         # Ensure the input has sufficient length for meaningful searches
         if len(title) > 5:
             # Perform content-based search
-            search_results = search_movies(title, movies, vectorizer, tfidf)
+            search_results = search_movies(
+                title, movies, vectorizer, tfidf, min_similarity=MIN_SIMILARITY
+            )
 
             if search_results.empty:
                 print(f"No results found for '{title}'. Try another title.")
                 continue
 
             print("\nContent-Based Search Results:")
-            print(search_results[["title"]].to_string(index=False))
+            print(search_results[["title", "score"]].to_string(index=False))
 
             # Get the first search result's movie ID for collaborative filtering
             movie_id = search_results.iloc[0]["movieId"]
@@ -62,11 +66,13 @@ if __name__ == "__main__":
     RATINGS_FILEPATH = "./data/ratings.csv"
 
     # Load and clean the movie and ratings data
-    movies = load_and_clean_data(MOVIES_FILEPATH)
-    ratings = pd.read_csv(RATINGS_FILEPATH)
+    movies = load_movies(MOVIES_FILEPATH)
+    ratings = load_ratings_index(RATINGS_FILEPATH)
+    movies = add_popularity(movies, ratings)
 
-    # Initialize vectorizer and TF-IDF matrix
-    vectorizer, tfidf = initialize_vectorizer(movies)
+    # Load the persisted vectorizer and TF-IDF matrix, fitting them on first use
+    vectorizer, tfidf = load_vectorizer(MOVIES_FILEPATH, movies)
+    tfidf = TitleIndex(tfidf)
 
     # Start the interactive search tool
     interactive_search(movies, ratings, vectorizer, tfidf)
@@ -0,0 +1,241 @@
+import os
+import time
+import click
+import numpy as np
+from scipy import sparse
+from mylib.data_cache import load_ratings_index
+
+
+class ItemEmbeddings:
+    """
+    Compact movie embeddings with an inverted-file (IVF) nearest-neighbour index.
+
+    The embeddings are the right singular vectors of the users x movies
+    high-rating matrix, scaled by their singular values and L2-normalized, so the
+    dot product of two rows is the cosine similarity of the movies. Movies are
+    partitioned into lists by spherical k-means; a query only scores the movies of
+    the n_probe lists whose centroids are closest to it, so its cost depends on
+    the list sizes rather than on how many users rated the movie.
+    """
+
+    def __init__(self, movie_ids, vectors, centroids, list_offsets, list_rows):
+        """
+        Args:
+            movie_ids (ndarray): Sorted movie IDs, aligned with the vector rows.
+            vectors (ndarray): (n_movies, dim) float32 unit-length embeddings.
+            centroids (ndarray): (n_lists, dim) float32 unit-length list centroids.
+            list_offsets (ndarray): Start of every list in list_rows, plus the end.
+            list_rows (ndarray): Vector rows grouped by list.
+        """
+        self.movie_ids = np.asarray(movie_ids)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets)
+        self.list_rows = np.asarray(list_rows)
+
+    @classmethod
+    def from_index(cls, index, dim=64, n_lists=None, iterations=10, seed=0):
+        """
+        Factorizes the high ratings of a RatingsIndex and partitions the movies.
+
+        Args:
+            index (RatingsIndex): The ratings index.
+            dim (int): Embedding dimension, capped below the matrix rank.
+            n_lists (int, optional): Number of IVF lists, defaults to about the
+                square root of the number of movies.
+            iterations (int): Number of k-means iterations.
+            seed (int): Seed of the factorization and of the k-means initialization.
+
+        Returns:
+            ItemEmbeddings: The embeddings and their index.
+        """
+        from scipy.sparse.linalg import svds  # Only needed to build embeddings
+
+        matrix = sparse.csr_matrix(index.user_movies, dtype=np.float32, copy=True)
+        matrix.data[:] = 1
+        # Cosine-normalize the columns so popular movies do not dominate the factors
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        matrix = matrix @ sparse.diags(1 / np.sqrt(np.maximum(counts, 1)))
+        dim = max(1, min(dim, min(matrix.shape) - 1))
+        rng = np.random.default_rng(seed)
+        _, values, right = svds(matrix, k=dim, v0=rng.random(min(matrix.shape)))
+        vectors = _normalize((right.T * values).astype(np.float32))
+
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        list_rows = np.argsort(assignments, kind="stable")
+        list_offsets = np.searchsorted(assignments[list_rows], np.arange(n_lists + 1))
+        return cls(index.movie_ids, vectors, centroids, list_offsets, list_rows)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def neighbors(self, movie_id, k=10, n_probe=8, allowed=None):
+        """
+        Finds the movies whose embeddings are closest to the given movie's.
+
+        Like find_similar_movies, the movie itself is included, normally first.
+
+        Args:
+            movie_id (int): The movie ID.
+            k (int): Number of neighbours.
+            n_probe (int): Number of IVF lists scanned; scanning all of them gives
+                the exact nearest neighbours.
+            allowed (callable, optional): Maps movie IDs to a boolean mask of the
+                movies that may be returned, applied to the scanned movies before
+                the top k are taken.
+
+        Returns:
+            ndarray, ndarray: Neighbour movie IDs and their cosine similarities,
+            most similar first; empty for unknown movies.
+        """
+        row = np.searchsorted(self.movie_ids, movie_id)
+        if row >= len(self.movie_ids) or self.movie_ids[row] != movie_id:
+            return self.movie_ids[:0], np.empty(0, dtype=np.float32)
+        query = self.vectors[row]
+        n_probe = min(n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        rows = np.concatenate(
+            [
+                self.list_rows[self.list_offsets[i] : self.list_offsets[i + 1]]
+                for i in lists
+            ]
+        )
+        if allowed is not None:
+            rows = rows[allowed(self.movie_ids[rows])]
+        scores = self.vectors[rows] @ query
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((self.movie_ids[rows], -scores))
+        return self.movie_ids[rows[order]], scores[order]
+
+    def save(self, filepath):
+        """
+        Writes the embeddings and their index to an .npz file.
+
+        Args:
+            filepath (str): Output path.
+        """
+        np.savez(
+            filepath,
+            movie_ids=self.movie_ids,
+            vectors=self.vectors,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Loads embeddings written by save.
+
+        Args:
+            filepath (str): Path to the .npz file.
+
+        Returns:
+            ItemEmbeddings: The loaded embeddings.
+        """
+        with np.load(filepath) as arrays:
+            return cls(
+                arrays["movie_ids"],
+                arrays["vectors"],
+                arrays["centroids"],
+                arrays["list_offsets"],
+                arrays["list_rows"],
+            )
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(vectors.dtype).tiny)
+
+
+def recall_report(index, embeddings, movie_ids, k=10, n_probe=8):
+    """
+    Measures how well the embedding neighbours reproduce the exact recommendations.
+
+    Args:
+        index (RatingsIndex): The ratings index the exact scores come from.
+        embeddings (ItemEmbeddings): The embeddings to evaluate.
+        movie_ids (array-like): Seed movies to evaluate.
+        k (int): Number of recommendations compared per seed.
+        n_probe (int): Number of IVF lists scanned per query.
+
+    Returns:
+        dict: Mean recall@k of the IVF neighbours against the exact recommendations
+        and against the exhaustive embedding neighbours, and the mean latencies in
+        milliseconds of the exact and IVF paths.
+    """
+    all_lists = len(embeddings.centroids)
+    recalls, ivf_recalls, exact_seconds, ann_seconds = [], [], [], []
+    for movie_id in movie_ids:
+        start = time.perf_counter()
+        exact = index.score_movie(movie_id)[0][:k]
+        exact_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        approximate = embeddings.neighbors(movie_id, k, n_probe)[0]
+        ann_seconds.append(time.perf_counter() - start)
+        exhaustive = embeddings.neighbors(movie_id, k, all_lists)[0]
+        if len(exact):
+            recalls.append(len(np.intersect1d(exact, approximate)) / len(exact))
+        if len(exhaustive):
+            ivf_recalls.append(
+                len(np.intersect1d(exhaustive, approximate)) / len(exhaustive)
+            )
+    return {
+        "seeds": len(movie_ids),
+        "k": k,
+        "n_probe": n_probe,
+        "recall_vs_exact": float(np.mean(recalls)) if recalls else 0.0,
+        "recall_vs_exhaustive": float(np.mean(ivf_recalls)) if ivf_recalls else 0.0,
+        "exact_ms": float(np.mean(exact_seconds) * 1000) if exact_seconds else 0.0,
+        "ann_ms": float(np.mean(ann_seconds) * 1000) if ann_seconds else 0.0,
+    }
+
+
+@click.command()
+@click.option("--ratings", "ratings_filepath", default="./data/ratings.csv")
+@click.option("--output", default="./data/.cache/embeddings.npz")
+@click.option("--dim", default=64, show_default=True, help="Embedding dimension.")
+@click.option("--lists", "n_lists", type=int, default=None, help="Number of IVF lists.")
+@click.option(
+    "--report-seeds",
+    default=200,
+    show_default=True,
+    help="Most popular movies the recall report is computed on, 0 to skip it.",
+)
+def main(ratings_filepath, output, dim, n_lists, report_seeds):
+    """Factorize the high ratings into item embeddings and report their recall."""
+    start = time.perf_counter()
+    index = load_ratings_index(ratings_filepath)
+    embeddings = ItemEmbeddings.from_index(index, dim=dim, n_lists=n_lists)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    embeddings.save(output)
+    click.echo(
+        f"Wrote {embeddings.dim}-d embeddings of {len(embeddings.movie_ids)} movies "
+        f"to {output} in {time.perf_counter() - start:.1f}s"
+    )
+    if report_seeds:
+        seeds = index.movie_ids[np.argsort(-index.movie_counts)[:report_seeds]]
+        for name, value in recall_report(index, embeddings, seeds).items():
+            click.echo(
+                f"{name}: {value:.4g}"
+                if isinstance(value, float)
+                else f"{name}: {value}"
+            )
+
+
+if __name__ == "__main__":
+    main()
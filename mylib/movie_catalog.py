@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+from mylib.movie_utils import extract_years
+
+# Separator of the genres of a movie in movies.csv, e.g. "Action|Sci-Fi"
+GENRE_SEPARATOR = "|"
+
+
+class MovieCatalog:
+    """
+    Array-backed lookup tables from movie IDs to the columns shown in results.
+
+    MovieLens movie IDs are sparse, so they are mapped to dense int32 codes by a
+    binary search over the sorted IDs. Titles are kept in an array aligned with
+    the codes and genres are dictionary-encoded, the few thousand distinct genre
+    strings being shared by every movie. Hydrating a list of recommended movie IDs
+    is then a couple of array indexing operations instead of a DataFrame merge.
+
+    Every movie also has a bitset of its individual genres and its release year,
+    so genre and year filters are evaluated as vectorized masks over candidates.
+    """
+
+    def __init__(self, movie_ids, titles, genre_codes, genre_names, years=None):
+        """
+        Args:
+            movie_ids (ndarray): Sorted, unique movie IDs.
+            titles (ndarray): Title of every movie, aligned with movie_ids.
+            genre_codes (ndarray): Position of every movie's genres in genre_names.
+            genre_names (ndarray): Distinct genre strings.
+            years (ndarray, optional): Release year of every movie, 0 when unknown.
+
+        Raises:
+            ValueError: If there are more than 64 individual genres.
+        """
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        self.titles = np.asarray(titles, dtype=object)
+        self.genre_codes = np.asarray(genre_codes, dtype=np.int32)
+        self.genre_names = np.asarray(genre_names, dtype=object)
+        if years is None:
+            years = np.zeros(len(self.movie_ids))
+        self.years = np.asarray(years, dtype=np.int16)
+
+        # One bit per individual genre, computed once per distinct genre string
+        split = [
+            name.split(GENRE_SEPARATOR) if isinstance(name, str) else []
+            for name in self.genre_names
+        ]
+        self.genres_vocabulary = sorted({genre for names in split for genre in names})
+        if len(self.genres_vocabulary) > 64:
+            raise ValueError(
+                f"{len(self.genres_vocabulary)} genres do not fit in a 64-bit set"
+            )
+        self._genre_bits = {
+            genre.lower(): 1 << i for i, genre in enumerate(self.genres_vocabulary)
+        }
+        name_bits = np.array(
+            [
+                sum({self._genre_bits[genre.lower()] for genre in names})
+                for names in split
+            ],
+            dtype=np.uint64,
+        )
+        self.genre_bits = (
+            name_bits[self.genre_codes]
+            if len(name_bits)
+            else np.zeros(len(self.movie_ids), dtype=np.uint64)
+        )
+
+    @classmethod
+    def from_movies(cls, movies):
+        """
+        Builds the catalog from a movies DataFrame.
+
+        Args:
+            movies (DataFrame): Movies with 'movieId', 'title' and 'genres' columns,
+                and optionally the 'year' column of load_movies; years are
+                extracted from the titles otherwise.
+
+        Returns:
+            MovieCatalog: The catalog, ordered by movie ID.
+        """
+        movie_ids = movies["movieId"].to_numpy()
+        order = np.argsort(movie_ids, kind="stable")
+        genre_codes, genre_names = pd.factorize(
+            movies["genres"].to_numpy(dtype=object)[order], use_na_sentinel=False
+        )
+        years = (
+            movies["year"]
+            if "year" in movies.columns
+            else extract_years(movies["title"])
+        )
+        return cls(
+            movie_ids[order],
+            movies["title"].to_numpy(dtype=object)[order],
+            genre_codes,
+            genre_names,
+            years.astype("Int64").fillna(0).to_numpy(dtype=np.int16)[order],
+        )
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, movie_id):
+        return bool(self.codes([movie_id])[0] >= 0)
+
+    @property
+    def genres(self):
+        """Genres string of every movie, aligned with movie_ids."""
+        return self.genre_names[self.genre_codes]
+
+    def codes(self, movie_ids):
+        """
+        Maps movie IDs to their dense codes.
+
+        Args:
+            movie_ids (array-like): Movie IDs to look up.
+
+        Returns:
+            ndarray: int32 codes aligned with movie_ids, -1 for unknown movies.
+        """
+        movie_ids = np.asarray(movie_ids)
+        codes = np.full(len(movie_ids), -1, dtype=np.int32)
+        if len(self.movie_ids):
+            found = np.minimum(
+                np.searchsorted(self.movie_ids, movie_ids), len(self.movie_ids) - 1
+            )
+            hit = self.movie_ids[found] == movie_ids
+            codes[hit] = found[hit]
+        return codes
+
+    def genre_mask(self, genres):
+        """
+        Builds the bitset of the given genres.
+
+        Args:
+            genres (iterable of str): Genre names, matched case-insensitively.
+
+        Returns:
+            uint64: The bitset with one bit per genre.
+
+        Raises:
+            ValueError: If a genre is not in the catalog.
+        """
+        bits = 0
+        for genre in genres:
+            if genre.lower() not in self._genre_bits:
+                raise ValueError(
+                    f"Unknown genre {genre!r}, expected one of {self.genres_vocabulary}"
+                )
+            bits |= self._genre_bits[genre.lower()]
+        return np.uint64(bits)
+
+    def matches(self, movie_ids, genres=None, min_year=None, max_year=None):
+        """
+        Tests which movies pass genre and release-year filters.
+
+        Args:
+            movie_ids (array-like): Movie IDs to test.
+            genres (iterable of str, optional): Keep movies with any of these genres.
+            min_year (int, optional): Keep movies released in or after this year.
+            max_year (int, optional): Keep movies released in or before this year.
+                Movies without a known year fail both year filters.
+
+        Returns:
+            ndarray: Boolean mask aligned with movie_ids, False for unknown movies.
+
+        Raises:
+            ValueError: If a genre is not in the catalog.
+        """
+        codes = self.codes(movie_ids)
+        keep = codes >= 0
+        codes = np.maximum(codes, 0)
+        if genres is not None:
+            keep &= (self.genre_bits[codes] & self.genre_mask(genres)) != 0
+        if min_year is not None:
+            keep &= self.years[codes] >= min_year
+        if max_year is not None:
+            keep &= (self.years[codes] <= max_year) & (self.years[codes] > 0)
+        return keep
+
+    def hydrate(self, movie_ids, scores):
+        """
+        Attaches titles and genres to scored movies, dropping unknown movies like the
+        inner merge it replaces.
+
+        Args:
+            movie_ids (array-like): Movie IDs, in result order.
+            scores (array-like): Score of every movie.
+
+        Returns:
+            DataFrame: The 'score', 'title' and 'genres' of the known movies.
+        """
+        codes = self.codes(movie_ids)
+        known = codes >= 0
+        codes = codes[known]
+        return pd.DataFrame(
+            {
+                "score": np.asarray(scores)[known],
+                "title": self.titles[codes],
+                "genres": self.genre_names[self.genre_codes[codes]],
+            }
+        )
+
+    def extend(self, movies):
+        """
+        Returns a new catalog with the given movies added.
+
+        Args:
+            movies (DataFrame): New movies with 'movieId', 'title' and 'genres' columns.
+
+        Returns:
+            MovieCatalog: The extended catalog; this one is left unchanged.
+        """
+        added = MovieCatalog.from_movies(movies)
+        return MovieCatalog.from_movies(
+            pd.DataFrame(
+                {
+                    "movieId": np.concatenate([self.movie_ids, added.movie_ids]),
+                    "title": np.concatenate([self.titles, added.titles]),
+                    "genres": np.concatenate([self.genres, added.genres]),
+                    "year": np.concatenate([self.years, added.years]),
+                }
+            )
+        )
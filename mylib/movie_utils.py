@@ -1,15 +1,81 @@
 import pandas as pd
-import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import unicodedata
 import numpy as np
+from scipy import sparse
+from mylib.title_index import TitleIndex
+from mylib.instrumentation import stage
+
+
+# scikit-learn takes over a second to import, so it is imported where it is used:
+# the CLI prompt and the service come up before any vectorizer is needed
+
+# Parameters of the title vectorizer, also recorded in persisted vectorizer artifacts
+VECTORIZER_PARAMS = {"ngram_range": (1, 2)}
+
+
+# Bytes deleted from titles once they are folded to lowercase ASCII
+KEPT_CHARACTERS = b"abcdefghijklmnopqrstuvwxyz0123456789 "
+_DROPPED = bytes(c for c in range(256) if c not in KEPT_CHARACTERS)
+# Same for clean_titles, which also keeps the separator of the joined column
+_DROPPED_JOINED = _DROPPED.replace(b"\x00", b"")
+
+# A release year in parentheses at the end of a title, e.g. "Heat (1995)"
+YEAR_PATTERN = r"\((\d{4})\)\s*$"
+
+
+def _fold(text):
+    """Folds accented and compatibility characters to lowercase ASCII bytes."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+    return text.encode("ascii", "ignore").lower()
 
 
 def clean_title(title):
     """
-    Cleans a movie title by removing non-alphanumeric characters.
+    Cleans a movie title by folding it to lowercase ASCII ("Amélie" -> "amelie")
+    and removing non-alphanumeric characters.
+    """
+    return _fold(title).translate(None, _DROPPED).decode("ascii")
+
+
+def clean_titles(titles):
+    """
+    Cleans a whole column of titles, giving the same result as clean_title per row.
+
+    The titles are joined into one string so that ASCII folding, lowercasing and
+    character removal each run once over the column instead of once per row; only
+    non-ASCII titles are Unicode-normalized individually.
+
+    Args:
+        titles (Series): The raw titles.
+
+    Returns:
+        Series: The cleaned titles, aligned with the input.
+    """
+    values = titles.fillna("").astype(str).tolist()
+    # Only the few non-ASCII titles need Unicode normalization
+    folded = "\x00".join(
+        [v if v.isascii() else unicodedata.normalize("NFKD", v) for v in values]
+    )
+    joined = folded.encode("ascii", "ignore").lower().translate(None, _DROPPED_JOINED)
+    cleaned = joined.decode("ascii").split("\x00")
+    if len(cleaned) != len(values):
+        # A title contained the separator itself, clean row by row instead
+        cleaned = [clean_title(title) for title in values]
+    return pd.Series(cleaned, index=titles.index, name=titles.name)
+
+
+def extract_years(titles):
+    """
+    Extracts the release year from titles ending in "(YYYY)".
+
+    Args:
+        titles (Series): The raw titles.
+
+    Returns:
+        Series: Years as a nullable integer column, missing where a title has none.
     """
-    return re.sub("[^a-zA-Z0-9 ]", "", title)
+    return titles.str.extract(YEAR_PATTERN, expand=False).astype("Int64")
 
 
 # def load_and_clean_data(filepath):
@@ -27,8 +93,14 @@ def clean_title(title):
 #     return movies
 
 
-def load_and_clean_data(filepath):
-    """Load and clean the movies dataset."""
+def load_and_clean_data(filepath, extract_year=False):
+    """
+    Load and clean the movies dataset.
+
+    Args:
+        filepath (str): Path to the CSV file containing movie data.
+        extract_year (bool): Also add a 'year' column parsed from the titles.
+    """
     try:
         movies = pd.read_csv(filepath)
 
@@ -37,7 +109,9 @@ def load_and_clean_data(filepath):
             raise KeyError("'title' column is missing from the dataset")
 
         # Clean and preprocess the movies data
-        movies["clean_title"] = movies["title"].apply(clean_title)
+        movies["clean_title"] = clean_titles(movies["title"])
+        if extract_year:
+            movies["year"] = extract_years(movies["title"])
         return movies
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found: {filepath}")
@@ -57,32 +131,258 @@ def initialize_vectorizer(movies):
     Returns:
         TfidfVectorizer, sparse matrix: The vectorizer and the fitted TF-IDF matrix.
     """
-    vectorizer = TfidfVectorizer(ngram_range=(1, 2))
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**VECTORIZER_PARAMS)
     tfidf = vectorizer.fit_transform(movies["clean_title"])
     return vectorizer, tfidf
 
 
-def search_movies(title, movies, vectorizer, tfidf):
+def _tiebreak_keys(movies):
+    """
+    Returns the per-row tie-break keys used to order equally similar movies:
+    higher popularity first (when a 'popularity' column exists), then lower movieId.
+    """
+    movie_ids = movies["movieId"].to_numpy()
+    if "popularity" in movies.columns:
+        popularity = movies["popularity"].to_numpy()
+    else:
+        popularity = np.zeros(len(movies))
+    return movie_ids, popularity
+
+
+def _rank_results(movies, rows, scores, k, min_similarity):
+    """
+    Orders matching rows by descending score with a stable tie-break and keeps the
+    best k at or above min_similarity.
+
+    Args:
+        movies (DataFrame): The movies DataFrame.
+        rows (ndarray): Positions of the matching movies.
+        scores (ndarray): Similarity of each matching movie.
+        k (int): Maximum number of results.
+        min_similarity (float): Minimum similarity of a result.
+
+    Returns:
+        DataFrame: The ranked movies with a 'score' column.
+    """
+    keep = (scores > 0) & (scores >= min_similarity)
+    rows, scores = rows[keep], scores[keep]
+    if len(scores) > k:
+        # Keep every row tied with the k-th best score so the tie-break decides
+        keep = scores >= np.partition(scores, -k)[-k]
+        rows, scores = rows[keep], scores[keep]
+    movie_ids, popularity = _tiebreak_keys(movies)
+    order = np.lexsort((movie_ids[rows], -popularity[rows], -scores))[:k]
+    results = movies.iloc[rows[order]].copy()
+    results["score"] = scores[order]
+    return results
+
+
+def restore_vectorizer(terms, idf):
+    """
+    Rebuilds a fitted TF-IDF vectorizer from its vocabulary and idf weights.
+
+    Args:
+        terms (array-like): Vocabulary terms, in feature column order.
+        idf (ndarray): The idf weight of every term.
+
+    Returns:
+        TfidfVectorizer: A vectorizer that transforms like the one it was saved from.
+    """
+    return _fitted_vectorizer({str(term): i for i, term in enumerate(terms)}, idf)
+
+
+def _fitted_vectorizer(vocabulary, idf):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**VECTORIZER_PARAMS)
+    vectorizer.vocabulary_ = vocabulary
+    vectorizer.idf_ = np.asarray(idf)
+    return vectorizer
+
+
+def append_titles(vectorizer, tfidf, titles):
+    """
+    Vectorizes new cleaned titles with a fitted vectorizer and appends their rows.
+
+    N-grams missing from the vocabulary become new columns weighted with the idf
+    a fit on all titles would give them, since no existing title contains them.
+    The idf of the existing terms is left as fitted, so the catalogue should be
+    refit once many titles have been appended.
+
+    Args:
+        vectorizer (TfidfVectorizer): The fitted vectorizer, left unchanged.
+        tfidf (sparse matrix): The TF-IDF matrix of the existing titles.
+        titles (list of str): The cleaned titles to append.
+
+    Returns:
+        TfidfVectorizer, csr_matrix, int: A vectorizer with the extended vocabulary,
+        the matrix with one row appended per title, and the number of new terms.
+    """
+    analyzer = vectorizer.build_analyzer()
+    vocabulary = dict(vectorizer.vocabulary_)
+    new_terms = {}
+    for title in titles:
+        for term in set(analyzer(title)):
+            if term not in vocabulary:
+                new_terms[term] = new_terms.get(term, 0) + 1
+    for term in new_terms:
+        vocabulary[term] = len(vocabulary)
+    n_titles = tfidf.shape[0] + len(titles)
+    document_counts = np.fromiter(new_terms.values(), dtype=np.float64)
+    idf = np.concatenate(
+        [vectorizer.idf_, np.log((1 + n_titles) / (1 + document_counts)) + 1]
+    )
+    extended = _fitted_vectorizer(vocabulary, idf)
+
+    tfidf = sparse.csr_matrix(tfidf)
+    existing = sparse.csr_matrix(
+        (tfidf.data, tfidf.indices, tfidf.indptr),
+        shape=(tfidf.shape[0], len(vocabulary)),
+    )
+    rows = extended.transform(list(titles))
+    return extended, sparse.vstack([existing, rows], format="csr"), len(new_terms)
+
+
+def search_movies(
+    title,
+    movies,
+    vectorizer,
+    tfidf,
+    cache=None,
+    k=5,
+    min_similarity=0.0,
+    fuzzy=None,
+):
     """
     Searches for the most similar movies based on the given title.
 
+    Results are sorted by descending similarity; ties are broken by popularity
+    (when movies has a 'popularity' column) and then by movieId, so the first
+    result is deterministic. Movies sharing no term with the title are never
+    returned, so a query without any real match gives an empty DataFrame.
+
+    With a FuzzyTitleIndex, every title is scored by the better of its TF-IDF and
+    character-trigram similarities, so misspelled or truncated words ("matrx",
+    "lord of the r") still find their movie.
+
     Args:
         title (str): The title to search for.
         movies (DataFrame): The movies DataFrame.
         vectorizer (TfidfVectorizer): The trained TF-IDF vectorizer.
-        tfidf (sparse matrix): The TF-IDF matrix of the cleaned titles.
+        tfidf (sparse matrix or TitleIndex): The TF-IDF matrix of the cleaned titles,
+            or an inverted index over it that only scores titles sharing a term.
+        cache (LRUCache, optional): Cache of results keyed by the cleaned title.
+        k (int): Maximum number of results.
+        min_similarity (float): Minimum cosine similarity of a result.
+        fuzzy (FuzzyTitleIndex, optional): Trigram index of the cleaned titles.
 
     Returns:
-        DataFrame: A DataFrame of the top 5 most similar movies.
+        DataFrame: Up to k most similar movies with their similarity in a 'score' column.
     """
-    cleaned_title = clean_title(title)
-    query_vec = vectorizer.transform([cleaned_title])
-    similarity = cosine_similarity(query_vec, tfidf).flatten()
-    indices = np.argpartition(similarity, -5)[-5:]
-    results = movies.iloc[indices].iloc[::-1]  # Reverse to show most similar first
+    with stage("search_movies", "clean"):
+        cleaned_title = clean_title(title)
+    if cache is not None:
+        return cache.get_or_compute(
+            (cleaned_title, k, min_similarity, fuzzy is not None),
+            lambda: search_movies(
+                cleaned_title,
+                movies,
+                vectorizer,
+                tfidf,
+                k=k,
+                min_similarity=min_similarity,
+                fuzzy=fuzzy,
+            ),
+        )
+    with stage("search_movies", "transform") as s:
+        query_vec = vectorizer.transform([cleaned_title])
+        s.rows = query_vec.nnz
+    with stage("search_movies", "similarity") as s:
+        if isinstance(tfidf, TitleIndex):
+            rows, similarity = tfidf.scores(query_vec)
+        else:
+            from sklearn.metrics.pairwise import cosine_similarity
+
+            similarity = cosine_similarity(query_vec, tfidf).flatten()
+            rows = np.flatnonzero(similarity)
+            similarity = similarity[rows]
+        s.rows = len(rows)
+    if fuzzy is not None:
+        with stage("search_movies", "trigrams") as s:
+            fuzzy_rows, fuzzy_similarity = fuzzy.scores(cleaned_title)
+            s.rows = len(fuzzy_rows)
+            # Keep the better of the two scores of every title
+            rows, inverse = np.unique(
+                np.concatenate([rows, fuzzy_rows]), return_inverse=True
+            )
+            best = np.zeros(len(rows))
+            np.maximum.at(best, inverse, np.concatenate([similarity, fuzzy_similarity]))
+            similarity = best
+    with stage("search_movies", "top_k") as s:
+        results = _rank_results(movies, rows, similarity, k, min_similarity)
+        s.rows = len(results)
     return results
 
 
+def search_movies_batch(
+    titles, movies, vectorizer, tfidf, k=5, min_similarity=0.0, block_size=256
+):
+    """
+    Searches many titles at once, yielding the same results as search_movies for each.
+
+    Each block of queries is transformed in one call and scored with a single sparse
+    matrix product; the top k of every row are then selected with one vectorized
+    sort over the non-zero scores, so memory is bounded by the block size.
+
+    Args:
+        titles (iterable of str): The titles to search for.
+        movies (DataFrame): The movies DataFrame.
+        vectorizer (TfidfVectorizer): The trained TF-IDF vectorizer.
+        tfidf (sparse matrix or TitleIndex): The TF-IDF matrix of the cleaned titles.
+        k (int): Maximum number of results per title.
+        min_similarity (float): Minimum cosine similarity of a result.
+        block_size (int): Number of titles scored per matrix product.
+
+    Yields:
+        DataFrame: The ranked movies of each title with a 'score' column, in input order.
+    """
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    titles = list(titles)
+    if isinstance(tfidf, TitleIndex):
+        tfidf = tfidf.matrix
+    movie_ids, popularity = _tiebreak_keys(movies)
+    for start in range(0, len(titles), block_size):
+        block = clean_titles(
+            pd.Series(titles[start : start + block_size], dtype=object)
+        )
+        query_vecs = vectorizer.transform(block)
+        similarity = cosine_similarity(query_vecs, tfidf, dense_output=False).tocsr()
+        similarity.data[similarity.data < min_similarity] = 0
+        similarity.eliminate_zeros()
+
+        # Sort every row's entries by the search_movies order and keep the first k
+        query_rows = np.repeat(np.arange(len(block)), np.diff(similarity.indptr))
+        columns = similarity.indices
+        order = np.lexsort(
+            (
+                movie_ids[columns],
+                -popularity[columns],
+                -similarity.data,
+                query_rows,
+            )
+        )
+        rank = np.arange(len(order)) - similarity.indptr[query_rows[order]]
+        keep = order[rank < k]
+        bounds = np.searchsorted(query_rows[keep], np.arange(len(block) + 1))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            results = movies.iloc[columns[keep[first:last]]].copy()
+            results["score"] = similarity.data[keep[first:last]]
+            yield results
+
+
 if __name__ == "__main__":
     # Load and clean the movie data
     movies = load_and_clean_data("./data/movies.csv")
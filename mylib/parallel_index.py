@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy import sparse
+from mylib.ratings_index import RatingsIndex
+
+# Arrays attached by the pool workers, keyed by name
+_WORKER_ARRAYS = {}
+
+
+def _to_shared(array, blocks):
+    """Copies an array into a new shared memory block and returns its descriptor."""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    blocks.append(block)
+    return block.name, array.dtype.str, array.shape
+
+
+def _attach(descriptor, blocks):
+    name, dtype, shape = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)
+    return np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _init_worker(descriptors):
+    """Pool initializer: maps every shared array into the worker."""
+    blocks = _WORKER_ARRAYS.setdefault("_blocks", [])
+    for name, descriptor in descriptors.items():
+        _WORKER_ARRAYS[name] = _attach(descriptor, blocks)
+
+
+def _count_shard(user_codes, n_movies):
+    """Counts the high ratings of a range of users (one shard) per movie code."""
+    indptr = _WORKER_ARRAYS["user_movies_indptr"]
+    starts, ends = indptr[user_codes], indptr[user_codes + 1]
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    positions = np.repeat(starts, lengths) + offsets
+    return np.bincount(
+        _WORKER_ARRAYS["user_movies_indices"][positions],
+        weights=_WORKER_ARRAYS["user_movies_data"][positions],
+        minlength=n_movies,
+    ).astype(np.int64)
+
+
+def _distinct_shard(shard, movie_codes):
+    """Counts the distinct users of one shard who rated any of the movies highly."""
+    indptr = _WORKER_ARRAYS[f"shard{shard}_indptr"]
+    indices = _WORKER_ARRAYS[f"shard{shard}_indices"]
+    size = int(_WORKER_ARRAYS[f"shard{shard}_size"][0])
+    seen = np.zeros(size, dtype=bool)
+    for code in movie_codes:
+        seen[indices[indptr[code] : indptr[code + 1]]] = True
+    return int(np.count_nonzero(seen))
+
+
+class ShardedRatingsIndex(RatingsIndex):
+    """
+    RatingsIndex whose counting passes run across a process pool.
+
+    Users are partitioned into contiguous code ranges holding roughly the same
+    number of high ratings. The adjacency arrays and the per-shard movie -> user
+    slices live in shared memory, so every worker maps the same pages. Each
+    worker counts the high ratings of the similar users in its shard and the
+    distinct users of its shard, and the integer partial results are summed, so
+    scores are bit-identical to the serial index.
+    """
+
+    def __init__(self, index, workers=None, min_parallel_rows=2000):
+        """
+        Args:
+            index (RatingsIndex): The index to shard.
+            workers (int, optional): Number of processes and shards, defaults to all
+                cores.
+            min_parallel_rows (int): Passes over fewer rows than this run in-process,
+                where the pool's dispatch overhead would dominate.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_rows = min_parallel_rows
+        self._blocks = []
+        descriptors = {}
+        arrays = {}
+        for name in ("user_movies", "movie_users"):
+            matrix = getattr(index, name)
+            for part in ("data", "indices", "indptr"):
+                arrays[f"{name}_{part}"] = getattr(matrix, part)
+
+        # Shard boundaries on user codes, balanced by number of high ratings
+        indptr = index.user_movies.indptr
+        targets = np.linspace(0, indptr[-1], self.workers + 1)
+        bounds = np.searchsorted(indptr, targets).clip(0, index.n_users)
+        bounds[0], bounds[-1] = 0, index.n_users
+        self.shard_bounds = np.maximum.accumulate(bounds)
+        movie_users = index.movie_users.tocsc()
+        for shard, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+            part = movie_users[:, low:high].tocsr()
+            arrays[f"shard{shard}_indptr"] = part.indptr
+            arrays[f"shard{shard}_indices"] = part.indices
+            arrays[f"shard{shard}_size"] = np.array([high - low])
+
+        for name, array in arrays.items():
+            descriptors[name] = _to_shared(array, self._blocks)
+        shared = {name: _attach(d, self._blocks) for name, d in descriptors.items()}
+
+        def shared_matrix(name, shape):
+            return sparse.csr_matrix(
+                (
+                    shared[f"{name}_data"],
+                    shared[f"{name}_indices"],
+                    shared[f"{name}_indptr"],
+                ),
+                shape=shape,
+                copy=False,
+            )
+
+        super().__init__(
+            index.user_ids,
+            index.movie_ids,
+            shared_matrix("user_movies", index.user_movies.shape),
+            index.rating_threshold,
+            movie_users=shared_matrix("movie_users", index.movie_users.shape),
+            movie_counts=index.movie_counts,
+            user_rated=index.user_rated,
+        )
+        self._descriptors = descriptors
+        self._owner = os.getpid()
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self):
+        """Returns the pool of this process, started on first use."""
+        # A forked process, e.g. a Gunicorn or batch worker, cannot use the pool of
+        # its parent and starts its own on the same shared memory
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self._descriptors,)
+            )
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _split(self, user_codes):
+        """Splits sorted user codes at the shard boundaries."""
+        cuts = np.searchsorted(user_codes, self.shard_bounds[1:-1])
+        return np.split(user_codes, cuts)
+
+    def _base_movie_counts(self, user_codes):
+        if len(user_codes) < max(self.min_parallel_rows, 1):
+            return super()._base_movie_counts(user_codes)
+        pieces = [p for p in self._split(np.sort(user_codes)) if len(p)]
+        partials = self._executor().map(
+            _count_shard, pieces, [self._base_movies] * len(pieces)
+        )
+        return np.sum(list(partials), axis=0, dtype=np.int64)
+
+    def _base_distinct_users(self, movie_codes):
+        movie_codes = np.asarray(movie_codes)
+        indptr = self.movie_users.indptr
+        if (
+            np.sum(indptr[movie_codes + 1] - indptr[movie_codes])
+            < self.min_parallel_rows
+        ):
+            return super()._base_distinct_users(movie_codes)
+        shards = range(len(self.shard_bounds) - 1)
+        return sum(
+            self._executor().map(_distinct_shard, shards, [movie_codes] * len(shards))
+        )
+
+    def close(self):
+        """
+        Shuts the pool down and releases the shared memory, which is only removed
+        by the process that created it.
+        """
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown()
+        self._pool = None
+        self.user_movies = self.movie_users = self.user_rated = None
+        for block in self._blocks:
+            try:
+                block.close()
+                if self._owner == os.getpid():
+                    block.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,739 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Arrays written by RatingsIndex.save, one .npy file each
+INDEX_ARRAYS = (
+    "user_ids",
+    "movie_ids",
+    "user_movies_data",
+    "user_movies_indices",
+    "user_movies_indptr",
+    "movie_users_data",
+    "movie_users_indices",
+    "movie_users_indptr",
+    "user_rated_data",
+    "user_rated_indices",
+    "user_rated_indptr",
+    "movie_counts",
+)
+
+
+def _positions(sorted_ids, ids):
+    """Returns the position of each ID in sorted_ids, -1 for IDs that are not in it."""
+    ids = np.asarray(ids)
+    positions = np.full(len(ids), -1, dtype=np.intp)
+    if len(sorted_ids):
+        found = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        hit = sorted_ids[found] == ids
+        positions[hit] = found[hit]
+    return positions
+
+
+class RatingsIndex:
+    """
+    Precomputed sparse indexes over the high ratings used for collaborative filtering.
+
+    Only ratings above ``rating_threshold`` are kept. Users and movies are mapped to
+    contiguous codes so that the adjacency can be held as two CSR matrices:
+    ``user_movies`` (user -> high-rated movies) and ``movie_users``
+    (movie -> users who rated it highly). The per-movie "all users" high-rating
+    counts are computed once at build time. A third matrix, ``user_rated``, holds
+    every movie of the index a user rated at all, whatever the rating, so that
+    seen movies can be excluded from that user's recommendations.
+
+    New ratings are applied with ``apply_ratings`` without rebuilding the matrices:
+    changed (user, movie) pairs are held in a small overlay that every lookup
+    consults, ``movie_counts`` is updated in place and unseen users and movies get
+    codes after the existing ones. ``compact`` folds the overlay into fresh matrices.
+    """
+
+    def __init__(
+        self,
+        user_ids,
+        movie_ids,
+        user_movies,
+        rating_threshold=4.0,
+        movie_users=None,
+        movie_counts=None,
+        user_rated=None,
+    ):
+        """
+        Args:
+            user_ids (ndarray): Sorted user IDs, the position of an ID is its user code.
+            movie_ids (ndarray): Sorted movie IDs, the position of an ID is its movie code.
+            user_movies (csr_matrix): Users x movies matrix of high-rating counts.
+            rating_threshold (float): Ratings strictly above this value count as high.
+            movie_users (csr_matrix, optional): Transpose of user_movies, derived if omitted.
+            movie_counts (ndarray, optional): Column sums of user_movies, derived if omitted.
+            user_rated (csr_matrix, optional): Users x movies matrix marking every
+                rated pair, the high-rated pairs of user_movies if omitted.
+        """
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self.user_movies = sparse.csr_matrix(user_movies)
+        if movie_users is None:
+            movie_users = self.user_movies.T.tocsr()
+        self.movie_users = sparse.csr_matrix(movie_users)
+        if movie_counts is None:
+            movie_counts = np.asarray(self.user_movies.sum(axis=0)).ravel()
+        self.movie_counts = np.asarray(movie_counts)
+        if user_rated is None:
+            user_rated = (self.user_movies > 0).astype(np.int8)
+        self.user_rated = sparse.csr_matrix(user_rated)
+        self.rating_threshold = rating_threshold
+        # Codes below these belong to the matrices, later ones were added by updates
+        self._base_users, self._base_movies = self.user_movies.shape
+        self._extra_codes = {"user": {}, "movie": {}}
+        # Overridden pairs as {user code: {movie code: (value, base value)}} and the
+        # same pairs keyed by movie code first
+        self._user_overrides = {}
+        self._movie_overrides = {}
+        # Pairs rated since the matrices were built, as {user code: {movie codes}}
+        self._rated_overrides = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_pairs(
+        cls,
+        user_ids,
+        movie_ids,
+        rating_threshold=4.0,
+        rated_user_ids=None,
+        rated_movie_ids=None,
+    ):
+        """
+        Builds the index from parallel arrays of (userId, movieId) high-rating pairs.
+
+        Args:
+            user_ids (array-like): User ID of each high rating.
+            movie_ids (array-like): Movie ID of each high rating.
+            rating_threshold (float): The threshold the pairs were filtered with.
+            rated_user_ids (array-like, optional): User ID of every rating, whatever
+                its value. Pairs whose user or movie has no high rating are dropped.
+            rated_movie_ids (array-like, optional): Movie ID of every rating.
+
+        Returns:
+            RatingsIndex: The built index.
+        """
+        unique_users, user_codes = np.unique(
+            np.asarray(user_ids, dtype=np.int32), return_inverse=True
+        )
+        unique_movies, movie_codes = np.unique(
+            np.asarray(movie_ids, dtype=np.int32), return_inverse=True
+        )
+        user_movies = sparse.csr_matrix(
+            (np.ones(len(user_codes), dtype=np.int32), (user_codes, movie_codes)),
+            shape=(len(unique_users), len(unique_movies)),
+        )
+        user_movies.sum_duplicates()
+        user_rated = None
+        if rated_user_ids is not None:
+            rated_users = _positions(unique_users, rated_user_ids)
+            rated_movies = _positions(unique_movies, rated_movie_ids)
+            known = (rated_users >= 0) & (rated_movies >= 0)
+            user_rated = sparse.csr_matrix(
+                (
+                    np.ones(np.count_nonzero(known), dtype=np.int8),
+                    (rated_users[known], rated_movies[known]),
+                ),
+                shape=user_movies.shape,
+            )
+            # Duplicates are summed, so the pairs are marked with ones again after
+            user_rated = ((user_rated + user_movies) > 0).astype(np.int8)
+        return cls(
+            unique_users,
+            unique_movies,
+            user_movies,
+            rating_threshold,
+            user_rated=user_rated,
+        )
+
+    @classmethod
+    def from_ratings(cls, ratings, rating_threshold=4.0):
+        """
+        Builds the index from a ratings DataFrame.
+
+        Args:
+            ratings (DataFrame): Ratings with 'userId', 'movieId' and 'rating' columns.
+            rating_threshold (float): Ratings strictly above this value count as high.
+
+        Returns:
+            RatingsIndex: The built index.
+        """
+        high = ratings[ratings["rating"] > rating_threshold]
+        return cls.from_pairs(
+            high["userId"].to_numpy(),
+            high["movieId"].to_numpy(),
+            rating_threshold,
+            ratings["userId"].to_numpy(),
+            ratings["movieId"].to_numpy(),
+        )
+
+    def save(self, directory):
+        """
+        Writes the index arrays as raw .npy files so they can be memory-mapped.
+
+        Args:
+            directory (str): Directory to write the arrays into.
+
+        Raises:
+            ValueError: If updates are pending, compact the index first.
+        """
+        if self.pending:
+            raise ValueError("The index has pending updates, compact it before saving")
+        os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "user_ids": self.user_ids,
+            "movie_ids": self.movie_ids,
+            "movie_counts": self.movie_counts,
+        }
+        for name in ("user_movies", "movie_users", "user_rated"):
+            matrix = getattr(self, name)
+            arrays[f"{name}_data"] = matrix.data
+            arrays[f"{name}_indices"] = matrix.indices
+            arrays[f"{name}_indptr"] = matrix.indptr
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), arrays[name])
+
+    @classmethod
+    def load(cls, directory, rating_threshold=4.0, mmap_mode="r"):
+        """
+        Loads an index written by save, memory-mapping the arrays by default.
+
+        Args:
+            directory (str): Directory the arrays were saved into.
+            rating_threshold (float): The threshold the index was built with.
+            mmap_mode (str or None): Passed to numpy.load; None reads into memory.
+
+        Returns:
+            RatingsIndex: The loaded index.
+        """
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in INDEX_ARRAYS
+        }
+        shape = (len(arrays["user_ids"]), len(arrays["movie_ids"]))
+        user_movies, movie_users, user_rated = (
+            sparse.csr_matrix(
+                (
+                    arrays[f"{name}_data"],
+                    arrays[f"{name}_indices"],
+                    arrays[f"{name}_indptr"],
+                ),
+                shape=matrix_shape,
+                copy=False,
+            )
+            for name, matrix_shape in (
+                ("user_movies", shape),
+                ("movie_users", shape[::-1]),
+                ("user_rated", shape),
+            )
+        )
+        return cls(
+            arrays["user_ids"],
+            arrays["movie_ids"],
+            user_movies,
+            rating_threshold,
+            movie_users=movie_users,
+            movie_counts=arrays["movie_counts"],
+            user_rated=user_rated,
+        )
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_movies(self):
+        return len(self.movie_ids)
+
+    @property
+    def pending(self):
+        """Number of (user, movie) pairs overridden by updates since the last compaction."""
+        users = set(self._user_overrides) | set(self._rated_overrides)
+        return sum(
+            len(
+                self._user_overrides.get(user, {}).keys()
+                | self._rated_overrides.get(user, set())
+            )
+            for user in users
+        )
+
+    def _lookup(self, ids, kind):
+        """Maps IDs to codes, -1 for IDs that are not in the index."""
+        ids = np.asarray(ids)
+        known_ids, base = (
+            (self.user_ids, self._base_users)
+            if kind == "user"
+            else (self.movie_ids, self._base_movies)
+        )
+        codes = _positions(known_ids[:base], ids)
+        extra = self._extra_codes[kind]
+        if extra:
+            for i in np.flatnonzero(codes < 0):
+                codes[i] = extra.get(int(ids[i]), -1)
+        return codes
+
+    def _codes(self, ids, kind):
+        """Maps IDs to codes, dropping IDs that are not in the index."""
+        codes = self._lookup(ids, kind)
+        return codes[codes >= 0]
+
+    def _similar_user_codes(self, movie_id):
+        """Returns the codes of the users who rated the movie highly."""
+        codes = self._codes([movie_id], "movie")
+        if len(codes) == 0:
+            return self.movie_users.indices[:0]
+        row = codes[0]
+        if row < self._base_movies:
+            start, end = self.movie_users.indptr[row], self.movie_users.indptr[row + 1]
+            users = self.movie_users.indices[start:end]
+        else:
+            users = self.movie_users.indices[:0]
+        with self._lock:
+            overrides = dict(self._movie_overrides.get(row, {}))
+        if overrides:
+            removed = [u for u, (value, _) in overrides.items() if value == 0]
+            added = [u for u, (value, _) in overrides.items() if value > 0]
+            users = np.union1d(np.setdiff1d(users, removed), added).astype(users.dtype)
+        return users
+
+    def _base_movie_counts(self, user_codes):
+        """Counts the high ratings the given users have in the matrices per movie code."""
+        rows = self.user_movies[user_codes]
+        return np.bincount(
+            rows.indices, weights=rows.data, minlength=self._base_movies
+        ).astype(np.int64)
+
+    def _base_distinct_users(self, movie_codes):
+        """Counts the distinct users of the matrices who rated any of the movies highly."""
+        seen = np.zeros(self._base_users, dtype=bool)
+        seen[self.movie_users[movie_codes].indices] = True
+        return int(np.count_nonzero(seen))
+
+    def _movie_counts_for(self, user_codes):
+        """Counts the high ratings the given users gave to every movie code."""
+        user_codes = np.asarray(user_codes)
+        counts = self._base_movie_counts(user_codes[user_codes < self._base_users])
+        if self.n_movies > len(counts):
+            counts = np.concatenate(
+                [counts, np.zeros(self.n_movies - len(counts), dtype=np.int64)]
+            )
+        with self._lock:
+            if not self._user_overrides:
+                return counts
+            overrides = [
+                list(self._user_overrides[user].items())
+                for user in np.intersect1d(user_codes, list(self._user_overrides))
+            ]
+        for items in overrides:
+            for movie, (value, base) in items:
+                counts[movie] += value - base
+        return counts
+
+    def _distinct_users(self, movie_codes):
+        """Counts the distinct users who rated at least one of the movies highly."""
+        movie_codes = np.asarray(movie_codes, dtype=np.intp)
+        base_codes = movie_codes[movie_codes < self._base_movies]
+        with self._lock:
+            overrides = [
+                list(self._movie_overrides[movie].items())
+                for movie in np.intersect1d(movie_codes, list(self._movie_overrides))
+            ]
+        if not overrides:
+            return self._base_distinct_users(base_codes)
+        # Number of the movies each user rated highly, corrected by the overrides
+        hits = np.bincount(
+            self.movie_users[base_codes].indices, minlength=self.n_users
+        ).astype(np.int64)
+        for items in overrides:
+            for user, (value, base) in items:
+                hits[user] += (value > 0) - (base > 0)
+        return int(np.count_nonzero(hits))
+
+    def _base_value(self, user, movie, matrix=None):
+        """Returns the value of a pair in user_movies, or in another users x movies matrix."""
+        matrix = self.user_movies if matrix is None else matrix
+        if user >= self._base_users or movie >= self._base_movies:
+            return 0
+        start, end = matrix.indptr[user], matrix.indptr[user + 1]
+        row = matrix.indices[start:end]
+        position = start + np.searchsorted(row, movie)
+        if position < end and matrix.indices[position] == movie:
+            return int(matrix.data[position])
+        return 0
+
+    def _liked_codes(self, user):
+        """Returns the codes of the movies a user currently rates highly."""
+        if user < self._base_users:
+            start, end = (
+                self.user_movies.indptr[user],
+                self.user_movies.indptr[user + 1],
+            )
+            movies = set(self.user_movies.indices[start:end].tolist())
+        else:
+            movies = set()
+        for movie, (value, _) in self._user_overrides.get(user, {}).items():
+            if value > 0:
+                movies.add(movie)
+            else:
+                movies.discard(movie)
+        return movies
+
+    def _add_ids(self, ids, kind):
+        """Gives codes to IDs not in the index yet, after the existing codes."""
+        codes = self._lookup(ids, kind)
+        new_ids = np.unique(np.asarray(ids)[codes < 0])
+        if len(new_ids) == 0:
+            return codes
+        extra = self._extra_codes[kind]
+        if kind == "user":
+            first = self.n_users
+            self.user_ids = np.concatenate([self.user_ids, new_ids])
+        else:
+            first = self.n_movies
+            # Counts are extended before the IDs so readers never index past them
+            self.movie_counts = np.concatenate(
+                [
+                    self.movie_counts,
+                    np.zeros(len(new_ids), dtype=self.movie_counts.dtype),
+                ]
+            )
+            self.movie_ids = np.concatenate([self.movie_ids, new_ids])
+        for i, new_id in enumerate(new_ids.tolist()):
+            extra[new_id] = first + i
+        return self._lookup(ids, kind)
+
+    def apply_ratings(self, ratings):
+        """
+        Applies new or changed ratings to the index in place.
+
+        Rows are applied in order, so a later rating of the same user and movie
+        replaces an earlier one. A rating above the threshold marks the pair as
+        rated highly, any other rating unmarks it.
+
+        Args:
+            ratings (DataFrame): Ratings with 'userId', 'movieId' and 'rating' columns.
+
+        Returns:
+            ndarray, ndarray: IDs of the movies whose high ratings changed, and IDs of
+            the movies the affected users rate highly before or after the update.
+        """
+        with self._lock:
+            # A private, writable copy of the counts, the loaded one may be memory-mapped
+            self.movie_counts = np.array(self.movie_counts, dtype=np.int64)
+            user_codes = self._add_ids(ratings["userId"].to_numpy(), "user")
+            movie_codes = self._add_ids(ratings["movieId"].to_numpy(), "movie")
+            high = ratings["rating"].to_numpy() > self.rating_threshold
+
+            changed_movies, changed_users, liked = set(), set(), set()
+            for user, movie, is_high in zip(
+                user_codes.tolist(), movie_codes.tolist(), high.tolist()
+            ):
+                if not self._base_value(user, movie, self.user_rated):
+                    self._rated_overrides.setdefault(user, set()).add(movie)
+                user_overrides = self._user_overrides.setdefault(user, {})
+                if movie in user_overrides:
+                    current, base = user_overrides[movie]
+                else:
+                    current = base = self._base_value(user, movie)
+                value = 1 if is_high else 0
+                if (value > 0) == (current > 0):
+                    if not user_overrides:
+                        del self._user_overrides[user]
+                    continue
+                if user not in changed_users:
+                    liked |= self._liked_codes(user)
+                    changed_users.add(user)
+                self.movie_counts[movie] += value - current
+                if value == base:
+                    del user_overrides[movie]
+                    del self._movie_overrides[movie][user]
+                    if not user_overrides:
+                        del self._user_overrides[user]
+                    if not self._movie_overrides[movie]:
+                        del self._movie_overrides[movie]
+                else:
+                    user_overrides[movie] = (value, base)
+                    self._movie_overrides.setdefault(movie, {})[user] = (value, base)
+                changed_movies.add(movie)
+            for user in changed_users:
+                liked |= self._liked_codes(user)
+        return (
+            self.movie_ids[sorted(changed_movies)],
+            self.movie_ids[sorted(liked)],
+        )
+
+    def compact(self):
+        """
+        Builds a new index with the pending updates folded into its matrices.
+
+        The index itself is left unchanged so that readers can keep using it until
+        the compacted one is swapped in.
+
+        Returns:
+            RatingsIndex: The compacted index.
+        """
+        with self._lock:
+            base = self.user_movies.tocoo()
+            users = [base.row.astype(np.intp)]
+            movies = [base.col.astype(np.intp)]
+            values = [base.data.astype(np.int64)]
+            for user, overrides in self._user_overrides.items():
+                for movie, (value, old) in overrides.items():
+                    users.append(np.array([user]))
+                    movies.append(np.array([movie]))
+                    values.append(np.array([value - old]))
+            rated = self.user_rated.tocoo()
+            rated_users, rated_movies = [rated.row], [rated.col]
+            for user, overrides in self._rated_overrides.items():
+                rated_users.append(np.full(len(overrides), user))
+                rated_movies.append(np.fromiter(overrides, dtype=np.intp))
+            user_ids, movie_ids = self.user_ids.copy(), self.movie_ids.copy()
+        pairs = sparse.coo_matrix(
+            (np.concatenate(values), (np.concatenate(users), np.concatenate(movies))),
+            shape=(len(user_ids), len(movie_ids)),
+        ).tocsr()
+        pairs.eliminate_zeros()
+        pairs = pairs.tocoo()
+        return RatingsIndex.from_pairs(
+            np.repeat(user_ids[pairs.row], pairs.data),
+            np.repeat(movie_ids[pairs.col], pairs.data),
+            self.rating_threshold,
+            user_ids[np.concatenate(rated_users)],
+            movie_ids[np.concatenate(rated_movies)],
+        )
+
+    def popularity(self, movie_ids):
+        """
+        Returns the number of high ratings of each movie, 0 for unknown movies.
+
+        Args:
+            movie_ids (array-like): Movie IDs to look up.
+
+        Returns:
+            ndarray: High-rating counts aligned with movie_ids.
+        """
+        codes = self._lookup(movie_ids, "movie")
+        popularity = np.zeros(len(codes), dtype=np.int64)
+        known = codes >= 0
+        popularity[known] = self.movie_counts[codes[known]]
+        return popularity
+
+    def similar_users(self, movie_id):
+        """
+        Finds users who rated the specified movie highly.
+
+        Args:
+            movie_id (int): The movie ID.
+
+        Returns:
+            ndarray: Array of user IDs who rated the movie highly.
+        """
+        return self.user_ids[self._similar_user_codes(movie_id)]
+
+    def co_liked_movies(self, movie_ids):
+        """
+        Finds the movies liked by a user who likes any of the given movies, i.e. the
+        seeds that have one of them among their candidates.
+
+        Args:
+            movie_ids (array-like): Movie IDs.
+
+        Returns:
+            ndarray: Sorted IDs of the co-liked movies, including the given ones.
+        """
+        users = self.similar_users_of(movie_ids)
+        return np.sort(self.similar_user_counts(users).index.to_numpy())
+
+    def similar_users_of(self, movie_ids):
+        """
+        Finds the users who rated any of the given movies highly.
+
+        Args:
+            movie_ids (array-like): Movie IDs.
+
+        Returns:
+            ndarray: Sorted IDs of the users who rated at least one movie highly.
+        """
+        codes = np.unique(self._codes(movie_ids, "movie"))
+        with self._lock:
+            overridden = codes[np.isin(codes, list(self._movie_overrides))]
+        # Movies without pending updates are read straight from the matrix
+        plain = np.setdiff1d(codes[codes < self._base_movies], overridden)
+        users = [self.movie_users[plain].indices] + [
+            self._similar_user_codes(movie_id)
+            for movie_id in self.movie_ids[overridden]
+        ]
+        return np.sort(self.user_ids[np.unique(np.concatenate(users))])
+
+    def liked_movies(self, user_id):
+        """
+        Finds the movies a user rated highly.
+
+        Args:
+            user_id (int): The user ID.
+
+        Returns:
+            ndarray: Sorted IDs of the movies the user rated highly, empty for
+            unknown users.
+        """
+        codes = self._codes([user_id], "user")
+        if len(codes) == 0:
+            return self.movie_ids[:0]
+        with self._lock:
+            liked = self._liked_codes(codes[0])
+        return np.sort(
+            self.movie_ids[np.fromiter(liked, dtype=np.intp, count=len(liked))]
+        )
+
+    def rated_movies(self, user_id):
+        """
+        Finds the movies a user rated, whatever the rating.
+
+        Args:
+            user_id (int): The user ID.
+
+        Returns:
+            ndarray: Sorted IDs of the movies of the index the user rated, empty for
+            unknown users.
+        """
+        codes = self._codes([user_id], "user")
+        if len(codes) == 0:
+            return self.movie_ids[:0]
+        user = codes[0]
+        rated = set()
+        if user < self._base_users:
+            start, end = self.user_rated.indptr[user], self.user_rated.indptr[user + 1]
+            rated.update(self.user_rated.indices[start:end].tolist())
+        with self._lock:
+            rated |= self._rated_overrides.get(user, set())
+        return np.sort(
+            self.movie_ids[np.fromiter(rated, dtype=np.intp, count=len(rated))]
+        )
+
+    def similar_user_counts(self, similar_users):
+        """
+        Counts how many high ratings the given users gave to every movie.
+
+        Args:
+            similar_users (ndarray): Array of user IDs.
+
+        Returns:
+            Series: High-rating counts indexed by movie ID, most frequent first.
+        """
+        counts = self._movie_counts_for(self._codes(similar_users, "user"))
+        return self._counts_series(self._in_id_order(np.flatnonzero(counts)), counts)
+
+    def all_user_counts(self, movie_ids):
+        """
+        Looks up the precomputed high-rating counts of the given movies and the number
+        of distinct users behind them.
+
+        Args:
+            movie_ids (array-like): Movie IDs to look up.
+
+        Returns:
+            Series, int: Counts indexed by movie ID, and the number of distinct users
+            who rated at least one of the movies highly.
+        """
+        codes = self._codes(movie_ids, "movie")
+        return (
+            self._counts_series(codes, self.movie_counts.astype(np.int64)),
+            self._distinct_users(codes),
+        )
+
+    def score_movie(
+        self,
+        movie_id,
+        min_similar_share=0.10,
+        min_support=1,
+        max_similar_users=None,
+        sample_seed=0,
+    ):
+        """
+        Computes the same scores as score_similar_movies using only array operations.
+
+        Candidates are ordered by descending score, then by descending count among
+        the similar users and ascending movie ID, which matches the order produced
+        by the pandas path for this index.
+
+        Args:
+            movie_id (int): The movie ID.
+            min_similar_share (float): Minimum share of similar users who must have
+                rated a candidate highly.
+            min_support (int): Minimum number of similar users who must have rated
+                a candidate highly.
+            max_similar_users (int, optional): Score from a deterministic sample of
+                at most this many similar users, the same as get_similar_users draws.
+            sample_seed (int): Seed of the similar-user sample.
+
+        Returns:
+            ndarray, ndarray: Candidate movie IDs and their scores.
+        """
+        user_codes = self._similar_user_codes(movie_id)
+        if max_similar_users is not None and len(user_codes) > max_similar_users:
+            user_codes = reservoir_sample(
+                user_codes[np.argsort(self.user_ids[user_codes])],
+                max_similar_users,
+                (sample_seed, int(movie_id)),
+            )
+        counts = self._movie_counts_for(user_codes)
+        similar = counts / len(user_codes) if len(user_codes) else counts * 0.0
+        candidates = self._in_id_order(
+            np.flatnonzero((similar > min_similar_share) & (counts >= min_support))
+        )
+        candidates = candidates[np.argsort(-counts[candidates], kind="stable")]
+        all_share = self.movie_counts[candidates].astype(np.int64) / max(
+            self._distinct_users(candidates), 1
+        )
+        scores = similar[candidates] / all_share
+        order = np.argsort(-scores, kind="stable")
+        return self.movie_ids[candidates[order]], scores[order]
+
+    def _in_id_order(self, codes):
+        """Sorts movie codes by ID, which only differs from code order after updates."""
+        if not self._extra_codes["movie"]:
+            return codes
+        return codes[np.argsort(self.movie_ids[codes], kind="stable")]
+
+    def _counts_series(self, codes, counts):
+        """Builds a value_counts-like Series for the given movie codes."""
+        codes = codes[np.argsort(-counts[codes], kind="stable")]
+        return pd.Series(
+            counts[codes],
+            index=pd.Index(self.movie_ids[codes], name="movieId"),
+            name="count",
+        )
+
+
+def reservoir_sample(values, k, seed=0):
+    """
+    Draws k of the values uniformly without replacement, deterministically.
+
+    Runs Algorithm R (reservoir sampling) vectorized: value i >= k replaces a
+    random slot j < k when j = randint(0, i] lands in the reservoir, the last
+    replacement of a slot winning. The sample only depends on the seed and on the
+    order of the values, so callers sort them to get the same sample from any path.
+
+    Args:
+        values (ndarray): The values to sample from.
+        k (int): Sample size.
+        seed (int or tuple): Seed of the random generator.
+
+    Returns:
+        ndarray: The sampled values, or all of them when there are at most k.
+    """
+    values = np.asarray(values)
+    if len(values) <= k:
+        return values
+    rng = np.random.default_rng(seed)
+    reservoir = values[:k].copy()
+    slots = rng.integers(0, np.arange(k + 1, len(values) + 1))
+    replaced = np.flatnonzero(slots < k)[::-1]
+    filled, last = np.unique(slots[replaced], return_index=True)
+    reservoir[filled] = values[k + replaced[last]]
+    return reservoir
@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import time
+import click
+import numpy as np
+from mylib.data_cache import load_ratings_index
+from mylib.ratings_index import RatingsIndex
+
+# Ratings used by the pool workers, inherited from the parent when it forks
+_RATINGS = None
+
+
+class RecommendationTable:
+    """
+    Precomputed top-N collaborative filtering recommendations for every movie.
+
+    Row i holds the recommendations of ``movie_ids[i]``; rows with fewer than
+    ``top_n`` recommendations are padded with -1 IDs and NaN scores. A dense
+    movieId -> row array makes each lookup a single array access.
+    """
+
+    def __init__(self, movie_ids, rec_ids, scores):
+        """
+        Args:
+            movie_ids (ndarray): Movie IDs the table holds recommendations for.
+            rec_ids (ndarray): (len(movie_ids), top_n) recommended movie IDs.
+            scores (ndarray): (len(movie_ids), top_n) recommendation scores.
+        """
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        self.rec_ids = np.asarray(rec_ids, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        size = int(self.movie_ids.max()) + 1 if len(self.movie_ids) else 0
+        self._rows = np.full(size, -1, dtype=np.int32)
+        self._rows[self.movie_ids] = np.arange(len(self.movie_ids), dtype=np.int32)
+
+    @property
+    def top_n(self):
+        return self.rec_ids.shape[1]
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def lookup(self, movie_id):
+        """
+        Looks up the precomputed recommendations of a movie.
+
+        Args:
+            movie_id (int): The movie ID.
+
+        Returns:
+            tuple or None: (recommended movie IDs, scores) sorted by descending score,
+            or None if the movie is not in the table.
+        """
+        movie_id = int(movie_id)
+        if not 0 <= movie_id < len(self._rows) or self._rows[movie_id] < 0:
+            return None
+        row = self._rows[movie_id]
+        valid = self.rec_ids[row] >= 0
+        return self.rec_ids[row][valid], self.scores[row][valid]
+
+    def discard(self, movie_ids):
+        """
+        Stops serving the recommendations of the given movies, e.g. after their
+        ratings changed, so that they are computed live instead.
+
+        Args:
+            movie_ids (array-like): Movie IDs to discard.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        movie_ids = movie_ids[(movie_ids >= 0) & (movie_ids < len(self._rows))]
+        self._rows[movie_ids] = -1
+
+    def save(self, filepath):
+        """
+        Writes the table to an .npz file.
+
+        Args:
+            filepath (str): Output path.
+        """
+        np.savez(
+            filepath, movie_ids=self.movie_ids, rec_ids=self.rec_ids, scores=self.scores
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Loads a table written by save.
+
+        Args:
+            filepath (str): Path to the .npz file.
+
+        Returns:
+            RecommendationTable: The loaded table.
+        """
+        with np.load(filepath) as arrays:
+            return cls(arrays["movie_ids"], arrays["rec_ids"], arrays["scores"])
+
+
+def _score_chunk(args):
+    """Computes the top-N recommendations for a chunk of movie IDs."""
+    movie_ids, top_n = args
+    rec_ids = np.full((len(movie_ids), top_n), -1, dtype=np.int32)
+    scores = np.full((len(movie_ids), top_n), np.nan)
+    for row, movie_id in enumerate(movie_ids):
+        ids, values = _RATINGS.score_movie(movie_id)
+        rec_ids[row, : min(len(ids), top_n)] = ids[:top_n]
+        scores[row, : min(len(ids), top_n)] = values[:top_n]
+    return rec_ids, scores
+
+
+def precompute_recommendations(
+    ratings, movie_ids=None, top_n=10, workers=None, chunk_size=256
+):
+    """
+    Computes the top-N recommendations of many movies across a process pool.
+
+    Args:
+        ratings (DataFrame or RatingsIndex): The ratings or their index. A DataFrame
+            is indexed once before the workers start.
+        movie_ids (array-like, optional): Movies to score, defaults to every movie
+            with a high rating.
+        top_n (int): Number of recommendations kept per movie.
+        workers (int, optional): Number of worker processes, defaults to all cores.
+        chunk_size (int): Number of movies scored per task.
+
+    Returns:
+        RecommendationTable: The precomputed recommendations.
+    """
+    global _RATINGS
+    if not isinstance(ratings, RatingsIndex):
+        ratings = RatingsIndex.from_ratings(ratings)
+    if movie_ids is None:
+        movie_ids = ratings.movie_ids
+    movie_ids = np.asarray(movie_ids, dtype=np.int32)
+    tasks = [
+        (movie_ids[start : start + chunk_size], top_n)
+        for start in range(0, len(movie_ids), chunk_size)
+    ]
+    _RATINGS = ratings
+    try:
+        if workers == 1:
+            results = list(map(_score_chunk, tasks))
+        else:
+            # fork shares the ratings with the workers without pickling them
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers) as pool:
+                results = pool.map(_score_chunk, tasks)
+    finally:
+        _RATINGS = None
+    if not results:
+        return RecommendationTable(
+            movie_ids, np.empty((0, top_n)), np.empty((0, top_n))
+        )
+    return RecommendationTable(
+        movie_ids,
+        np.concatenate([rec_ids for rec_ids, _ in results]),
+        np.concatenate([scores for _, scores in results]),
+    )
+
+
+@click.command()
+@click.option("--ratings", "ratings_filepath", default="./data/ratings.csv")
+@click.option("--output", default="./data/.cache/recommendations.npz")
+@click.option(
+    "--top-n", default=10, show_default=True, help="Recommendations per movie."
+)
+@click.option("--workers", type=int, default=None, help="Defaults to all cores.")
+def main(ratings_filepath, output, top_n, workers):
+    """Precompute the top-N recommendations of every movie."""
+    start = time.perf_counter()
+    ratings = load_ratings_index(ratings_filepath)
+    table = precompute_recommendations(ratings, top_n=top_n, workers=workers)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    table.save(output)
+    click.echo(
+        f"Wrote recommendations for {len(table)} movies to {output} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from mylib.data_cache import load_movies, load_ratings_index, load_vectorizer
+from mylib.movie_utils import (
+    append_titles,
+    clean_title,
+    clean_titles,
+    extract_years,
+    initialize_vectorizer,
+    search_movies,
+)
+from mylib.item_embeddings import ItemEmbeddings
+from mylib.fuzzy_index import FuzzyTitleIndex
+from mylib.movie_catalog import MovieCatalog
+from mylib.parallel_index import ShardedRatingsIndex
+from mylib.ratings_index import RatingsIndex
+from mylib.recommendation_table import RecommendationTable
+from mylib.recommender_utils import (
+    add_popularity,
+    find_similar_movies,
+    recommend_for_user,
+)
+from mylib.result_cache import LRUCache
+from mylib.title_index import TitleIndex
+
+# Search results below this similarity are not considered a match
+MIN_SIMILARITY = 0.2
+
+# Default locations of the datasets, relative to the repository root
+MOVIES_FILEPATH = "./data/movies.csv"
+RATINGS_FILEPATH = "./data/ratings.csv"
+TABLE_FILEPATH = "./data/.cache/recommendations.npz"
+EMBEDDINGS_FILEPATH = "./data/.cache/embeddings.npz"
+
+# Seconds a replaced sharded index stays open for the requests still using it
+SHARDED_CLOSE_DELAY = 60
+
+
+def default_shards():
+    """
+    Returns the number of shards set by the RECOMMENDER_SHARDS environment variable.
+
+    Returns:
+        int or None: The number of shards, None (serial counting) when unset or 0.
+    """
+    return int(os.environ.get("RECOMMENDER_SHARDS", 0)) or None
+
+
+class RecommenderModel:
+    """
+    Holds the movies, the ratings index and the TF-IDF matrix for a serving process.
+
+    Everything is loaded once and only read afterwards, so a model loaded before
+    the web server forks its workers is shared between them copy-on-write.
+    Search and recommendation results are kept in per-process LRU caches that are
+    cleared whenever the data is (re)loaded. New ratings are applied with
+    ``apply_ratings``, which only invalidates the affected recommendations, and
+    new movies with ``add_movies``.
+
+    The movies, vectorizer, title index, movie catalog and trigram index are
+    published together as one tuple, so a request always sees a consistent set even while movies are
+    being added.
+
+    Loading is staged: search is served as soon as the movies and the vectorizer
+    are loaded, while the ratings index, which takes far longer on large datasets,
+    is still loading. Recommendation calls block until the ratings are ready.
+    """
+
+    def __init__(
+        self,
+        movies_filepath=MOVIES_FILEPATH,
+        ratings_filepath=RATINGS_FILEPATH,
+        table_filepath=TABLE_FILEPATH,
+        embeddings_filepath=EMBEDDINGS_FILEPATH,
+        cache_size=4096,
+        cache_ttl=None,
+        compact_threshold=100_000,
+        refit_fraction=0.10,
+        shards=None,
+    ):
+        """
+        Args:
+            movies_filepath (str): Path to the movies CSV file.
+            ratings_filepath (str): Path to the ratings CSV file.
+            table_filepath (str, optional): Path to precomputed recommendations, used
+                when the file exists.
+            embeddings_filepath (str, optional): Path to item embeddings, which
+                enable the "ann" recommendation mode when the file exists.
+            cache_size (int): Maximum number of cached results per endpoint.
+            cache_ttl (float, optional): Seconds after which cached results expire.
+            compact_threshold (int): Number of pending rating updates after which
+                they are compacted into the ratings index.
+            refit_fraction (float): Share of appended titles, relative to the
+                catalogue, after which the vectorizer is refit in the background.
+            shards (int, optional): Split the ratings index into this many shards
+                counted across a process pool, see ShardedRatingsIndex. Counting is
+                serial when None.
+        """
+        self.movies_filepath = movies_filepath
+        self.ratings_filepath = ratings_filepath
+        self.table_filepath = table_filepath
+        self.embeddings_filepath = embeddings_filepath
+        self.ratings = None
+        self.table = None
+        self.embeddings = None
+        # (movies, vectorizer, title index, movie catalog, trigram index), replaced
+        # as a whole
+        self._catalogue = (None, None, None, None, None)
+        self._appended = 0
+        self.error = None
+        self.search_cache = LRUCache(cache_size, cache_ttl)
+        self.recommend_cache = LRUCache(cache_size, cache_ttl)
+        self.compact_threshold = compact_threshold
+        self.refit_fraction = refit_fraction
+        self.shards = shards
+        self._search_ready = threading.Event()
+        self._ready = threading.Event()
+        self._update_lock = threading.Lock()
+
+    @classmethod
+    def from_data(cls, movies, ratings, table=None, embeddings=None, **kwargs):
+        """
+        Builds a ready model from already loaded data.
+
+        Args:
+            movies (DataFrame): The movies DataFrame with a 'clean_title' column.
+            ratings (DataFrame or RatingsIndex): The ratings or their index.
+            table (RecommendationTable, optional): Precomputed recommendations.
+            embeddings (ItemEmbeddings, optional): Item embeddings for "ann" mode.
+            **kwargs: Cache and update settings passed to the constructor.
+
+        Returns:
+            RecommenderModel: The warm model.
+        """
+        model = cls(None, None, None, None, **kwargs)
+        model.table = table
+        model.embeddings = embeddings
+        model._set_catalogue(movies)
+        model._set_ratings(ratings)
+        return model
+
+    @property
+    def movies(self):
+        return self._catalogue[0]
+
+    @property
+    def vectorizer(self):
+        return self._catalogue[1]
+
+    @property
+    def tfidf(self):
+        return self._catalogue[2]
+
+    @property
+    def catalog(self):
+        return self._catalogue[3]
+
+    @property
+    def fuzzy(self):
+        return self._catalogue[4]
+
+    @property
+    def ready(self):
+        """True once the data is loaded and requests can be served."""
+        return self._ready.is_set() and self.error is None
+
+    @property
+    def search_ready(self):
+        """True once the movies are loaded and titles can be searched."""
+        return self._search_ready.is_set() and self.error is None
+
+    def _set_catalogue(self, movies, vectorizer=None, tfidf=None):
+        # Search ranks equally similar titles by popularity, unknown until the
+        # ratings are loaded
+        if "popularity" not in movies.columns:
+            movies = movies.assign(popularity=0)
+        if vectorizer is None:
+            vectorizer, tfidf = initialize_vectorizer(movies)
+        self._catalogue = (
+            movies,
+            vectorizer,
+            TitleIndex(tfidf),
+            MovieCatalog.from_movies(movies),
+            FuzzyTitleIndex(movies["clean_title"].tolist()),
+        )
+        self._appended = 0
+        self.search_cache.clear()
+        self._search_ready.set()
+
+    def _sharded(self, ratings):
+        """Wraps a ratings index into a ShardedRatingsIndex when shards are set."""
+        if self.shards and type(ratings) is RatingsIndex:
+            return ShardedRatingsIndex(ratings, self.shards)
+        return ratings
+
+    def _set_ratings(self, ratings):
+        ratings = self._sharded(ratings)
+        with self._update_lock:
+            movies, *indexes = self._catalogue
+            self.ratings = ratings
+            self._catalogue = (add_popularity(movies, ratings), *indexes)
+            self.search_cache.clear()
+            self.recommend_cache.clear()
+        self._ready.set()
+
+    def load(self):
+        """
+        Loads the datasets and the persisted vectorizer, blocking until done.
+
+        Search is ready, see search_ready, before the ratings start loading.
+        """
+        try:
+            movies = load_movies(self.movies_filepath)
+            self._set_catalogue(movies, *load_vectorizer(self.movies_filepath, movies))
+            ratings = load_ratings_index(self.ratings_filepath)
+            if self.table_filepath and os.path.exists(self.table_filepath):
+                self.table = RecommendationTable.load(self.table_filepath)
+            if self.embeddings_filepath and os.path.exists(self.embeddings_filepath):
+                self.embeddings = ItemEmbeddings.load(self.embeddings_filepath)
+            self._set_ratings(ratings)
+        except Exception as e:
+            self.error = e
+            # Wakes up the callers waiting for data that will not come
+            self._search_ready.set()
+            self._ready.set()
+            raise
+
+    def load_async(self):
+        """
+        Loads the model in a background thread.
+
+        Returns:
+            Thread: The loading thread.
+        """
+        thread = threading.Thread(target=self._load_quietly, daemon=True)
+        thread.start()
+        return thread
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:  # recorded in self.error and reported by readiness checks
+            pass
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the model is ready.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the model is ready.
+        """
+        return self._ready.wait(timeout) and self.error is None
+
+    def _wait_for(self, event):
+        """Blocks until a loading stage is done, raising the error if loading failed."""
+        event.wait()
+        if self.error is not None:
+            raise self.error
+
+    def search(self, title, fuzzy=False):
+        """
+        Searches movie titles, see search_movies.
+
+        Args:
+            title (str): The title to search for.
+            fuzzy (bool): Also match misspelled and truncated words through the
+                trigram index.
+
+        Returns:
+            DataFrame: The most similar movies.
+        """
+        self._wait_for(self._search_ready)
+        movies, vectorizer, tfidf, _, trigrams = self._catalogue
+        return search_movies(
+            title,
+            movies,
+            vectorizer,
+            tfidf,
+            self.search_cache,
+            min_similarity=MIN_SIMILARITY,
+            fuzzy=trigrams if fuzzy else None,
+        )
+
+    def autocomplete(self, prefix, k=10):
+        """
+        Completes a partially typed title, see FuzzyTitleIndex.autocomplete.
+
+        Args:
+            prefix (str): The typed text.
+            k (int): Maximum number of completions.
+
+        Returns:
+            DataFrame: The completed movies with a 'score' column, titles starting
+            with the prefix first, most popular first.
+        """
+        self._wait_for(self._search_ready)
+        movies, _, _, _, trigrams = self._catalogue
+        rows, scores = trigrams.autocomplete(
+            clean_title(prefix),
+            k,
+            movies["popularity"].to_numpy(),
+            min_similarity=MIN_SIMILARITY,
+        )
+        results = movies.iloc[rows]
+        return results.assign(score=scores)
+
+    def recommend(self, movie_id, mode="exact", **knobs):
+        """
+        Recommends movies liked by fans of the given movie, see find_similar_movies.
+
+        Precomputed recommendations are served when available and the scoring knobs
+        are left at their defaults. Blocks until the ratings are loaded.
+
+        Args:
+            movie_id (int): The movie ID.
+            mode (str): "exact", or "ann" to use the item embeddings.
+            **knobs: Scoring knobs of find_similar_movies, e.g. max_similar_users.
+
+        Returns:
+            DataFrame: The top recommended movies.
+
+        Raises:
+            ValueError: If the mode is unknown or its data is not loaded.
+        """
+        self._wait_for(self._ready)
+        return find_similar_movies(
+            movie_id,
+            self.ratings,
+            self.catalog,
+            self.table,
+            self.recommend_cache,
+            mode=mode,
+            embeddings=self.embeddings,
+            **knobs,
+        )
+
+    def recommend_for_user(self, user, **options):
+        """
+        Recommends movies to a user from all the movies they liked, see
+        recommend_for_user. Results are not cached, as a user's ratings change.
+        Blocks until the ratings are loaded.
+
+        Args:
+            user (int or list of int): A user ID, or the movie IDs the user liked.
+            **options: Scoring knobs and filters of recommend_for_user, e.g. k.
+
+        Returns:
+            DataFrame: The top recommended movies the user has not seen.
+        """
+        self._wait_for(self._ready)
+        return recommend_for_user(user, self.ratings, self.catalog, **options)
+
+    def apply_ratings(self, ratings):
+        """
+        Applies new ratings without reloading, see RatingsIndex.apply_ratings.
+
+        Cached and precomputed recommendations are dropped for the movies whose high
+        ratings changed, the movies recommending them and the movies the rating
+        users like. The index is compacted once compact_threshold updates are pending.
+
+        Args:
+            ratings (DataFrame): Ratings with 'userId', 'movieId' and 'rating' columns.
+
+        Returns:
+            int: Number of movies whose high ratings changed.
+
+        Raises:
+            TypeError: If the model does not hold a RatingsIndex.
+        """
+        if not isinstance(self.ratings, RatingsIndex):
+            raise TypeError("Rating updates require the ratings to be a RatingsIndex")
+        with self._update_lock:
+            changed, liked = self.ratings.apply_ratings(ratings)
+            if len(changed) == 0:
+                return 0
+            stale = liked
+            if self.table is not None:
+                # A row scores its seed against the fan counts of every candidate,
+                # not only the stored top N, so it is stale as soon as one of the
+                # seed's fans likes a changed movie
+                stale = np.union1d(
+                    np.union1d(changed, liked), self.ratings.co_liked_movies(changed)
+                )
+                self.table.discard(stale)
+            # Results are tagged with their seed movie, for every combination of
+            # knobs, and results served from the table only with its stored top N
+            self.recommend_cache.invalidate(
+                tags=[("seed", movie_id) for movie_id in stale.tolist()]
+                + changed.tolist()
+            )
+            movies, *indexes = self._catalogue
+            self._catalogue = (add_popularity(movies, self.ratings), *indexes)
+            if self.ratings.pending >= self.compact_threshold:
+                self.compact()
+            return len(changed)
+
+    def compact(self):
+        """Folds the pending rating updates into a new ratings index and swaps it in."""
+        replaced = self.ratings
+        self.ratings = self._sharded(replaced.compact())
+        if isinstance(replaced, ShardedRatingsIndex):
+            # Requests that already hold the replaced index finish on it first
+            timer = threading.Timer(SHARDED_CLOSE_DELAY, replaced.close)
+            timer.daemon = True
+            timer.start()
+
+    def add_movies(self, new_movies):
+        """
+        Adds movies to the catalogue and makes them searchable without a refit.
+
+        The new titles are vectorized against the existing vocabulary, see
+        append_titles, and the extended catalogue is swapped in as a whole.
+        Once refit_fraction of the catalogue was appended, a full refit runs in a
+        background thread.
+
+        Args:
+            new_movies (DataFrame): Movies with 'movieId', 'title' and 'genres' columns.
+
+        Raises:
+            ValueError: If a movie ID is already in the catalogue.
+        """
+        with self._update_lock:
+            movies, vectorizer, tfidf, catalog, trigrams = self._catalogue
+            if new_movies["movieId"].isin(movies["movieId"]).any():
+                raise ValueError("Some of the movies are already in the catalogue")
+            new_movies = new_movies.assign(
+                clean_title=clean_titles(new_movies["title"])
+            )
+            if "year" in movies.columns:
+                new_movies["year"] = extract_years(new_movies["title"])
+            # Until the ratings are loaded, _set_ratings fills in the popularity
+            new_movies = (
+                new_movies.assign(popularity=0)
+                if self.ratings is None
+                else add_popularity(new_movies, self.ratings)
+            )
+            vectorizer, matrix, _ = append_titles(
+                vectorizer, tfidf.matrix, new_movies["clean_title"].tolist()
+            )
+            movies = pd.concat([movies, new_movies], ignore_index=True)
+            self._catalogue = (
+                movies,
+                vectorizer,
+                TitleIndex(matrix),
+                catalog.extend(new_movies),
+                trigrams.extend(new_movies["clean_title"].tolist()),
+            )
+            self._appended += len(new_movies)
+            self.search_cache.clear()
+            if self._appended > self.refit_fraction * len(movies):
+                self._appended = 0
+                threading.Thread(target=self.refit, daemon=True).start()
+
+    def refit(self):
+        """
+        Refits the vectorizer on the whole catalogue and swaps it in, unless movies
+        were added in the meantime.
+        """
+        movies = self.movies
+        vectorizer, tfidf = initialize_vectorizer(movies)
+        index = TitleIndex(tfidf)
+        with self._update_lock:
+            # Rating updates only replace the popularity column, keep their movies
+            if len(self.movies) == len(movies):
+                self._catalogue = (self.movies, vectorizer, index, *self._catalogue[3:])
+                self.search_cache.clear()
+
+    def cache_stats(self):
+        """
+        Returns the counters of the result caches.
+
+        Returns:
+            dict: LRUCache.stats of the search and recommendation caches.
+        """
+        return {
+            "search": self.search_cache.stats(),
+            "recommend": self.recommend_cache.stats(),
+        }
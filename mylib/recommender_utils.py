@@ -1,52 +1,133 @@
+import weakref
+from functools import partial
+import numpy as np
 import pandas as pd
-from mylib.movie_utils import load_and_clean_data, initialize_vectorizer, search_movies
+from mylib.movie_catalog import MovieCatalog
+from mylib.ratings_index import RatingsIndex, reservoir_sample
+from mylib.data_cache import load_movies, load_ratings_index
+from mylib.instrumentation import stage
+from mylib.result_cache import MISSING
 
 
-def get_similar_users(movie_id, ratings):
+# Defaults of the collaborative filtering knobs
+MIN_RATING = 4.0
+MIN_SIMILAR_SHARE = 0.10
+
+
+def _check_threshold(ratings, min_rating):
+    """Raises if an index was built with another rating threshold than requested."""
+    if ratings.rating_threshold != min_rating:
+        raise ValueError(
+            f"The ratings index keeps ratings above {ratings.rating_threshold}, "
+            f"it cannot answer min_rating={min_rating}"
+        )
+
+
+def get_similar_users(
+    movie_id, ratings, min_rating=MIN_RATING, max_users=None, sample_seed=0
+):
     """
     Finds users who rated the specified movie highly.
 
     Args:
         movie_id (int): The movie ID.
-        ratings (DataFrame): The ratings DataFrame.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high.
+        max_users (int, optional): Keep a deterministic sample of at most this many
+            users, see reservoir_sample.
+        sample_seed (int): Seed of the sample, combined with the movie ID.
 
     Returns:
         ndarray: Array of user IDs who rated the movie highly.
     """
-    return ratings[(ratings["movieId"] == movie_id) & (ratings["rating"] > 4)][
-        "userId"
-    ].unique()
+    if isinstance(ratings, RatingsIndex):
+        _check_threshold(ratings, min_rating)
+        users = ratings.similar_users(movie_id)
+    else:
+        users = ratings[
+            (ratings["movieId"] == movie_id) & (ratings["rating"] > min_rating)
+        ]["userId"].unique()
+    if max_users is not None and len(users) > max_users:
+        users = reservoir_sample(
+            np.sort(users), max_users, (sample_seed, int(movie_id))
+        )
+    return users
+
+
+def get_users_similar_to(
+    movie_ids, ratings, min_rating=MIN_RATING, max_users=None, sample_seed=0
+):
+    """
+    Finds users who rated any of the specified movies highly.
+
+    Args:
+        movie_ids (array-like): The movie IDs, e.g. the movies a user liked.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high.
+        max_users (int, optional): Keep a deterministic sample of at most this many
+            users, see reservoir_sample.
+        sample_seed (int): Seed of the sample, combined with the movie IDs.
+
+    Returns:
+        ndarray: Sorted array of the distinct user IDs who rated a movie highly.
+    """
+    movie_ids = np.unique(np.asarray(movie_ids, dtype=np.int64))
+    if isinstance(ratings, RatingsIndex):
+        _check_threshold(ratings, min_rating)
+        users = ratings.similar_users_of(movie_ids)
+    else:
+        users = np.sort(
+            ratings[
+                (ratings["movieId"].isin(movie_ids)) & (ratings["rating"] > min_rating)
+            ]["userId"].unique()
+        )
+    if max_users is not None and len(users) > max_users:
+        users = reservoir_sample(users, max_users, (sample_seed, *movie_ids.tolist()))
+    return users
 
 
-def calculate_similar_user_recommendations(similar_users, ratings):
+def calculate_similar_user_recommendations(
+    similar_users, ratings, min_rating=MIN_RATING
+):
     """
     Calculates the percentage of similar users who highly rated other movies.
 
     Args:
         similar_users (ndarray): Array of user IDs.
-        ratings (DataFrame): The ratings DataFrame.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high.
 
     Returns:
         Series: A Series with movie IDs as index and recommendation percentages as values.
     """
+    if isinstance(ratings, RatingsIndex):
+        _check_threshold(ratings, min_rating)
+        return ratings.similar_user_counts(similar_users) / len(similar_users)
     similar_user_recs = ratings[
-        (ratings["userId"].isin(similar_users)) & (ratings["rating"] > 4)
+        (ratings["userId"].isin(similar_users)) & (ratings["rating"] > min_rating)
     ]["movieId"]
     return similar_user_recs.value_counts() / len(similar_users)
 
 
-def calculate_all_user_recommendations(movie_ids, ratings):
+def calculate_all_user_recommendations(movie_ids, ratings, min_rating=MIN_RATING):
     """
     Calculates the percentage of all users who highly rated the specified movies.
 
     Args:
         movie_ids (Index): Movie IDs for which to calculate percentages.
-        ratings (DataFrame): The ratings DataFrame.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high.
 
     Returns:
         Series: A Series with movie IDs as index and recommendation percentages as values.
     """
-    all_users = ratings[(ratings["movieId"].isin(movie_ids)) & (ratings["rating"] > 4)]
+    if isinstance(ratings, RatingsIndex):
+        _check_threshold(ratings, min_rating)
+        counts, n_users = ratings.all_user_counts(movie_ids)
+        return counts / n_users
+    all_users = ratings[
+        (ratings["movieId"].isin(movie_ids)) & (ratings["rating"] > min_rating)
+    ]
     return all_users["movieId"].value_counts() / len(all_users["userId"].unique())
 
 
@@ -67,46 +148,408 @@ def compute_recommendation_scores(similar_user_recs, all_user_recs):
     )
     rec_percentages.columns = ["similar", "all"]
     rec_percentages["score"] = rec_percentages["similar"] / rec_percentages["all"]
-    return rec_percentages.sort_values("score", ascending=False)
+    return rec_percentages.sort_values("score", ascending=False, kind="stable")
 
 
-def find_similar_movies(movie_id, ratings, movies):
+def add_popularity(movies, ratings, min_rating=MIN_RATING):
     """
-    Finds movies similar to the given movie based on collaborative filtering.
+    Adds a 'popularity' column with the number of high ratings of each movie, used
+    by search_movies to order equally similar titles.
 
     Args:
-        movie_id (int): The ID of the movie for which recommendations are sought.
-        ratings (DataFrame): The ratings DataFrame.
         movies (DataFrame): The movies DataFrame.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high; a
+            RatingsIndex only answers the threshold it was built with.
 
     Returns:
-        DataFrame: A DataFrame containing the top 10 recommended movies with their score, title, and genres.
+        DataFrame: A copy of movies with the 'popularity' column.
+
+    Raises:
+        ValueError: If ratings is a RatingsIndex built with another threshold.
+    """
+    if isinstance(ratings, RatingsIndex):
+        _check_threshold(ratings, min_rating)
+        popularity = ratings.popularity(movies["movieId"].to_numpy())
+    else:
+        counts = ratings.loc[ratings["rating"] > min_rating, "movieId"].value_counts()
+        popularity = movies["movieId"].map(counts).fillna(0).astype("int64").to_numpy()
+    return movies.assign(popularity=popularity)
+
+
+def score_similar_movies(
+    movie_id,
+    ratings,
+    min_rating=MIN_RATING,
+    min_similar_share=MIN_SIMILAR_SHARE,
+    min_support=1,
+    max_similar_users=None,
+    sample_seed=0,
+):
+    """
+    Scores every candidate movie for the given movie based on collaborative filtering.
+
+    Args:
+        movie_id (int): The ID of the movie for which recommendations are sought.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        min_rating (float): Ratings strictly above this value count as high; a
+            RatingsIndex only answers the threshold it was built with.
+        min_similar_share (float): Minimum share of similar users who must have
+            rated a candidate highly.
+        min_support (int): Minimum number of similar users who must have rated a
+            candidate highly, which drops scores backed by one or two ratings.
+        max_similar_users (int, optional): Score from a deterministic sample of at
+            most this many similar users, bounding the cost for blockbusters.
+        sample_seed (int): Seed of the similar-user sample.
+
+    Returns:
+        DataFrame: Similar percentages, all percentages and scores indexed by movie ID,
+        sorted by descending score.
+
+    Raises:
+        ValueError: If ratings is a RatingsIndex built with another threshold.
     """
     # Step 1: Find users who liked the movie
-    similar_users = get_similar_users(movie_id, ratings)
+    with stage("find_similar_movies", "similar_users") as s:
+        similar_users = get_similar_users(
+            movie_id, ratings, min_rating, max_similar_users, sample_seed
+        )
+        s.rows = len(similar_users)
+    return _score_candidates(
+        "find_similar_movies",
+        similar_users,
+        ratings,
+        min_rating,
+        min_similar_share,
+        min_support,
+    )
+
 
+def _score_candidates(
+    operation, similar_users, ratings, min_rating, min_similar_share, min_support
+):
+    """Scores the movies the similar users like, steps 2 to 5 of the scoring."""
     # Step 2: Get recommendation percentages for similar users
-    similar_user_recs = calculate_similar_user_recommendations(similar_users, ratings)
+    with stage(operation, "similar_user_counts") as s:
+        similar_user_recs = calculate_similar_user_recommendations(
+            similar_users, ratings, min_rating
+        )
+        s.rows = len(similar_user_recs)
 
-    # Step 3: Filter movies with similar user recommendation percentage > 10%
-    similar_user_recs = similar_user_recs[similar_user_recs > 0.10]
+    # Step 3: Filter movies by similar user recommendation percentage and support
+    with stage(operation, "filter") as s:
+        support = np.rint(similar_user_recs * len(similar_users))
+        similar_user_recs = similar_user_recs[
+            (similar_user_recs > min_similar_share) & (support >= min_support)
+        ]
+        s.rows = len(similar_user_recs)
 
     # Step 4: Get recommendation percentages for all users
-    all_user_recs = calculate_all_user_recommendations(similar_user_recs.index, ratings)
+    with stage(operation, "all_user_counts") as s:
+        all_user_recs = calculate_all_user_recommendations(
+            similar_user_recs.index, ratings, min_rating
+        )
+        s.rows = len(all_user_recs)
 
     # Step 5: Compute recommendation scores
-    rec_percentages = compute_recommendation_scores(similar_user_recs, all_user_recs)
+    with stage(operation, "scores") as s:
+        rec_percentages = compute_recommendation_scores(
+            similar_user_recs, all_user_recs
+        )
+        s.rows = len(rec_percentages)
+    return rec_percentages
 
-    # Step 6: Merge with movie data and return the top 10 results
-    return rec_percentages.head(10).merge(movies, left_index=True, right_on="movieId")[
-        ["score", "title", "genres"]
-    ]
+
+# Recommendation modes of find_similar_movies
+MODES = ("exact", "ann")
+
+
+def find_similar_movies(
+    movie_id,
+    ratings,
+    movies,
+    table=None,
+    cache=None,
+    mode="exact",
+    embeddings=None,
+    min_rating=MIN_RATING,
+    min_similar_share=MIN_SIMILAR_SHARE,
+    min_support=1,
+    max_similar_users=None,
+    sample_seed=0,
+    k=10,
+    genres=None,
+    min_year=None,
+    max_year=None,
+):
+    """
+    Finds movies similar to the given movie based on collaborative filtering.
+
+    In "exact" mode candidates are scored by how much more their fans' share is
+    among the movie's fans than among all users. In "ann" mode the nearest
+    neighbours of the movie's item embedding are returned instead, scored by
+    cosine similarity, at a cost independent of the movie's popularity.
+
+    Genre and year filters are applied as a mask over all scored candidates
+    before the top k are taken, so filtered results keep their unfiltered scores
+    and are filled to k whenever enough candidates pass.
+
+    Args:
+        movie_id (int): The ID of the movie for which recommendations are sought.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame, or a RatingsIndex
+            built from it once at load time for fast repeated lookups.
+        movies (DataFrame or MovieCatalog): The movies DataFrame, or a MovieCatalog
+            built from it at load time to attach titles and filter without a merge.
+        table (RecommendationTable, optional): Precomputed recommendations served
+            instead of the live computation for the movies it contains, when the
+            scoring knobs are left at their defaults and the stored row holds k
+            movies passing the filters, or every candidate of the movie.
+        cache (LRUCache, optional): Cache of results keyed by movie ID and options,
+            tagged with the movie and its candidates so that rating updates can
+            invalidate them.
+        mode (str): "exact" or "ann".
+        embeddings (ItemEmbeddings, optional): Item embeddings, required in "ann" mode.
+        min_rating, min_similar_share, min_support, max_similar_users, sample_seed:
+            Scoring knobs of the "exact" mode, see score_similar_movies.
+        k (int): Number of recommendations.
+        genres (iterable of str, optional): Only recommend movies with any of these
+            genres.
+        min_year (int, optional): Only recommend movies released in or after this year.
+        max_year (int, optional): Only recommend movies released in or before this year.
+
+    Returns:
+        DataFrame: A DataFrame containing the top k recommended movies with their score, title, and genres.
+
+    Raises:
+        ValueError: If the mode is unknown, "ann" without embeddings, a genre is
+            unknown, or min_rating differs from the threshold of a RatingsIndex.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+    filters, allowed = _movie_filter(movies, genres, min_year, max_year)
+    options = tuple(sorted(filters.items())) + ((("k", k),) if k != 10 else ())
+    if mode == "ann":
+        if embeddings is None:
+            raise ValueError("The 'ann' mode requires item embeddings")
+        return _ann_movies(movie_id, movies, embeddings, cache, k, allowed, options)
+    knobs = {
+        "min_rating": min_rating,
+        "min_similar_share": min_similar_share,
+        "min_support": min_support,
+        "max_similar_users": max_similar_users,
+        "sample_seed": sample_seed,
+    }
+    # Only the default scoring matches the precomputed table and the plain cache key
+    changed = tuple(
+        (name, value) for name, value in knobs.items() if value != _DEFAULTS[name]
+    )
+    if changed:
+        table = None
+    if cache is not None:
+        key = (
+            (int(movie_id), *changed, *options) if changed or options else int(movie_id)
+        )
+        results = cache.get(key)
+        if results is MISSING:
+            rec_percentages = _rec_percentages(
+                movie_id, ratings, table, knobs, k, allowed
+            )
+            results = _top_movies(rec_percentages, movies, k, allowed)
+            # Tagged with every candidate, whose counts also change the scores
+            cache.set(
+                key,
+                results,
+                tags=[("seed", int(movie_id)), *rec_percentages.index.tolist()],
+            )
+        return results
+    return _top_movies(
+        _rec_percentages(movie_id, ratings, table, knobs, k, allowed),
+        movies,
+        k,
+        allowed,
+    )
+
+
+def _movie_filter(movies, genres, min_year, max_year):
+    """
+    Returns the given filters and a function masking the movie IDs passing them,
+    or None without filters.
+    """
+    filters = {
+        name: value
+        for name, value in (
+            ("genres", None if genres is None else tuple(sorted(genres))),
+            ("min_year", min_year),
+            ("max_year", max_year),
+        )
+        if value is not None
+    }
+    if not filters:
+        return filters, None
+    catalog = _catalog_of(movies)
+    catalog.genre_mask(filters.get("genres", ()))  # Rejects unknown genres early
+    return filters, partial(catalog.matches, **filters)
+
+
+# The last movies DataFrame filtered on and its catalog, as (weak reference, catalog)
+_LAST_CATALOG = (None, None)
+
+
+def _catalog_of(movies):
+    """
+    Returns the catalog of the movies, built once per DataFrame, which is treated
+    as read-only like the catalog the model holds.
+    """
+    global _LAST_CATALOG
+    if isinstance(movies, MovieCatalog):
+        return movies
+    reference, catalog = _LAST_CATALOG
+    if reference is None or reference() is not movies:
+        catalog = MovieCatalog.from_movies(movies)
+        _LAST_CATALOG = (weakref.ref(movies), catalog)
+    return catalog
+
+
+# Default scoring knobs, served from the precomputed table
+_DEFAULTS = {
+    "min_rating": MIN_RATING,
+    "min_similar_share": MIN_SIMILAR_SHARE,
+    "min_support": 1,
+    "max_similar_users": None,
+    "sample_seed": 0,
+}
+
+
+def _rec_percentages(movie_id, ratings, table, knobs, k=10, allowed=None):
+    """
+    Returns the scored candidates, from the table when its row of the movie holds
+    k candidates passing the filters or is shorter than top_n, i.e. complete.
+    """
+    precomputed = table.lookup(movie_id) if table is not None else None
+    if precomputed is not None:
+        ids, scores = precomputed
+        passing = len(ids) if allowed is None else np.count_nonzero(allowed(ids))
+        if passing >= k or len(ids) < table.top_n:
+            return pd.DataFrame({"score": scores}, index=pd.Index(ids, name="movieId"))
+    return score_similar_movies(movie_id, ratings, **knobs)
+
+
+def _ann_movies(movie_id, movies, embeddings, cache, k, allowed, options):
+    """Returns the movies with the closest embeddings, cached without tags."""
+    if cache is not None:
+        return cache.get_or_compute(
+            ("ann", int(movie_id), *options),
+            lambda: _ann_movies(movie_id, movies, embeddings, None, k, allowed, ()),
+        )
+    with stage("find_similar_movies", "neighbors") as s:
+        ids, scores = embeddings.neighbors(movie_id, k=k, allowed=allowed)
+        s.rows = len(ids)
+    return _top_movies(
+        pd.DataFrame({"score": scores}, index=pd.Index(ids, name="movieId")),
+        movies,
+        k,
+    )
+
+
+def _top_movies(rec_percentages, movies, k=10, allowed=None):
+    """Attaches the movie data to the k best scored candidates passing the filters."""
+    if allowed is not None:
+        with stage("find_similar_movies", "filter_movies") as s:
+            rec_percentages = rec_percentages[allowed(rec_percentages.index.to_numpy())]
+            s.rows = len(rec_percentages)
+    # Step 6: Merge with movie data and return the top k results
+    with stage("find_similar_movies", "merge") as s:
+        top = rec_percentages.head(k)
+        if isinstance(movies, MovieCatalog):
+            results = movies.hydrate(top.index.to_numpy(), top["score"].to_numpy())
+        else:
+            results = top.merge(movies, left_index=True, right_on="movieId")[
+                ["score", "title", "genres"]
+            ]
+        s.rows = len(results)
+    return results
+
+
+def recommend_for_user(
+    user,
+    ratings,
+    movies,
+    k=10,
+    min_rating=MIN_RATING,
+    min_similar_share=MIN_SIMILAR_SHARE,
+    min_support=1,
+    max_similar_users=None,
+    sample_seed=0,
+    genres=None,
+    min_year=None,
+    max_year=None,
+):
+    """
+    Recommends movies to a user from everything they liked.
+
+    The fans of all the liked movies are pooled into one similar-user set, which
+    is scored like the fans of a single seed movie: one counting pass over the
+    similar users and one over the candidates, whatever the number of liked
+    movies. Movies the user has already seen are never recommended.
+
+    Args:
+        user (int or list of int): A user ID, or the movie IDs the user liked.
+        ratings (DataFrame or RatingsIndex): The ratings DataFrame or its index.
+        movies (DataFrame or MovieCatalog): The movies DataFrame or its catalog.
+        k (int): Number of recommendations to return.
+        min_rating, min_similar_share, min_support, max_similar_users, sample_seed:
+            The scoring knobs of find_similar_movies.
+        genres, min_year, max_year: The result filters of find_similar_movies.
+
+    Returns:
+        DataFrame: The top k movies with their scores, titles and genres, empty for
+        a user without liked movies.
+
+    Raises:
+        ValueError: If a genre is not in the catalog.
+    """
+    allowed = _movie_filter(movies, genres, min_year, max_year)[1]
+    if np.ndim(user) == 0:
+        if isinstance(ratings, RatingsIndex):
+            _check_threshold(ratings, min_rating)
+            liked = ratings.liked_movies(user)
+            seen = ratings.rated_movies(user)
+        else:
+            rated = ratings[ratings["userId"] == user]
+            liked = rated.loc[rated["rating"] > min_rating, "movieId"].to_numpy()
+            seen = rated["movieId"].to_numpy()
+    else:
+        liked = seen = np.asarray(user, dtype=np.int64)
+
+    with stage("recommend_for_user", "similar_users") as s:
+        similar_users = get_users_similar_to(
+            liked, ratings, min_rating, max_similar_users, sample_seed
+        )
+        s.rows = len(similar_users)
+    if len(similar_users) == 0:
+        return _top_movies(
+            pd.DataFrame(
+                {"score": []}, index=pd.Index([], dtype=np.int64, name="movieId")
+            ),
+            movies,
+            k,
+        )
+    rec_percentages = _score_candidates(
+        "recommend_for_user",
+        similar_users,
+        ratings,
+        min_rating,
+        min_similar_share,
+        min_support,
+    )
+    rec_percentages = rec_percentages[~rec_percentages.index.isin(seen)]
+    return _top_movies(rec_percentages, movies, k, allowed)
 
 
 if __name__ == "__main__":
     # Load the data
-    ratings = pd.read_csv("./data/ratings.csv")
-    movies = load_and_clean_data("./data/movies.csv")
+    ratings = load_ratings_index("./data/ratings.csv")
+    movies = load_movies("./data/movies.csv")
 
     # Test collaborative filtering recommendations
     test_movie_id = 1  # Replace with a valid movieId from your dataset
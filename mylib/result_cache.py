@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LRUCache.get for missing keys when no default is given
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe bounded cache with least-recently-used eviction and optional TTL.
+
+    Hits, misses, evictions and expirations are counted so the hit rate can be
+    exported. ``clear`` drops every entry, which is how results are invalidated
+    when the underlying data is reloaded. Entries can also be stored with tags,
+    e.g. the IDs of the movies a result depends on, so that ``invalidate`` drops
+    only the entries affected by a change.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """
+        Args:
+            maxsize (int): Maximum number of entries kept.
+            ttl (float, optional): Seconds after which an entry expires.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._tagged = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        Args:
+            key (hashable): The cache key.
+            default: Returned when the key is missing or expired.
+
+        Returns:
+            The cached value or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, _ = entry
+                if expires is None or expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def _drop(self, key):
+        """Removes an entry and its tags, the lock must be held."""
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[tag]
+
+    def set(self, key, value, tags=()):
+        """
+        Stores a value, evicting the least recently used entries beyond maxsize.
+
+        Args:
+            key (hashable): The cache key.
+            value: The value to store.
+            tags (iterable, optional): Tags the entry can be invalidated by.
+        """
+        expires = self._clock() + self.ttl if self.ttl is not None else None
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for a key, computing and storing it on a miss.
+
+        Args:
+            key (hashable): The cache key.
+            compute (callable): Called without arguments to produce a missing value.
+
+        Returns:
+            The cached or computed value.
+        """
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drops every entry, e.g. after the underlying data was reloaded."""
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+            self.invalidations += 1
+
+    def invalidate(self, keys=(), tags=()):
+        """
+        Drops the given keys and every entry stored with any of the given tags.
+
+        Args:
+            keys (iterable, optional): Keys to drop.
+            tags (iterable, optional): Tags whose entries are dropped.
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        with self._lock:
+            dropped = {key for key in keys if key in self._entries}
+            for tag in tags:
+                dropped |= self._tagged.get(tag, set())
+            for key in dropped:
+                self._drop(key)
+            if dropped:
+                self.invalidations += 1
+            return len(dropped)
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Size, hits, misses, hit rate, evictions, expirations and invalidations.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
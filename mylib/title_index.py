@@ -0,0 +1,59 @@
+import numpy as np
+from scipy import sparse
+
+
+class TitleIndex:
+    """
+    Inverted index from the TF-IDF vocabulary to the titles containing each term.
+
+    The TF-IDF matrix is stored column-major, so the posting list of a term is one
+    contiguous slice. Scoring a query only visits the postings of its own terms,
+    making the cost proportional to the number of matching titles rather than to
+    the size of the catalogue.
+    """
+
+    def __init__(self, tfidf):
+        """
+        Args:
+            tfidf (sparse matrix): The TF-IDF matrix of the cleaned titles.
+        """
+        self.matrix = sparse.csr_matrix(tfidf)
+        self.postings = self.matrix.tocsc()
+        self.postings.sort_indices()
+        self.row_norms = np.sqrt(
+            np.asarray(self.matrix.multiply(self.matrix).sum(axis=1))
+        ).ravel()
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def scores(self, query_vec):
+        """
+        Computes exact cosine similarities between a query and the titles sharing
+        at least one term with it.
+
+        Args:
+            query_vec (sparse matrix): A single TF-IDF query row.
+
+        Returns:
+            ndarray, ndarray: Row indices of the matching titles and their scores.
+        """
+        query_vec = sparse.csr_matrix(query_vec)
+        terms, weights = query_vec.indices, query_vec.data
+        query_norm = np.sqrt(np.dot(weights, weights))
+        if query_norm == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        starts = self.postings.indptr[terms]
+        lengths = self.postings.indptr[terms + 1] - starts
+        # Positions of every posting of every query term, built without a Python loop
+        offsets = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        positions = np.repeat(starts, lengths) + offsets
+        contributions = self.postings.data[positions] * np.repeat(weights, lengths)
+
+        rows, inverse = np.unique(self.postings.indices[positions], return_inverse=True)
+        dots = np.bincount(inverse, weights=contributions, minlength=len(rows))
+        return rows, dots / (self.row_norms[rows] * query_norm)
@@ -110,11 +110,56 @@
 #     print(recommendations)
 
 
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
 import pytest
-from mylib.movie_utils import load_and_clean_data, initialize_vectorizer, search_movies
-from mylib.recommender_utils import find_similar_movies
+from mylib.movie_utils import (
+    append_titles,
+    load_and_clean_data,
+    clean_title,
+    clean_titles,
+    initialize_vectorizer,
+    search_movies,
+    search_movies_batch,
+)
+from mylib.recommender_utils import (
+    add_popularity,
+    find_similar_movies,
+    get_similar_users,
+    recommend_for_user,
+)
+from mylib.ratings_index import RatingsIndex, reservoir_sample
+from mylib.parallel_index import ShardedRatingsIndex
+from mylib import recommender_model, recommender_utils
+from mylib.recommender_model import RecommenderModel
+from mylib.result_cache import LRUCache
+from mylib import instrumentation
+from mylib.title_index import TitleIndex
+from mylib.movie_catalog import MovieCatalog
+from mylib.fuzzy_index import FuzzyTitleIndex, trigram_codes
+from mylib.recommendation_table import RecommendationTable, precompute_recommendations
+from mylib.batch import _parquet_rows, run_batch
+from app import create_app
+from asgi import create_asgi_app
+from mylib.async_service import AsyncRecommender, Overloaded
+from mylib.item_embeddings import ItemEmbeddings, recall_report
+from benchmarks.synthetic import generate_movies, generate_ratings
+from benchmarks.run_benchmarks import compare
+from mylib.data_cache import (
+    build_ratings_index,
+    load_movies,
+    load_ratings,
+    load_ratings_index,
+    load_vectorizer,
+)
+import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
 
 
 @pytest.fixture
@@ -167,6 +212,23 @@ def test_load_and_clean_data(tmp_path):
     assert not movies["clean_title"].isnull().any()
 
 
+def test_title_normalization(tmp_path):
+    """Test ASCII folding, the column-wide cleaner and year extraction."""
+    titles = pd.Series(["Amélie (2001)", "Heat (1995) ", "Ｍ*A*S*H", "Untitled", None])
+    cleaned = clean_titles(titles)
+    assert cleaned.tolist() == ["amelie 2001", "heat 1995 ", "mash", "untitled", ""]
+    assert cleaned.tolist()[:4] == [clean_title(title) for title in titles[:4]]
+    assert clean_titles(pd.Series(["a\x00b", "C"])).tolist() == ["ab", "c"]
+
+    filepath = tmp_path / "movies.csv"
+    pd.DataFrame({"movieId": [1, 2, 3], "title": titles[:3]}).to_csv(
+        filepath, index=False
+    )
+    movies = load_and_clean_data(filepath, extract_year=True)
+    assert movies["year"].tolist() == [2001, 1995, pd.NA]
+    assert "year" not in load_and_clean_data(filepath).columns
+
+
 def test_initialize_vectorizer(sample_movies):
     """Test the initialize_vectorizer function with sample movies."""
     vectorizer, tfidf = initialize_vectorizer(sample_movies)
@@ -194,6 +256,939 @@ def test_find_similar_movies(sample_movies, sample_ratings):
     assert "title" in recommendations.columns  # Validate the structure
 
 
+def test_ratings_index_matches_dataframe(sample_movies):
+    """Test that the RatingsIndex path produces the same scores as the DataFrame path."""
+    ratings = pd.DataFrame(
+        {
+            "userId": [1, 1, 1, 2, 2, 3, 3, 3, 4, 4, 5],
+            "movieId": [1, 2, 3, 1, 2, 1, 4, 5, 2, 3, 5],
+            "rating": [5, 4.5, 5, 4.5, 5, 5, 5, 3, 5, 5, 5],
+        }
+    )
+    index = RatingsIndex.from_ratings(ratings)
+    expected = find_similar_movies(1, ratings, sample_movies)
+    result = find_similar_movies(1, index, sample_movies)
+    assert result["score"].tolist() == expected["score"].tolist()
+    assert sorted(result["title"]) == sorted(expected["title"])
+    assert find_similar_movies(99, index, sample_movies).empty
+
+
+def test_data_cache_round_trip(tmp_path, sample_movies):
+    """Test that cached ratings and movies are reloaded and invalidated correctly."""
+    ratings_path = tmp_path / "ratings.csv"
+    movies_path = tmp_path / "movies.csv"
+    pd.DataFrame(
+        {
+            "userId": [1, 1, 2, 2, 3],
+            "movieId": [1, 2, 1, 2, 1],
+            "rating": [5.0, 4.5, 5.0, 5.0, 3.0],
+            "timestamp": [0, 0, 0, 0, 0],
+        }
+    ).to_csv(ratings_path, index=False)
+    sample_movies[["movieId", "title", "genres"]].to_csv(movies_path, index=False)
+    cache_dir = tmp_path / "cache"
+
+    ratings = load_ratings(ratings_path, cache_dir)
+    assert list(ratings.columns) == ["userId", "movieId", "rating"]
+    assert ratings["userId"].dtype == np.int32
+    assert ratings["rating"].dtype == np.float32
+    assert isinstance(
+        load_ratings(ratings_path, cache_dir)["userId"].values.base, np.memmap
+    )
+
+    index = load_ratings_index(ratings_path, cache_dir)
+    assert sorted(index.similar_users(1)) == [1, 2]
+    assert load_movies(movies_path, cache_dir)["clean_title"].notnull().all()
+
+    # A changed source file must invalidate the cached entry
+    pd.DataFrame(
+        {"userId": [7], "movieId": [1], "rating": [5.0], "timestamp": [0]}
+    ).to_csv(ratings_path, index=False)
+    assert list(load_ratings_index(ratings_path, cache_dir).similar_users(1)) == [7]
+
+
+def test_build_ratings_index_in_chunks(tmp_path):
+    """Test that a chunked build matches an index built from the full DataFrame."""
+    ratings = pd.DataFrame(
+        {
+            "userId": [1, 1, 2, 2, 3, 3, 4],
+            "movieId": [1, 2, 1, 3, 2, 3, 1],
+            "rating": [5.0, 4.5, 5.0, 2.0, 5.0, 4.5, 4.0],
+            "timestamp": [0] * 7,
+        }
+    )
+    filepath = tmp_path / "ratings.csv"
+    ratings.to_csv(filepath, index=False)
+    # A tiny memory ceiling forces one row per chunk
+    index = build_ratings_index(filepath, max_memory=1)
+    expected = RatingsIndex.from_ratings(ratings)
+    assert (index.user_movies != expected.user_movies).nnz == 0
+    assert index.movie_counts.tolist() == expected.movie_counts.tolist()
+    assert (index.user_rated != expected.user_rated).nnz == 0
+    # The low rating of movie 3 is kept apart from the high ones
+    assert index.liked_movies(2).tolist() == [1]
+    assert index.rated_movies(2).tolist() == [1, 3]
+    index.save(tmp_path / "index")
+    loaded = RatingsIndex.load(tmp_path / "index")
+    assert loaded.rated_movies(2).tolist() == [1, 3]
+
+
+def test_web_app(sample_movies, sample_ratings):
+    """Test the search, recommend and readiness endpoints of the web service."""
+    model = RecommenderModel.from_data(sample_movies, sample_ratings)
+    client = create_app(model).test_client()
+    assert client.get("/health").status_code == 200
+    assert client.get("/ready").status_code == 200
+
+    response = client.get("/search?q=Matrix")
+    assert response.status_code == 200
+    assert any("Matrix" in r["title"] for r in response.get_json()["results"])
+    assert client.get("/search").status_code == 400
+
+    response = client.get("/recommend/1")
+    assert response.status_code == 200
+    assert response.get_json()["results"]
+    assert client.get("/recommend/999").status_code == 404
+
+    cold = create_app(RecommenderModel("missing.csv", "missing.csv")).test_client()
+    assert cold.get("/ready").status_code == 503
+    assert cold.get("/search?q=Matrix").status_code == 503
+
+
+def test_precomputed_recommendations(tmp_path, sample_movies):
+    """Test that precomputed recommendations match live ones and fall back when missing."""
+    ratings = pd.DataFrame(
+        {
+            "userId": [1, 1, 1, 2, 2, 3, 3, 4, 4],
+            "movieId": [1, 2, 3, 1, 2, 1, 4, 2, 3],
+            "rating": [5, 4.5, 5, 4.5, 5, 5, 5, 5, 5],
+        }
+    )
+    index = RatingsIndex.from_ratings(ratings)
+    table = precompute_recommendations(index, movie_ids=[1, 2], workers=2, chunk_size=1)
+    table.save(tmp_path / "table.npz")
+    table = RecommendationTable.load(tmp_path / "table.npz")
+    assert len(table) == 2 and table.lookup(3) is None
+    # A DataFrame is indexed once and scores every highly rated movie by default
+    from_dataframe = precompute_recommendations(ratings, workers=1)
+    assert from_dataframe.movie_ids.tolist() == [1, 2, 3, 4]
+    assert from_dataframe.lookup(1)[1].tolist() == table.lookup(1)[1].tolist()
+
+    for movie_id in [1, 2, 3]:
+        expected = find_similar_movies(movie_id, index, sample_movies)
+        result = find_similar_movies(movie_id, index, sample_movies, table)
+        assert result["score"].tolist() == expected["score"].tolist()
+        assert result["title"].tolist() == expected["title"].tolist()
+
+
+def test_lru_cache_eviction_and_ttl():
+    """Test LRU eviction, TTL expiry, invalidation and the exported counters."""
+    now = [0.0]
+    cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used entry
+    assert cache.get("b", None) is None
+    now[0] = 11.0
+    assert cache.get("a", None) is None
+    cache.set("d", 4)
+    cache.clear()
+    assert len(cache) == 0
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert (stats["evictions"], stats["expirations"]) == (1, 1)
+    assert stats["invalidations"] == 1
+
+
+def test_cached_search_and_recommendations(sample_movies, sample_ratings):
+    """Test that repeated queries are served from the cache without the matrices."""
+    vectorizer, tfidf = initialize_vectorizer(sample_movies)
+    cache = LRUCache()
+    first = search_movies("Matrix!", sample_movies, vectorizer, tfidf, cache)
+    second = search_movies("Matrix", sample_movies, None, None, cache)
+    assert second is first
+
+    recommendations = find_similar_movies(1, sample_ratings, sample_movies, cache=cache)
+    assert find_similar_movies(1, None, None, cache=cache) is recommendations
+    assert cache.stats()["hits"] == 2
+
+
+def test_search_movies_batch(sample_movies):
+    """Test that batched search returns the same top k as single searches."""
+    vectorizer, tfidf = initialize_vectorizer(sample_movies)
+    titles = ["Matrix", "The Notebook", "Interstellar", "zzz"]
+    batch = list(
+        search_movies_batch(titles, sample_movies, vectorizer, tfidf, block_size=3)
+    )
+    assert len(batch) == len(titles)
+    for title, results in zip(titles, batch):
+        expected = search_movies(title, sample_movies, vectorizer, tfidf)
+        assert results["movieId"].tolist() == expected["movieId"].tolist()
+        assert np.allclose(results["score"], expected["score"])
+    assert batch[0].iloc[0]["title"] == "The Matrix"
+    assert batch[3].empty
+
+
+def test_title_index_search(sample_movies):
+    """Test that the inverted index scores exactly like the dense cosine path."""
+    vectorizer, tfidf = initialize_vectorizer(sample_movies)
+    index = TitleIndex(tfidf)
+    query_vec = vectorizer.transform(["the matrix"])
+    rows, scores = index.scores(query_vec)
+    dense = cosine_similarity(query_vec, tfidf).ravel()
+    assert sorted(rows) == list(np.flatnonzero(dense))
+    assert np.allclose(scores, dense[rows])
+
+    results = search_movies("Matrix", sample_movies, vectorizer, index)
+    expected = search_movies("Matrix", sample_movies, vectorizer, tfidf)
+    assert len(results) == len(expected)
+    assert results.iloc[0]["title"] == "The Matrix"
+
+
+def test_search_movies_ordering_and_threshold(sample_movies):
+    """Test score ordering, the popularity/movieId tie-break and min_similarity."""
+    movies = pd.concat(
+        [
+            sample_movies,
+            pd.DataFrame(
+                {
+                    "movieId": [6, 7],
+                    "title": ["Matrix", "Matrix"],
+                    "genres": ["Action", "Action"],
+                    "clean_title": ["Matrix", "Matrix"],
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    movies["popularity"] = [0, 0, 0, 0, 0, 1, 5]
+    vectorizer, tfidf = initialize_vectorizer(movies)
+    for matrix in (tfidf, TitleIndex(tfidf)):
+        results = search_movies("Matrix", movies, vectorizer, matrix, k=3)
+        assert results["movieId"].tolist()[:2] == [7, 6]  # exact matches, by popularity
+        assert results["score"].is_monotonic_decreasing
+        strict = search_movies(
+            "Matrix", movies, vectorizer, matrix, min_similarity=0.99
+        )
+        assert strict["movieId"].tolist() == [7, 6]
+        assert search_movies("Casablanca", movies, vectorizer, matrix).empty
+
+
+def test_persisted_vectorizer(tmp_path, sample_movies):
+    """Test that the persisted vectorizer artifact transforms like a fresh fit."""
+    movies_path = tmp_path / "movies.csv"
+    sample_movies[["movieId", "title", "genres"]].to_csv(movies_path, index=False)
+    movies = load_movies(movies_path)
+    expected_vectorizer, expected_tfidf = initialize_vectorizer(movies)
+
+    load_vectorizer(movies_path, movies)
+    vectorizer, tfidf = load_vectorizer(movies_path)  # served from the artifact
+    assert not tfidf.data.flags.writeable  # memory-mapped read-only
+    assert abs(tfidf - expected_tfidf).max() < 1e-12
+    query = ["the matrix reloaded"]
+    assert (
+        abs(vectorizer.transform(query) - expected_vectorizer.transform(query)).max()
+        < 1e-12
+    )
+
+
+def test_synthetic_data_is_deterministic():
+    """Test that the benchmark generator is reproducible and MovieLens-shaped."""
+    movies = generate_movies(200, seed=3)
+    assert movies.equals(generate_movies(200, seed=3))
+    assert movies["movieId"].is_unique
+    chunks = list(generate_ratings(movies["movieId"], 5000, seed=3, chunk_size=2000))
+    again = list(generate_ratings(movies["movieId"], 5000, seed=3, chunk_size=2000))
+    assert [len(chunk) for chunk in chunks] == [2000, 2000, 1000]
+    assert all(a.equals(b) for a, b in zip(chunks, again))
+    ratings = pd.concat(chunks)
+    assert ratings["movieId"].isin(movies["movieId"]).all()
+    counts = ratings["movieId"].value_counts()
+    assert counts.iloc[0] > 10 * counts.median()  # Zipf-skewed popularity
+
+
+def test_benchmark_baseline_comparison():
+    """Test that only metrics slower than the threshold are reported, like for like."""
+    run = {"schema": 3, "config": {"ratings": 1000, "seed": 0}}
+    baseline = run | {"metrics": {"cold_start_s": 1.0, "search": {"p99_ms": 2.0}}}
+    results = run | {"metrics": {"cold_start_s": 1.1, "search": {"p99_ms": 3.0}}}
+    assert compare(results, baseline, threshold=0.25) == [("search.p99_ms", 2.0, 3.0)]
+    # Runs on another dataset or with other metrics are not compared
+    with pytest.raises(ValueError, match="config"):
+        compare(results | {"config": {"ratings": 2000, "seed": 0}}, baseline, 0.25)
+    with pytest.raises(ValueError, match="schema"):
+        compare(results | {"schema": 4}, baseline, 0.25)
+
+
+def test_instrumentation(sample_movies, sample_ratings):
+    """Test per-stage recording when enabled and that nothing is recorded when disabled."""
+    vectorizer, tfidf = initialize_vectorizer(sample_movies)
+    instrumentation.reset()
+    find_similar_movies(1, sample_ratings, sample_movies)
+    assert instrumentation.dump() == {}
+
+    instrumentation.enable(trace_memory=True)
+    try:
+        find_similar_movies(1, sample_ratings, sample_movies)
+        search_movies("Matrix", sample_movies, vectorizer, tfidf)
+    finally:
+        instrumentation.disable()
+    snapshot = instrumentation.dump()
+    assert snapshot["seconds"]["find_similar_movies.similar_users"]["count"] == 1
+    assert snapshot["rows"]["find_similar_movies.similar_users"]["sum"] == 1
+    assert "find_similar_movies.merge" in snapshot["alloc_bytes"]
+    assert set(snapshot["seconds"]) >= {
+        "search_movies.clean",
+        "search_movies.transform",
+        "search_movies.similarity",
+        "search_movies.top_k",
+    }
+    text = instrumentation.render_prometheus()
+    assert "# TYPE recommender_stage_seconds histogram" in text
+    assert 'stage="top_k",le="+Inf"} 1' in text
+    instrumentation.reset()
+
+
+def test_sharded_ratings_index_matches_serial(sample_movies):
+    """Test that sharded counting across a process pool gives bit-identical scores."""
+    ratings = pd.concat(generate_ratings(range(1, 41), 5000, n_users=300, seed=3))
+    index = RatingsIndex.from_ratings(ratings)
+    with ShardedRatingsIndex(index, workers=2, min_parallel_rows=0) as sharded:
+        assert len(sharded.shard_bounds) == 3
+        for movie_id in (1, 2, 7, 99):
+            expected_ids, expected_scores = index.score_movie(movie_id)
+            ids, scores = sharded.score_movie(movie_id)
+            assert np.array_equal(ids, expected_ids)
+            assert np.array_equal(scores, expected_scores)
+        pd.testing.assert_frame_equal(
+            find_similar_movies(1, sharded, sample_movies),
+            find_similar_movies(1, index, sample_movies),
+        )
+
+    # The model wraps its ratings index when asked for shards, also after compaction
+    model = RecommenderModel.from_data(sample_movies, index, shards=2)
+    assert isinstance(model.ratings, ShardedRatingsIndex)
+    assert model.ratings.workers == 2
+    pd.testing.assert_frame_equal(
+        model.recommend(1),
+        RecommenderModel.from_data(sample_movies, index).recommend(1),
+    )
+    model.compact()
+    assert isinstance(model.ratings, ShardedRatingsIndex)
+    model.ratings.close()
+
+
+def test_incremental_rating_updates(sample_movies):
+    """Test that applied ratings match a rebuild and only drop affected results."""
+    ratings = pd.DataFrame(
+        {
+            "userId": [1, 1, 1, 2, 2, 3, 3, 3, 4, 4, 5],
+            "movieId": [1, 2, 3, 1, 2, 1, 4, 5, 2, 3, 5],
+            "rating": [5, 4.5, 5, 4.5, 5, 5, 5, 3, 5, 5, 5],
+        }
+    )
+    model = RecommenderModel.from_data(
+        sample_movies, RatingsIndex.from_ratings(ratings)
+    )
+    model.recommend(1)
+    model.recommend(4)
+    model.recommend(5)
+
+    # Only movie 3 changes: movie 1 has it as a candidate, user 5 is a fan of movie 5
+    first = pd.DataFrame({"userId": [5], "movieId": [3], "rating": [5]})
+    assert model.apply_ratings(first) == 1
+    assert set(model.recommend_cache._entries) == {4}
+
+    # User 6 is new, user 3 now likes movie 5 and no longer likes movie 4
+    second = pd.DataFrame(
+        {"userId": [6, 6, 3, 3], "movieId": [2, 5, 5, 4], "rating": [5, 5, 5, 1]}
+    )
+    assert model.apply_ratings(second) == 3
+    assert model.ratings.pending == 5
+    updates = pd.concat([first, second])
+    expected = RatingsIndex.from_ratings(
+        pd.concat([ratings, updates]).drop_duplicates(
+            ["userId", "movieId"], keep="last"
+        )
+    )
+    for movie_id in range(1, 6):
+        ids, scores = model.ratings.score_movie(movie_id)
+        expected_ids, expected_scores = expected.score_movie(movie_id)
+        assert ids.tolist() == expected_ids.tolist()
+        assert scores.tolist() == expected_scores.tolist()
+    assert (
+        model.movies["popularity"].tolist()
+        == expected.popularity([1, 2, 3, 4, 5]).tolist()
+    )
+
+    # Precomputed rows and the results cached from them go stale when any
+    # candidate's fans change, not only the top N
+    movies = generate_movies(60, seed=9)
+    ratings = pd.concat(generate_ratings(movies["movieId"], 4000, n_users=200, seed=9))
+    ratings = ratings.drop_duplicates(["userId", "movieId"], keep="last")
+    index = RatingsIndex.from_ratings(ratings)
+    served = RecommenderModel.from_data(
+        movies.assign(clean_title=movies["title"]),
+        index,
+        table=precompute_recommendations(index, workers=1),
+    )
+    # A candidate just below the stored top N rises when the users who like it
+    # but not the seed stop liking it, which leaves the seed's liked movies alone
+    top_n = served.table.top_n
+    seed = next(
+        movie_id
+        for movie_id in movies["movieId"].tolist()
+        if len(served.ratings.score_movie(movie_id)[0]) > top_n
+    )
+    served.recommend(seed)
+    candidate = int(served.ratings.score_movie(seed)[0][top_n])
+    fans = set(served.ratings.similar_users(seed).tolist())
+    others = [
+        user
+        for user in served.ratings.similar_users(candidate).tolist()
+        if user not in fans
+    ]
+    batch = pd.DataFrame({"userId": others, "movieId": candidate, "rating": 1.0})
+    served.apply_ratings(batch)
+    assert candidate in served.ratings.score_movie(seed)[0][:top_n]
+    assert served.recommend(seed)["score"].tolist() == pytest.approx(
+        served.ratings.score_movie(seed)[1][:10].tolist()
+    )
+    ratings = pd.concat([ratings, batch]).drop_duplicates(
+        ["userId", "movieId"], keep="last"
+    )
+    rng = np.random.default_rng(9)
+    for _ in range(3):
+        batch = pd.DataFrame(
+            {
+                "userId": rng.integers(1, 220, 20),
+                "movieId": rng.choice(movies["movieId"], 20),
+                "rating": rng.choice([1.0, 5.0], 20),
+            }
+        ).drop_duplicates(["userId", "movieId"], keep="last")
+        for movie_id in movies["movieId"]:
+            served.recommend(movie_id)
+        served.apply_ratings(batch)
+        ratings = pd.concat([ratings, batch]).drop_duplicates(
+            ["userId", "movieId"], keep="last"
+        )
+
+    fresh = RecommenderModel.from_data(
+        movies.assign(clean_title=movies["title"]), RatingsIndex.from_ratings(ratings)
+    )
+    for movie_id in movies["movieId"]:
+        assert served.recommend(movie_id)["score"].tolist() == pytest.approx(
+            fresh.recommend(movie_id)["score"].tolist()
+        )
+
+    compacted = model.ratings.compact()
+    assert compacted.pending == 0
+    assert compacted.user_ids.tolist() == expected.user_ids.tolist()
+    assert (compacted.user_movies != expected.user_movies).nnz == 0
+    assert (compacted.user_rated != expected.user_rated).nnz == 0
+
+    cache = LRUCache()
+    cache.set("a", 1, tags=[1, 2])
+    cache.set("b", 2, tags=[3])
+    assert cache.invalidate(tags=[2]) == 1
+    assert cache.get("a", None) is None
+    assert cache.get("b") == 2
+
+
+def test_add_movies_without_refit(sample_movies, sample_ratings):
+    """Test that appended titles are searchable and earlier snapshots are untouched."""
+    vectorizer, tfidf = initialize_vectorizer(sample_movies)
+    new_titles = ["matrix resurrections", "amelie"]
+    extended, matrix, new_terms = append_titles(vectorizer, tfidf, new_titles)
+    assert matrix.shape == (7, len(extended.vocabulary_))
+    assert new_terms == len(extended.vocabulary_) - len(vectorizer.vocabulary_) == 3
+    assert "amelie" not in vectorizer.vocabulary_
+    assert (matrix[:5, : tfidf.shape[1]] != tfidf).nnz == 0
+
+    model = RecommenderModel.from_data(sample_movies, sample_ratings, refit_fraction=1)
+    before = model.search("Matrix")
+    snapshot = model._catalogue
+    model.add_movies(
+        pd.DataFrame(
+            {
+                "movieId": [6, 7],
+                "title": ["Matrix Resurrections", "Amélie"],
+                "genres": ["Action", "Romance"],
+            }
+        )
+    )
+    assert model._catalogue[0] is not snapshot[0] and len(snapshot[0]) == 5
+    assert model.search("amelie")["movieId"].tolist() == [7]
+    assert 6 in model.search("Matrix")["movieId"].tolist()
+    assert 6 not in before["movieId"].tolist()
+    with pytest.raises(ValueError):
+        model.add_movies(pd.DataFrame({"movieId": [1], "title": ["x"], "genres": [""]}))
+
+
+def test_async_single_flight_and_shedding(sample_movies, sample_ratings):
+    """Test request coalescing, load shedding, deadlines and the ASGI front end."""
+    model = RecommenderModel.from_data(sample_movies, sample_ratings)
+    calls = []
+    release = threading.Event()
+    recommend = model.recommend
+
+    def slow_recommend(movie_id, mode="exact"):
+        calls.append(movie_id)
+        release.wait(5)
+        return recommend(movie_id, mode)
+
+    model.recommend = slow_recommend
+    service = AsyncRecommender(model, workers=2, max_pending=1, timeout=5)
+
+    async def burst():
+        callers = [asyncio.create_task(service.recommend(1)) for _ in range(20)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(Overloaded):
+            await service.recommend(2)
+        with pytest.raises(TimeoutError):
+            await service.recommend(1, timeout=0.01)
+        release.set()
+        return await asyncio.gather(*callers)
+
+    results = asyncio.run(burst())
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert service.stats() == {
+        "requests": 22,
+        "coalesced": 20,
+        "shed": 1,
+        "timeouts": 1,
+        "pending": 0,
+    }
+    service.close()
+
+    app = create_asgi_app(model)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/recommend/1"}
+    asyncio.run(app(scope, None, send))
+    assert sent[0]["status"] == 200
+    assert json.loads(sent[1]["body"])["movieId"] == 1
+    app.service.close()
+
+
+def test_item_embeddings_ann_mode(tmp_path):
+    """Test the embedding neighbours, their persistence and the 'ann' mode."""
+    movies = generate_movies(300, seed=4)
+    ratings = pd.concat(generate_ratings(movies["movieId"], 20000, seed=4))
+    index = RatingsIndex.from_ratings(ratings)
+    embeddings = ItemEmbeddings.from_index(index, dim=16, n_lists=8)
+    assert embeddings.vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(embeddings.vectors, axis=1), 1, atol=1e-5)
+    assert embeddings.list_offsets[-1] == len(embeddings.movie_ids)
+
+    seed = int(index.movie_ids[np.argmax(index.movie_counts)])
+    ids, scores = embeddings.neighbors(seed, k=10, n_probe=8)
+    brute = (
+        embeddings.vectors @ embeddings.vectors[np.searchsorted(index.movie_ids, seed)]
+    )
+    assert ids[0] == seed and len(ids) == 10
+    assert np.allclose(scores, np.sort(brute)[::-1][:10], atol=1e-5)
+    assert len(embeddings.neighbors(-1)[0]) == 0
+
+    embeddings.save(tmp_path / "embeddings.npz")
+    loaded = ItemEmbeddings.load(tmp_path / "embeddings.npz")
+    assert np.array_equal(loaded.neighbors(seed)[0], embeddings.neighbors(seed)[0])
+
+    report = recall_report(index, embeddings, index.movie_ids[:20], n_probe=8)
+    assert report["recall_vs_exhaustive"] == 1.0
+    assert 0 <= report["recall_vs_exact"] <= 1
+
+    results = find_similar_movies(
+        seed, index, movies, mode="ann", embeddings=embeddings
+    )
+    assert results["score"].tolist() == pytest.approx(scores.tolist())
+    with pytest.raises(ValueError):
+        find_similar_movies(seed, index, movies, mode="ann")
+    with pytest.raises(ValueError):
+        find_similar_movies(seed, index, movies, mode="fast")
+
+
+def test_scoring_knobs():
+    """Test the thresholds, minimum support and deterministic similar-user sampling."""
+    movies = generate_movies(200, seed=5)
+    ratings = pd.concat(generate_ratings(movies["movieId"], 20000, seed=5))
+    index = RatingsIndex.from_ratings(ratings)
+    seed = int(index.movie_ids[np.argmax(index.movie_counts)])
+
+    sample = reservoir_sample(np.arange(1000), 50, seed=(0, seed))
+    assert len(np.unique(sample)) == 50
+    assert np.array_equal(sample, reservoir_sample(np.arange(1000), 50, (0, seed)))
+    assert len(reservoir_sample(np.arange(10), 50)) == 10
+
+    # The sample is the same from the DataFrame and from the index
+    knobs = {"max_similar_users": 50, "min_support": 3}
+    expected = find_similar_movies(seed, ratings, movies, **knobs)
+    result = find_similar_movies(seed, index, movies, **knobs)
+    assert result["score"].tolist() == pytest.approx(expected["score"].tolist())
+    ids, scores = index.score_movie(seed, **knobs)
+    assert result["score"].tolist() == pytest.approx(scores[:10].tolist())
+    reseeded = index.score_movie(seed, max_similar_users=50, sample_seed=1)[0]
+    assert (
+        reseeded.tolist() != index.score_movie(seed, max_similar_users=50)[0].tolist()
+    )
+
+    # Every candidate is backed by at least min_support similar users
+    similar = get_similar_users(seed, index)
+    counts = index.similar_user_counts(similar)
+    strict_ids = index.score_movie(seed, min_support=30)[0]
+    assert (counts[strict_ids] >= 30).all()
+    assert len(strict_ids) < len(index.score_movie(seed)[0])
+
+    # A cap above the number of similar users changes nothing
+    exact_ids = index.score_movie(seed)[0]
+    uncapped = index.score_movie(seed, max_similar_users=len(similar))[0]
+    assert uncapped.tolist() == exact_ids.tolist()
+    overlap = len(np.intersect1d(exact_ids[:10], ids[:10])) / 10
+    assert 0 <= overlap <= 1
+
+    looser = find_similar_movies(seed, ratings, movies, min_rating=3.0)
+    assert not looser.equals(find_similar_movies(seed, ratings, movies))
+    with pytest.raises(ValueError):
+        find_similar_movies(seed, index, movies, min_rating=3.0)
+    popularity = add_popularity(movies, ratings)["popularity"]
+    assert popularity.tolist() == add_popularity(movies, index)["popularity"].tolist()
+    looser = add_popularity(movies, ratings, min_rating=3.0)["popularity"]
+    assert (looser >= popularity).all() and (looser > popularity).any()
+    with pytest.raises(ValueError):
+        add_popularity(movies, index, min_rating=3.0)
+
+    cache = LRUCache()
+    find_similar_movies(seed, index, movies, cache=cache)
+    find_similar_movies(seed, index, movies, cache=cache, max_similar_users=50)
+    assert set(cache._entries) == {seed, (seed, ("max_similar_users", 50))}
+    assert cache.invalidate(tags=[("seed", seed)]) == 2
+
+
+def test_movie_catalog_hydration(sample_movies, sample_ratings):
+    """Test that catalog hydration matches the DataFrame merge."""
+    catalog = MovieCatalog.from_movies(sample_movies.iloc[::-1])
+    assert catalog.movie_ids.tolist() == [1, 2, 3, 4, 5]
+    assert catalog.movie_ids.dtype == np.int32
+    assert catalog.codes([5, 1, 42]).tolist() == [4, 0, -1]
+    assert 3 in catalog and 42 not in catalog
+    assert catalog.genres.tolist() == sample_movies["genres"].tolist()
+
+    index = RatingsIndex.from_ratings(sample_ratings)
+    expected = find_similar_movies(1, index, sample_movies)
+    result = find_similar_movies(1, index, catalog)
+    assert result.to_dict("records") == expected.to_dict("records")
+    hydrated = catalog.hydrate([4, 42, 2], [3.0, 2.0, 1.0])
+    assert hydrated["title"].tolist() == ["Inception", "Matrix Reloaded"]
+    assert hydrated["score"].tolist() == [3.0, 1.0]
+
+    extended = catalog.extend(
+        pd.DataFrame({"movieId": [0], "title": ["Up"], "genres": ["Animation"]})
+    )
+    assert extended.movie_ids.tolist() == [0, 1, 2, 3, 4, 5] and len(catalog) == 5
+    assert extended.hydrate([0], [1.0])["genres"].tolist() == ["Animation"]
+
+
+def test_fuzzy_title_search(sample_movies, sample_ratings):
+    """Test trigram matching, prefix autocomplete and their use in title search."""
+    rows, codes = trigram_codes(["ab cd", "x"])
+    trigrams = [bytes([c >> 16, (c >> 8) & 255, c & 255]).decode() for c in codes]
+    assert sorted(zip(rows.tolist(), trigrams)) == [
+        (0, " ab"),
+        (0, " cd"),
+        (0, "ab "),
+        (0, "cd "),
+        (1, " x "),
+    ]
+
+    movies = sample_movies.assign(clean_title=clean_titles(sample_movies["title"]))
+    index = FuzzyTitleIndex(movies["clean_title"].tolist())
+    rows, scores = index.scores("matrx")
+    assert set(rows.tolist()) >= {0, 1} and scores.max() < 1
+    assert index.prefix_rows("the").tolist() == [0, 2]
+    popularity = np.array([1, 5, 9, 0, 0])
+    rows, scores = index.autocomplete("the", k=2, popularity=popularity)
+    assert rows.tolist() == [2, 0] and scores.tolist() == [1, 1]
+    rows, _ = index.autocomplete("interstelar", k=1)
+    assert rows.tolist() == [4]
+
+    extended = index.extend(["the godfather", "alien"])
+    rebuilt = FuzzyTitleIndex(
+        movies["clean_title"].tolist() + ["the godfather", "alien"]
+    )
+    assert extended.sorted_titles == rebuilt.sorted_titles
+    assert np.array_equal(extended.sorted_rows, rebuilt.sorted_rows)
+    assert (extended.postings != rebuilt.postings).nnz == 0
+    assert extended.prefix_rows("the g").tolist() == [5] and len(index) == 5
+
+    vectorizer, tfidf = initialize_vectorizer(movies)
+    assert search_movies("matrx", movies, vectorizer, tfidf, min_similarity=0.2).empty
+    results = search_movies(
+        "matrx", movies, vectorizer, tfidf, min_similarity=0.2, fuzzy=index
+    )
+    assert results["movieId"].tolist()[:2] == [1, 2]
+
+    model = RecommenderModel.from_data(movies, sample_ratings)
+    client = create_app(model).test_client()
+    response = client.get("/autocomplete?q=Incep")
+    assert response.get_json()["results"][0]["title"] == "Inception"
+    assert client.get("/autocomplete").status_code == 400
+    for k in ("0", "-1", "ten"):
+        assert client.get(f"/autocomplete?q=Incep&k={k}").status_code == 400
+    response = client.get("/search?q=notebok&fuzzy=1")
+    assert response.get_json()["results"][0]["movieId"] == 3
+
+
+def test_filtered_recommendations():
+    """Test that genre and year filters fill the top k with unfiltered scores."""
+    movies = generate_movies(300, seed=6)
+    ratings = pd.concat(generate_ratings(movies["movieId"], 30000, seed=6))
+    index = RatingsIndex.from_ratings(ratings)
+    catalog = MovieCatalog.from_movies(movies)
+    assert "Sci-Fi" in catalog.genres_vocabulary
+    seed = int(index.movie_ids[np.argmax(index.movie_counts)])
+    years = movies["title"].str.extract(r"\((\d{4})\)$")[0].astype(int)
+    wanted = set(
+        movies.loc[
+            movies["genres"].str.contains("Drama|Horror") & (years >= 1980), "title"
+        ]
+    )
+
+    everything = find_similar_movies(seed, index, catalog, k=1000)
+    expected = everything[everything["title"].isin(wanted)].head(5)
+    result = find_similar_movies(
+        seed, index, catalog, k=5, genres=["drama", "Horror"], min_year=1980
+    )
+    assert len(expected) == 5 and len(result) == 5
+    assert result["title"].tolist() == expected["title"].tolist()
+    assert result["score"].tolist() == expected["score"].tolist()
+    dataframe = find_similar_movies(
+        seed, index, movies, k=5, genres=["Drama", "Horror"], min_year=1980
+    )
+    assert dataframe["title"].tolist() == result["title"].tolist()
+    assert len(find_similar_movies(seed, index, catalog, k=25)) == 25
+    with pytest.raises(ValueError):
+        find_similar_movies(seed, index, catalog, genres=["Space Opera"])
+
+    # Filtered requests are served from the precomputed row when it holds k
+    # matches, the doubled scores tell the stored row from a live computation
+    table = precompute_recommendations(index, movie_ids=[seed], top_n=50, workers=1)
+    doubled = RecommendationTable(table.movie_ids, table.rec_ids, table.scores * 2)
+    options = {"k": 5, "genres": ["drama", "Horror"], "min_year": 1980}
+    served = find_similar_movies(seed, index, catalog, doubled, **options)
+    assert served["title"].tolist() == result["title"].tolist()
+    assert served["score"].tolist() == [2 * score for score in result["score"]]
+    # ...and scored live when the filters leave fewer than k of the stored movies
+    filtered = find_similar_movies(seed, index, catalog, doubled, genres=["Western"])
+    assert filtered.equals(
+        find_similar_movies(seed, index, catalog, genres=["Western"])
+    )
+    assert recommender_utils._catalog_of(movies) is recommender_utils._catalog_of(
+        movies
+    )
+
+    embeddings = ItemEmbeddings.from_index(index, dim=8, n_lists=4)
+    ann = find_similar_movies(
+        seed, index, catalog, mode="ann", embeddings=embeddings, max_year=1990
+    )
+    assert len(ann) == 10
+    assert (ann["title"].str.extract(r"\((\d{4})\)$")[0].astype(int) <= 1990).all()
+
+    model = RecommenderModel.from_data(
+        movies.assign(clean_title=movies["title"]), index
+    )
+    client = create_app(model).test_client()
+    response = client.get(f"/recommend/{seed}?genres=Drama,Horror&min_year=1980&k=5")
+    titles = [r["title"] for r in response.get_json()["results"]]
+    assert titles == result["title"].tolist()
+    assert client.get(f"/recommend/{seed}?genres=Nope").status_code == 400
+    assert client.get(f"/recommend/{seed}?k=ten").status_code == 400
+
+
+def test_recommend_for_user():
+    """Test that user recommendations pool the fans of every liked movie."""
+    movies = generate_movies(300, seed=7)
+    ratings = pd.concat(
+        generate_ratings(movies["movieId"], 30000, n_users=3000, seed=7)
+    )
+    index = RatingsIndex.from_ratings(ratings)
+    catalog = MovieCatalog.from_movies(movies)
+    user = int(
+        index.user_ids[np.flatnonzero(np.diff(index.user_movies.indptr) == 5)[0]]
+    )
+    liked = index.liked_movies(user)
+    expected = ratings.loc[
+        (ratings["userId"] == user) & (ratings["rating"] > 4), "movieId"
+    ]
+    assert liked.tolist() == sorted(expected.unique().tolist())
+    assert set(index.similar_users_of(liked[:2])) == set(
+        index.similar_users(liked[0])
+    ) | set(index.similar_users(liked[1]))
+
+    # Five pooled fan sets are much wider than one, hence the lower share
+    knobs = {"min_similar_share": 0.02}
+    result = recommend_for_user(user, index, catalog, **knobs)
+    assert len(result) == 10
+    assert result["score"].is_monotonic_decreasing
+    by_list = recommend_for_user(liked.tolist(), index, catalog, **knobs)
+    listed = recommend_for_user(liked.tolist(), ratings, movies, **knobs)
+    assert listed["score"].tolist() == by_list["score"].tolist()
+
+    # From a user ID, every rated movie counts as seen, whatever the rating
+    rated = ratings.loc[ratings["userId"] == user, "movieId"]
+    assert index.rated_movies(user).tolist() == sorted(rated.unique().tolist())
+    seen = catalog.titles[catalog.codes(rated)]
+    assert not set(result["title"]) & set(seen)
+    dataframe = recommend_for_user(user, ratings, movies, **knobs)
+    assert dataframe["score"].tolist() == result["score"].tolist()
+
+    # A low rating of the top movie hides it without making it a liked movie
+    top = int(movies.loc[movies["title"] == result["title"].iloc[0], "movieId"].iloc[0])
+    low = pd.DataFrame({"userId": [user], "movieId": [top], "rating": [1.0]})
+    updated = RatingsIndex.from_ratings(ratings)
+    updated.apply_ratings(low)
+    assert top in updated.rated_movies(user) and top not in updated.liked_movies(user)
+    for rerated in (updated, updated.compact()):
+        hidden = recommend_for_user(user, rerated, catalog, **knobs)
+        assert result["title"].iloc[0] not in set(hidden["title"])
+        assert hidden["score"].tolist()[:9] == result["score"].tolist()[1:10]
+
+    assert recommend_for_user(-1, index, catalog).empty
+    sampled = recommend_for_user(user, index, catalog, max_similar_users=50, **knobs)
+    assert sampled.equals(
+        recommend_for_user(user, index, catalog, max_similar_users=50, **knobs)
+    )
+    filtered = recommend_for_user(user, index, catalog, k=5, min_year=1980, **knobs)
+    assert len(filtered) == 5
+
+    model = RecommenderModel.from_data(
+        movies.assign(clean_title=movies["title"]), index
+    )
+    client = create_app(model).test_client()
+    response = client.get(f"/recommend/user/{user}")
+    titles = [r["title"] for r in response.get_json()["results"]]
+    assert titles == recommend_for_user(user, index, catalog)["title"].tolist()
+    assert client.get(f"/recommend/user/{user}?genres=Nope").status_code == 400
+
+
+def test_batch_resumes_after_interruption(tmp_path, monkeypatch):
+    """Test that a killed batch job resumes after its last written batch."""
+    movies = generate_movies(200, seed=8)
+    index = RatingsIndex.from_ratings(
+        pd.concat(generate_ratings(movies["movieId"], 20000, seed=8))
+    )
+    model = RecommenderModel.from_data(
+        movies.assign(clean_title=movies["title"]), index
+    )
+    lines = [f"{movie_id}\n" for movie_id in movies["movieId"]] + ["\n", "oops\n"]
+
+    def killed(lines):
+        for number, line in enumerate(lines):
+            if number == 130:
+                raise KeyboardInterrupt
+            yield line
+
+    output = tmp_path / "recommendations.jsonl"
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(
+            "recommend", killed(lines), output, model, batch_size=50, workers=1, k=5
+        )
+    assert len(output.read_text().splitlines()) == 100
+    assert run_batch("recommend", lines, output, model, batch_size=50, k=5) == 101
+    assert not os.path.exists(f"{output}.checkpoint")
+
+    fresh = tmp_path / "fresh.jsonl"
+    assert run_batch("recommend", lines, fresh, model, k=5, workers=2) == 201
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert records == [json.loads(line) for line in fresh.read_text().splitlines()]
+    assert records[-1] == {"movieId": "oops", "error": "invalid movieId 'oops'"}
+    first = model.recommend(int(movies["movieId"][0]), k=5)
+    assert records[0]["results"] == json.loads(first.to_json(orient="records"))
+
+    # Parquet output keeps one row per error, without mixing input strings into IDs
+    rows = _parquet_rows(records[-3:])
+    assert [row["rank"] for row in rows[-5:-1]] == [2, 3, 4, 5]
+    assert rows[-1] == {
+        "movieId": None,
+        "error": "invalid movieId 'oops'",
+        "rank": None,
+    }
+    unknown = {"movieId": 99999, "error": "unknown movieId 99999"}
+    assert _parquet_rows([unknown]) == [unknown | {"rank": None}]
+
+    # A query the search rejects gets an error record instead of stopping the job
+    def search(query, fuzzy=False):
+        raise ValueError(f"bad query {query!r}")
+
+    monkeypatch.setattr(model, "search", search)
+    queries = tmp_path / "queries.jsonl"
+    assert run_batch("search", ["matrx\n"], queries, model, workers=1) == 1
+    assert json.loads(queries.read_text()) == {
+        "query": "matrx",
+        "error": "bad query 'matrx'",
+    }
+
+
+def test_staged_loading(tmp_path, monkeypatch, sample_movies, sample_ratings):
+    """Test that search is served while the ratings load, and recommend waits."""
+    movies_path = tmp_path / "movies.csv"
+    ratings_path = tmp_path / "ratings.csv"
+    sample_movies[["movieId", "title", "genres"]].to_csv(movies_path, index=False)
+    sample_ratings.assign(timestamp=0).to_csv(ratings_path, index=False)
+    release = threading.Event()
+    load_ratings_index = recommender_model.load_ratings_index
+
+    def slow_load_ratings_index(filepath):
+        release.wait(5)
+        return load_ratings_index(filepath)
+
+    monkeypatch.setattr(
+        recommender_model, "load_ratings_index", slow_load_ratings_index
+    )
+    model = RecommenderModel(movies_path, ratings_path, None, None)
+    thread = model.load_async()
+    client = create_app(model).test_client()
+    assert model.search("Matrix")["title"].iloc[0] == "The Matrix"
+    assert model.search_ready and not model.ready
+    assert client.get("/search?q=Matrix").status_code == 200
+    assert client.get("/recommend/1").status_code == 503
+
+    # Movies added before the ratings are loaded get their popularity afterwards
+    model.add_movies(
+        pd.DataFrame({"movieId": [6], "title": ["Matrix 4"], "genres": ["Action"]})
+    )
+    assert model.movies["popularity"].tolist() == [0] * 6
+
+    recommendations = []
+    waiting = threading.Thread(
+        target=lambda: recommendations.append(model.recommend(1))
+    )
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive() and not recommendations
+    release.set()
+    waiting.join(5)
+    thread.join(5)
+    assert model.ready and len(recommendations) == 1
+    expected = RecommenderModel.from_data(sample_movies, sample_ratings).recommend(1)
+    assert recommendations[0]["title"].tolist() == expected["title"].tolist()
+    assert model.movies["popularity"].tolist() == [1, 1, 0, 0, 0, 0]
+
+    failed = RecommenderModel(movies_path, tmp_path / "missing.csv", None, None)
+    failed.load_async().join(5)
+    assert not failed.search_ready and not failed.ready
+    with pytest.raises(FileNotFoundError):
+        failed.recommend(1)
+
+    # Heavy modules are only imported once a vectorizer is needed
+    code = "import sys, main; assert 'sklearn' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.getcwd())
+
+
 if __name__ == "__main__":
     print("Running tests with sample movie recommendation system data...")
 